@@ -14,24 +14,24 @@ load_dotenv(dotenv_path=dotenv_path)
 import logging
 logging.basicConfig(level=logging.INFO)
 
-from flask import Flask, request, jsonify, render_template, send_from_directory, redirect, url_for, flash, session, abort
+from flask import Flask, request, jsonify, render_template, send_from_directory, redirect, url_for, flash, session, abort, Response, stream_with_context
 import google.generativeai as genai
 from flask_cors import CORS
 import base64
-import re
 import random
-from io import BytesIO
-from PIL import Image
+import math
 import json
-import requests # Added for external API calls
+import copy
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
-from firebase_config import initialize_firebase, get_user_data, save_user_data, get_chat_history, save_chat_history, get_todo_list, save_todo_list
+from firebase_config import initialize_firebase, get_db, get_user_data, save_user_data, get_chat_history, save_chat_history
 from firebase_admin import firestore, auth as firebase_admin_auth
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import uuid
 from flask_socketio import SocketIO, join_room, leave_room, emit, disconnect
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 import time
 import traceback
 from agora_token_builder import RtcTokenBuilder
@@ -39,6 +39,25 @@ from groq import Groq
 
 # Gamification Logic
 import gamification_logic
+import metrics
+from room_timers import RoomTimerScheduler
+from leaderboard import LeaderboardService, LEADERBOARD_FIELDS
+import inspire_content
+from conversation_memory import ConversationMemory
+from response_formatting import format_response, StreamingResponseFormatter
+from question_intent import classify_question
+from image_preprocessing import ImagePreprocessor
+from response_cache import ResponseCache
+from llm_executor import LLMExecutor, LLMUnavailable
+from room_message_writer import RoomMessageWriter
+from room_registry import RoomRegistry
+from room_deletion import RoomDeleter
+import page_cursor
+from room_sweeper import FirestoreLease, backfill_empty_since, find_empty_rooms
+import todo_store
+import session_history
+import study_stats
+from todo_archive import TodoArchiver, archive_page, is_expired
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)  # Enable CORS for all routes
@@ -86,6 +105,16 @@ except Exception as e:
     print(f"Error initializing Firebase: {e}")
     raise
 
+# Gamification config is cached in-process; GAMIFICATION_CONFIG_TTL tunes expiry and
+# GAMIFICATION_CONFIG_LISTENER=1 keeps it current through a Firestore snapshot listener instead.
+gamification_logic.gamification_config_provider.ttl_seconds = int(os.environ.get('GAMIFICATION_CONFIG_TTL', 300))
+if os.environ.get('GAMIFICATION_CONFIG_LISTENER') == '1':
+    try:
+        gamification_logic.gamification_config_provider.start_listener(db)
+        print("Gamification config listener started")
+    except Exception as e:
+        print(f"Error starting gamification config listener, falling back to TTL cache: {e}")
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -273,9 +302,8 @@ def get_user_progress():
     try:
         user_id = session['user_id']
         user_data = get_user_data(user_id)
-        db_client = initialize_firebase() # Ensure db client is available
-        gamification_settings_doc = gamification_logic.get_gamification_config_ref(db_client).get()
-        gamification_settings = gamification_settings_doc.to_dict() if gamification_settings_doc.exists else {}
+        db_client = get_db()
+        gamification_settings = gamification_logic.get_gamification_settings(db_client)
 
         if not user_data:
             is_new_google_user = False
@@ -306,7 +334,8 @@ def get_user_progress():
                  }
                  gamification_logic.assign_new_quests(user_data['progress'], gamification_settings)
                  gamification_logic.update_leaderboard_data(user_data) # ensure leaderboard data is consistent
-                 save_user_data(user_id, user_data)
+                 if save_user_data(user_id, user_data):
+                     leaderboard_service.record(user_id, user_data['leaderboardData'])
             else:
                  # This case implies not a new Google user, but still no user_data found initially.
                  # This might be a regular new user or an edge case.
@@ -331,26 +360,14 @@ def get_user_progress():
                  gamification_logic.update_leaderboard_data(user_data)
                  # save_user_data(user_id, user_data) # Decided not to save here, GET should not always write for non-existent.
         else:
-            # Ensure all gamification fields exist for existing user_data
-            user_data['progress'].setdefault('level', 1)
-            user_data['progress'].setdefault('xp', 0)
-            user_data['progress'].setdefault('total_time', 0)
-            user_data['progress'].setdefault('streak', 0)
-            user_data['progress'].setdefault('sessions', 0)
-            
-            # Ensure badges is an array of strings (badge IDs)
-            current_badges = user_data['progress'].get('badges')
-            if not isinstance(current_badges, list):
-                if isinstance(current_badges, dict): # Old format {'bronze': True, 'silver': False}
-                    user_data['progress']['badges'] = [badge_id for badge_id, earned in current_badges.items() if earned]
-                else: # Unknown format or None, initialize as empty list
-                    user_data['progress']['badges'] = [] 
-            else:
-                 user_data['progress'].setdefault('badges', []) # Ensure it exists if it was None
-
-            user_data['progress'].setdefault('lastStudyDay', None)
-            user_data['progress'].setdefault('activeQuests', [])
-            user_data['progress'].setdefault('completedQuests', [])
+            if not isinstance(user_data.get('progress'), dict):
+                user_data['progress'] = {}
+            # Older documents still carry sessionHistory inline; move it to the session log once
+            if 'sessionHistory' in user_data['progress']:
+                session_history.migrate_legacy_history(user_id)
+
+            # Same normalized view (badge list, defaults, no sessionHistory) the sync paths version
+            gamification_logic.normalize_progress(user_data['progress'])
             
             if 'leaderboardData' not in user_data: # Initialize if missing
                 user_data['leaderboardData'] = {
@@ -360,24 +377,26 @@ def get_user_progress():
                     'level': user_data['progress'].get('level',1)
                 }
 
-            # Assign new quests if needed when user data is fetched
-            newly_assigned_quests = gamification_logic.assign_new_quests(user_data['progress'], gamification_settings)
-            if newly_assigned_quests:
-                 gamification_logic.update_leaderboard_data(user_data) # Update if quests changed anything indirectly
-                 save_user_data(user_id, user_data) # Save if quests were assigned
-
-        # Clean up session history older than 30 days (existing logic)
-        if 'sessionHistory' in user_data.get('progress', {}):
-            thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-            user_data['progress']['sessionHistory'] = [
-                s for s in user_data['progress']['sessionHistory']
-                if s.get('date') and isinstance(s['date'], str) and datetime.fromisoformat(s['date'].replace('Z', '+00:00')) > thirty_days_ago
-            ]
+            # Assign new quests if needed when user data is fetched. Only activeQuests is written, in a
+            # transaction on fresh data, so a session saved meanwhile is never overwritten by this read
+            if gamification_logic.assign_new_quests(copy.deepcopy(user_data['progress']), gamification_settings):
+                active_quests = assign_due_quests(db_client.collection('users').document(user_id), gamification_settings)
+                if active_quests is not None:
+                    user_data['progress']['activeQuests'] = active_quests
+
+        # Version of the normalized progress; the client echoes it on syncs so unchanged ones are skipped
+        version = gamification_logic.progress_version(
+            gamification_logic.normalize_progress(copy.deepcopy(user_data.get('progress', {}))))
+
+        # Latest sessions for the progress panel, read from the session log
+        recent_sessions, _ = session_history.session_page(user_id)
+        user_data.setdefault('progress', {})['sessionHistory'] = recent_sessions
         
         return jsonify({
             'username': user_id, 
             'display_username': user_data.get('username', user_id),
             'progress': user_data.get('progress', {}),
+            'version': version,
             'gamification_settings': { # Send badge definitions for frontend display
                 'badges': gamification_settings.get('badges', {}),
                 'quests': gamification_settings.get('quests', {}),
@@ -390,6 +409,65 @@ def get_user_progress():
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+def assign_due_quests(user_doc_ref, gamification_settings):
+    """
+    Assigns the daily/weekly quests that are due, in a transaction that re-reads
+    the user document and writes only progress.activeQuests. Returns the active
+    quests as stored afterwards (None if the document is gone), so a request that
+    lost the race to another one shows the quests that were actually saved.
+    """
+    @firestore.transactional
+    def assign(transaction):
+        user_doc_snapshot = user_doc_ref.get(transaction=transaction)
+        user_progress = (user_doc_snapshot.to_dict() or {}).get('progress') if user_doc_snapshot.exists else None
+        if not isinstance(user_progress, dict):
+            return None
+        if gamification_logic.assign_new_quests(user_progress, gamification_settings):
+            transaction.update(user_doc_ref, {'progress.activeQuests': user_progress['activeQuests']})
+        return user_progress.get('activeQuests', [])
+
+    return assign(get_db().transaction())
+
+def answer_unchanged_sync(user_doc_ref, client_version, started_at):
+    """
+    Answers an event-less /api/user_data sync from a single read when it would not
+    write anything. Returns None if the document is missing or needs repairs
+    (missing progress fields or stale leaderboardData), so the caller can run the
+    full transactional save instead.
+    """
+    user_doc_snapshot = user_doc_ref.get()
+    if not user_doc_snapshot.exists:
+        return None
+    user_doc_data = user_doc_snapshot.to_dict()
+    if not isinstance(user_doc_data.get('progress'), dict) or not isinstance(user_doc_data.get('leaderboardData'), dict):
+        return None
+
+    stored_progress = dict(user_doc_data['progress'])
+    stored_progress.pop('sessionHistory', None) # Moved to the session log by the next event or GET; never part of the version
+    repaired_progress = gamification_logic.ensure_progress_defaults(copy.deepcopy(stored_progress))
+    expected_document = gamification_logic.update_leaderboard_data({
+        'username': user_doc_data.get('username', 'Anonymous'),
+        'progress': repaired_progress,
+        'leaderboardData': dict(user_doc_data['leaderboardData']),
+    })
+    if gamification_logic.build_progress_update(stored_progress, repaired_progress,
+                                                user_doc_data['leaderboardData'], expected_document['leaderboardData']):
+        return None
+
+    # Versioned exactly like GET /api/user_data, so legacy documents (badge maps, inline
+    # sessionHistory) still match the version the client got from it
+    user_progress = gamification_logic.normalize_progress(repaired_progress)
+    version = gamification_logic.progress_version(user_progress)
+    not_modified = client_version == version
+    metrics.get_metrics('user_data_save').record(
+        time.perf_counter() - started_at, written=0, skipped=1, not_modified=int(not_modified))
+    if not_modified:
+        response = jsonify({'status': 'not_modified', 'version': version}) # The client's copy is current
+    else:
+        response = jsonify({'status': 'success', 'progress': user_progress, 'version': version})
+    response.set_etag(version)
+    return response
+
 @app.route('/api/user_data', methods=['POST'])
 @login_required
 def save_user_progress():
@@ -397,147 +475,213 @@ def save_user_progress():
         user_id = session['user_id']
         client_data_payload = request.json # This is the full object client sends, typically containing a 'progress' field
         
-        db_client = initialize_firebase()
-        user_doc_ref = db_client.collection('users').document(user_id)
-        user_doc_snapshot = user_doc_ref.get()
+        started_at = time.perf_counter()
         
-        # Ensure gamification settings are loaded regardless of user doc existence for now
-        gamification_settings_doc = gamification_logic.get_gamification_config_ref(db_client).get()
-        gamification_settings = gamification_settings_doc.to_dict() if gamification_settings_doc.exists else {}
-
-        if not user_doc_snapshot.exists:
-            # Critical: If user document doesn't exist during a POST to save progress, 
-            # it implies a significant issue or a client trying to save before full initialization.
-            # Do not proceed to create a new document or default progress here.
-            error_msg = f"User document for user_id {user_id} not found during save_user_progress (POST). Aborting save to prevent data loss."
-            print(f"ERROR: {error_msg}")
-            return jsonify({'error': error_msg, 'status': 'error'}), 500 # Or 404 if preferred
-
-        current_user_document_data = user_doc_snapshot.to_dict()
-        
-        # Ensure 'progress' and 'leaderboardData' sub-dictionaries exist if the document itself was found
-        if 'progress' not in current_user_document_data:
-            current_user_document_data['progress'] = {}
-            print(f"WARNING: User {user_id} document existed but 'progress' field was missing. Initialized as empty dict.")
-        
-        if 'leaderboardData' not in current_user_document_data:
-            # Initialize leaderboardData with sensible defaults if it was missing from an existing document
-            progress_for_lb_init = current_user_document_data.get('progress', {})
-            current_user_document_data['leaderboardData'] = {
-                'username': current_user_document_data.get('username', user_id),
-                'totalXp': progress_for_lb_init.get('xp', 0),
-                'currentStreak': progress_for_lb_init.get('streak', 0),
-                'level': progress_for_lb_init.get('level', 1)
-            }
-            print(f"WARNING: User {user_id} document existed but 'leaderboardData' field was missing. Initialized.")
-
-        user_progress = current_user_document_data['progress']
+        db_client = get_db()
+        user_doc_ref = db_client.collection('users').document(user_id)
 
         # Extract progress data from client payload
         client_progress_update = client_data_payload.get('progress', {})
         event_type_from_client = client_data_payload.get('event_type')
         event_data = client_data_payload.get('event_data', {})
 
-        newly_awarded_badges = []
-        leveled_up = False
-        all_completed_quest_titles = []
+        # Syncs without an event never change XP/level/badges, so they are answered from a
+        # plain read and only fall through to the transaction if the document needs repairs.
+        client_version = client_data_payload.get('version') or request.headers.get('If-None-Match', '').strip('"')
+        if not event_type_from_client:
+            sync_response = answer_unchanged_sync(user_doc_ref, client_version, started_at)
+            if sync_response is not None:
+                return sync_response
+
+        wrote_fields = [False] # Set inside the transaction; a list so the closure can assign it
+        # Only the transactional path needs the gamification settings
+        gamification_settings = gamification_logic.get_gamification_settings(db_client)
+
+        # The read-modify-write runs in a transaction so concurrent saves (e.g. two tabs completing
+        # sessions) are retried against fresh data instead of overwriting each other. Only the
+        # progress/leaderboard fields that changed are written back.
+        @firestore.transactional
+        def apply_progress_update(transaction):
+            user_doc_snapshot = user_doc_ref.get(transaction=transaction)
+            if not user_doc_snapshot.exists:
+                return None
+
+            current_user_document_data = user_doc_snapshot.to_dict()
+            
+            # Ensure 'progress' and 'leaderboardData' sub-dictionaries exist if the document itself was found
+            if 'progress' not in current_user_document_data:
+                current_user_document_data['progress'] = {}
+                print(f"WARNING: User {user_id} document existed but 'progress' field was missing. Initialized as empty dict.")
+            
+            if 'leaderboardData' not in current_user_document_data:
+                # Initialize leaderboardData with sensible defaults if it was missing from an existing document
+                progress_for_lb_init = current_user_document_data.get('progress', {})
+                current_user_document_data['leaderboardData'] = {
+                    'username': current_user_document_data.get('username', user_id),
+                    'totalXp': progress_for_lb_init.get('xp', 0),
+                    'currentStreak': progress_for_lb_init.get('streak', 0),
+                    'level': progress_for_lb_init.get('level', 1)
+                }
+                print(f"WARNING: User {user_id} document existed but 'leaderboardData' field was missing. Initialized.")
+
+            user_progress = current_user_document_data['progress']
+            # An inline sessionHistory left from before the session log is moved there with this write
+            legacy_history = user_progress.pop('sessionHistory', None)
+            progress_before = copy.deepcopy(user_progress)
+            gamification_logic.normalize_progress(user_progress) # Old badge maps are rewritten as lists with this save
+            leaderboard_before = copy.deepcopy((user_doc_snapshot.to_dict() or {}).get('leaderboardData', {}))
+
+            newly_awarded_badges = []
+            leveled_up = False
+            session_entry = None
+            all_completed_quest_titles = []
+
+            if event_type_from_client == "session_completed":
+                duration_minutes = event_data.get("duration", 0)
+                if duration_minutes > 0:
+                    # Server calculates XP for this session and adds to existing server XP
+                    xp_earned_this_session = gamification_logic.calculate_xp_for_session(duration_minutes, gamification_settings)
+                    user_progress['xp'] = user_progress.get('xp', 0) + xp_earned_this_session
+                    
+                    # Server updates total time and session count
+                    user_progress['total_time'] = user_progress.get('total_time', 0) + duration_minutes
+                    user_progress['sessions'] = user_progress.get('sessions', 0) + 1
+
+                    # Appended to the session log (and its day/week rollups) in this same transaction
+                    session_entry = {
+                        'type': 'work', 
+                        'duration': duration_minutes,
+                        'date': datetime.now(timezone.utc).isoformat(),
+                        'xp_earned': xp_earned_this_session 
+                    }
+                    session_history.record_sessions(transaction, user_id, [session_entry])
+
+                # Update streak (always do this if a session was completed)
+                gamification_logic.update_study_streak(user_progress)
 
-        if event_type_from_client == "session_completed":
-            duration_minutes = event_data.get("duration", 0)
-            if duration_minutes > 0:
-                # Server calculates XP for this session and adds to existing server XP
-                xp_earned_this_session = gamification_logic.calculate_xp_for_session(duration_minutes, gamification_settings)
-                user_progress['xp'] = user_progress.get('xp', 0) + xp_earned_this_session
+                # Update quest progress based on session completion
+                quest_event_info_session = {'type': 'pomodoro_session_completed', 'value': 1}
+                completed_quests_session = gamification_logic.update_quest_progress(user_progress, gamification_settings, quest_event_info_session)
                 
-                # Server updates total time and session count
-                user_progress['total_time'] = user_progress.get('total_time', 0) + duration_minutes
-                user_progress['sessions'] = user_progress.get('sessions', 0) + 1
+                quest_event_info_time = {'type': 'study_time_added', 'value': duration_minutes}
+                completed_quests_time = gamification_logic.update_quest_progress(user_progress, gamification_settings, quest_event_info_time)
 
-                # Add to session history (server-authoritative part)
-                session_entry = {
-                    'type': 'work', 
-                    'duration': duration_minutes,
-                    'date': datetime.now(timezone.utc).isoformat(),
-                    'xp_earned': xp_earned_this_session 
-                }
-                if 'sessionHistory' not in user_progress or not isinstance(user_progress['sessionHistory'], list):
-                    user_progress['sessionHistory'] = []
-                user_progress['sessionHistory'].append(session_entry)
-                user_progress['sessionHistory'].sort(key=lambda x: x.get('date', ''), reverse=True)
-                user_progress['sessionHistory'] = user_progress['sessionHistory'][:50]
-
-            # Update streak (always do this if a session was completed)
-            gamification_logic.update_study_streak(user_progress)
-
-            # Update quest progress based on session completion
-            quest_event_info_session = {'type': 'pomodoro_session_completed', 'value': 1}
-            completed_quests_session = gamification_logic.update_quest_progress(user_progress, gamification_settings, quest_event_info_session)
-            
-            quest_event_info_time = {'type': 'study_time_added', 'value': duration_minutes}
-            completed_quests_time = gamification_logic.update_quest_progress(user_progress, gamification_settings, quest_event_info_time)
+                all_completed_quest_titles = list(set(completed_quests_session + completed_quests_time))
 
-            all_completed_quest_titles = list(set(completed_quests_session + completed_quests_time))
+                # Check for level up after XP changes from quests or session
+                leveled_up = gamification_logic.check_for_levelup(user_progress, gamification_settings)
 
-            # Check for level up after XP changes from quests or session
-            leveled_up = gamification_logic.check_for_levelup(user_progress, gamification_settings)
+                # Check for badges
+                session_event_info = {
+                    'type': 'session_complete', 
+                    'duration': duration_minutes,
+                    'time_completed_hour_utc': datetime.now(timezone.utc).hour
+                }
+                newly_awarded_badges = gamification_logic.check_and_award_badges(user_progress, gamification_settings, session_event_info)
+            else:
+                # This is a general sync (e.g., from 'beforeunload' or after a break session)
+                # Do NOT update XP, Level, or Badges from client here. Server's values are authoritative.
+                # Log if client attempts to send differing values for debugging.
+                if 'xp' in client_progress_update and client_progress_update['xp'] != user_progress.get('xp'):
+                    print(f"[SYNC_INFO] Client sent XP {client_progress_update['xp']}. Server XP is {user_progress.get('xp')}. Server value preserved.")
+                if 'level' in client_progress_update and client_progress_update['level'] != user_progress.get('level'):
+                    print(f"[SYNC_INFO] Client sent Level {client_progress_update['level']}. Server Level is {user_progress.get('level')}. Server value preserved.")
+                if 'badges' in client_progress_update and set(client_progress_update.get('badges',[])) != set(user_progress.get('badges',[])):
+                     print(f"[SYNC_INFO] Client sent Badges. Server badges preserved.")
+                
+                # Session history is only written by session_completed events (into the session log)
+                if 'sessionHistory' in client_progress_update:
+                    print(f"[SYNC_INFO] Client sent sessionHistory. Server's session log preserved.")
 
-            # Check for badges
-            session_event_info = {
-                'type': 'session_complete', 
-                'duration': duration_minutes,
-                'time_completed_hour_utc': datetime.now(timezone.utc).hour
-            }
-            newly_awarded_badges = gamification_logic.check_and_award_badges(user_progress, gamification_settings, session_event_info)
-        else:
-            # This is a general sync (e.g., from 'beforeunload' or after a break session)
-            # Do NOT update XP, Level, or Badges from client here. Server's values are authoritative.
-            # Log if client attempts to send differing values for debugging.
-            if 'xp' in client_progress_update and client_progress_update['xp'] != user_progress.get('xp'):
-                print(f"[SYNC_INFO] Client sent XP {client_progress_update['xp']}. Server XP is {user_progress.get('xp')}. Server value preserved.")
-            if 'level' in client_progress_update and client_progress_update['level'] != user_progress.get('level'):
-                print(f"[SYNC_INFO] Client sent Level {client_progress_update['level']}. Server Level is {user_progress.get('level')}. Server value preserved.")
-            if 'badges' in client_progress_update and set(client_progress_update.get('badges',[])) != set(user_progress.get('badges',[])):
-                 print(f"[SYNC_INFO] Client sent Badges. Server badges preserved.")
+            # Ensure essential progress fields have default values after merge and logic
+            gamification_logic.ensure_progress_defaults(user_progress)
             
-            # If client sends sessionHistory during a general sync, we might merge it,
-            # but for now, session history is primarily driven by server-side session_completed events.
-            # The client's version of sessionHistory is mostly for UI consistency between full GETs.
-            # Let's ensure the server's sessionHistory isn't overwritten by a potentially stale client one.
-            if 'sessionHistory' in client_progress_update:
-                print(f"[SYNC_INFO] Client sent sessionHistory. Server's sessionHistory preserved.")
-
-        # Ensure essential progress fields have default values after merge and logic
-        user_progress.setdefault('level', 1)
-        user_progress.setdefault('xp', 0)
-        user_progress.setdefault('total_time', 0)
-        user_progress.setdefault('streak', 0)
-        user_progress.setdefault('sessions', 0)
-        user_progress.setdefault('badges', [])
-        user_progress.setdefault('lastStudyDay', None) # 'YYYY-MM-DD'
-        user_progress.setdefault('activeQuests', [])
-        user_progress.setdefault('completedQuests', [])
-        if 'sessionHistory' not in user_progress or not isinstance(user_progress['sessionHistory'], list):
-            user_progress['sessionHistory'] = []
-        
-        current_user_document_data['progress'] = user_progress
-        
-        # Update denormalized leaderboard data
-        gamification_logic.update_leaderboard_data(current_user_document_data)
-        
-        save_user_data(user_id, current_user_document_data) 
-        
-        response_data = {'status': 'success', 'progress': current_user_document_data['progress']}
-        if newly_awarded_badges: response_data['new_badges'] = newly_awarded_badges
-        if leveled_up: response_data['leveled_up_to'] = user_progress['level']
-        if all_completed_quest_titles: response_data['completed_quests'] = all_completed_quest_titles
-        
-        return jsonify(response_data)
+            current_user_document_data['progress'] = user_progress
+            
+            # Update denormalized leaderboard data
+            gamification_logic.update_leaderboard_data(current_user_document_data)
+
+            field_updates = gamification_logic.build_progress_update(
+                progress_before, user_progress,
+                leaderboard_before, current_user_document_data['leaderboardData'])
+            if legacy_history is not None:
+                if isinstance(legacy_history, list):
+                    session_history.record_legacy_history(transaction, user_id, legacy_history)
+                field_updates['progress.sessionHistory'] = firestore.DELETE_FIELD
+            if field_updates:
+                transaction.update(user_doc_ref, field_updates)
+
+            response_data = {'status': 'success', 'progress': user_progress,
+                             'version': gamification_logic.progress_version(user_progress)}
+            wrote_fields[0] = bool(field_updates)
+            if newly_awarded_badges: response_data['new_badges'] = newly_awarded_badges
+            if leveled_up: response_data['leveled_up_to'] = user_progress['level']
+            if all_completed_quest_titles: response_data['completed_quests'] = all_completed_quest_titles
+            if session_entry: response_data['session'] = session_entry # The client adds it to its recent sessions list
+            return response_data, current_user_document_data['leaderboardData']
+
+        response_data, leaderboard_data = apply_progress_update(db_client.transaction()) or (None, None)
+        if response_data is None:
+            # Critical: If user document doesn't exist during a POST to save progress, 
+            # it implies a significant issue or a client trying to save before full initialization.
+            # Do not proceed to create a new document or default progress here.
+            error_msg = f"User document for user_id {user_id} not found during save_user_progress (POST). Aborting save to prevent data loss."
+            print(f"ERROR: {error_msg}")
+            return jsonify({'error': error_msg, 'status': 'error'}), 500 # Or 404 if preferred
+
+        leaderboard_service.record(user_id, leaderboard_data) # Committed; keep in-memory leaderboards current
+        metrics.get_metrics('user_data_save').record(
+            time.perf_counter() - started_at, written=int(wrote_fields[0]), skipped=int(not wrote_fields[0]))
+        response = jsonify(response_data)
+        response.set_etag(response_data['version'])
+        return response
     except Exception as e:
         print(f"Error saving user data for {session.get('user_id')}: {str(e)}")
         import traceback
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+SESSION_HISTORY_MAX_PAGE_SIZE = 100
+
+@app.route('/api/session_history', methods=['GET'])
+@login_required
+def get_user_session_history():
+    """Session log, newest first (?start_after=<next_cursor>, ?limit=), plus today's and this week's totals."""
+    try:
+        user_id = session['user_id'] # Firebase UID
+        limit = min(max(request.args.get('limit', session_history.RECENT_SESSIONS_LIMIT, type=int), 1), SESSION_HISTORY_MAX_PAGE_SIZE)
+        sessions, next_cursor = session_history.session_page(user_id, limit, request.args.get('start_after'))
+        response_data = {'sessions': sessions, 'next_cursor': next_cursor}
+        if not request.args.get('start_after'):
+            response_data.update(session_history.current_rollups(user_id))
+        return jsonify(response_data)
+    except ValueError as e: # A start_after we never handed out
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error getting session history for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def get_user_study_stats():
+    """
+    Minutes per day (?days=, default 30), weekly trend (?weeks=, default 12) and best hour of day.
+    ?tz_offset= is the client's offset in minutes east of UTC (-new Date().getTimezoneOffset()),
+    so days and hours follow the user's clock; without it they are UTC.
+    """
+    try:
+        user_id = session['user_id'] # Firebase UID
+        started_at = time.perf_counter()
+        tz = study_stats.parse_tz_offset(request.args.get('tz_offset', 0, type=int))
+        stats = study_stats.build_stats(user_id, request.args.get('days', 30, type=int), request.args.get('weeks', 12, type=int), tz=tz)
+        metrics.get_metrics('study_stats').record(time.perf_counter() - started_at, days=stats['range']['days'])
+        return jsonify(stats)
+    except ValueError as e: # tz_offset out of range
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error getting study stats for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/chat_history', methods=['GET'])
 @login_required
 def get_user_chat_history():
@@ -559,28 +703,43 @@ def save_user_chat_history():
         messages = request.json
         messages = messages[-50:]
         result = save_chat_history(user_id, messages) # Assumes save_chat_history uses UID
+        if not messages:
+            chat_memory.clear(user_id, 'daphinix') # A cleared chat takes its summary with it
         return jsonify({'status': 'success' if result else 'error'})
     except Exception as e:
         print(f"Error saving chat history for {user_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Done todos older than TODO_ARCHIVE_AFTER_DAYS move to todo_lists/<uid>/archive on a background thread
+todo_archiver = TodoArchiver(archive_after_days=int(os.environ.get('TODO_ARCHIVE_AFTER_DAYS', 30)))
+TODO_ARCHIVE_PAGE_SIZE = 50
+TODO_ARCHIVE_MAX_PAGE_SIZE = 200
+
+@app.route('/api/chat_memory/<conversation>', methods=['DELETE'])
+@login_required
+def clear_user_chat_memory(conversation):
+    """Forgets the server-side summary of a conversation (Sana's history itself lives on the client)."""
+    if conversation not in CONVERSATION_PERSONAS:
+        return jsonify({'error': 'Unknown conversation'}), 404
+    try:
+        chat_memory.clear(session['user_id'], conversation)
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        print(f"Error clearing {conversation} memory for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/todo_list', methods=['GET'])
 @login_required
 def get_user_todo_list():
     try:
         user_id = session['user_id'] # Firebase UID
-        todo_data = get_todo_list(user_id) # Assumes get_todo_list uses UID
-        if not todo_data:
-            todo_data = {'todos': []}
-            save_todo_list(user_id, todo_data)
-        
-        todos = todo_data.get('todos', [])
-        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-        todos = [todo for todo in todos if 
-                todo.get('status') != 'Done' or 
-                (todo.get('completedAt') and datetime.fromisoformat(todo['completedAt'].replace('Z', '+00:00')) > thirty_days_ago)]
+        todos = todo_store.list_todos(user_id) # Every item carries its 'id' and 'version'
+        cutoff = todo_archiver.cutoff()
+        live_todos = [todo for todo in todos if not is_expired(todo, cutoff)]
+        if len(live_todos) < len(todos):
+            todo_archiver.compact(user_id) # Hidden right away, moved out of the document shortly after
         
-        return jsonify(todos)
+        return jsonify(live_todos)
     except Exception as e:
         print(f"Error getting todo list for {user_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -588,27 +747,99 @@ def get_user_todo_list():
 @app.route('/api/todo_list', methods=['POST'])
 @login_required
 def save_user_todo_list():
+    # Whole-list replacement, kept for older clients; the item endpoints below write one task at a time
     try:
         user_id = session['user_id'] # Firebase UID
-        todos = request.json
-        
-        for todo in todos:
-            if 'startDate' in todo and todo['startDate']:
-                todo['startDate'] = datetime.fromisoformat(todo['startDate'].replace('Z', '+00:00')).isoformat()
-            if 'dueDate' in todo and todo['dueDate']:
-                todo['dueDate'] = datetime.fromisoformat(todo['dueDate'].replace('Z', '+00:00')).isoformat()
-            if todo.get('status') == 'Done' and not todo.get('completedAt'):
-                todo['completedAt'] = datetime.utcnow().isoformat()
-            elif todo.get('status') != 'Done':
-                todo['completedAt'] = None
-        
-        todo_data = {'todos': todos}
-        save_todo_list(user_id, todo_data) # Assumes save_todo_list uses UID
+        todo_store.replace_todos(user_id, request.json)
         return jsonify({'status': 'success'})
+    except ValueError as e: # Malformed client data (version, dates, list shape)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error saving todo list for {user_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/todo_list/archive', methods=['GET'])
+@login_required
+def get_user_todo_archive():
+    """Archived todos, most recently completed first; ?start_after=<next_cursor> pages back, ?limit= sets the page size."""
+    try:
+        user_id = session['user_id'] # Firebase UID
+        limit = min(max(request.args.get('limit', TODO_ARCHIVE_PAGE_SIZE, type=int), 1), TODO_ARCHIVE_MAX_PAGE_SIZE)
+        todos, next_cursor = archive_page(user_id, limit, request.args.get('start_after'))
+        return jsonify({'todos': todos, 'next_cursor': next_cursor})
+    except ValueError as e: # A start_after we never handed out
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error getting todo archive for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def todo_expected_version():
+    """
+    The version the client last saw, from the JSON body or an If-Match header
+    (None = don't check). Raises ValueError if it isn't a version we issued.
+    """
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict) and payload.get('version') is not None:
+        return todo_store.parse_version(payload['version'])
+    if_match = request.headers.get('If-Match', '').strip()
+    if not if_match or if_match == '*':
+        return None
+    return todo_store.parse_version(if_match)
+
+def todo_conflict_response(error):
+    return jsonify({'error': str(error), 'status': 'conflict', 'current': error.current}), 409
+
+@app.route('/api/todo_list/items', methods=['POST'])
+@login_required
+def create_user_todo():
+    try:
+        user_id = session['user_id'] # Firebase UID
+        fields = request.json or {}
+        if not fields.get('name'):
+            return jsonify({'error': 'Task name is required'}), 400
+        todo = todo_store.create_todo(user_id, fields)
+        return jsonify({'status': 'success', 'todo': todo}), 201
+    except ValueError as e: # Malformed client data (version, dates, list shape)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error creating todo for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/todo_list/items/<todo_id>', methods=['PATCH'])
+@login_required
+def update_user_todo(todo_id):
+    try:
+        user_id = session['user_id'] # Firebase UID
+        if not todo_store.TODO_ID_PATTERN.match(todo_id):
+            return jsonify({'error': 'Task not found'}), 404
+        todo = todo_store.update_todo(user_id, todo_id, request.json or {}, todo_expected_version())
+        if todo is None:
+            return jsonify({'error': 'Task not found'}), 404
+        return jsonify({'status': 'success', 'todo': todo})
+    except todo_store.TodoConflict as e:
+        return todo_conflict_response(e)
+    except ValueError as e: # Malformed client data (version, dates, list shape)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error updating todo {todo_id} for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/todo_list/items/<todo_id>', methods=['DELETE'])
+@login_required
+def delete_user_todo(todo_id):
+    try:
+        user_id = session['user_id'] # Firebase UID
+        if not todo_store.TODO_ID_PATTERN.match(todo_id) or not todo_store.delete_todo(user_id, todo_id, todo_expected_version()):
+            return jsonify({'error': 'Task not found'}), 404
+        return jsonify({'status': 'success'})
+    except todo_store.TodoConflict as e:
+        return todo_conflict_response(e)
+    except ValueError as e: # Malformed client data (version, dates, list shape)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error deleting todo {todo_id} for {session.get('user_id')}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # Configure Google Generative AI with API key
 api_key_gemini = os.environ.get("GEMINI_API_KEY")
 
@@ -651,6 +882,14 @@ if api_key_gemini:
 else:
     print("WARNING: GEMINI_API_KEY environment variable not set. Daphinix AI features will not work.")
 
+# Uploads are downsampled, stripped of EXIF and re-encoded before they reach the vision model
+IMAGE_PREPROCESS_TIMEOUT_SECONDS = float(os.environ.get('IMAGE_PREPROCESS_TIMEOUT_SECONDS', 20))
+image_preprocessor = ImagePreprocessor(
+    max_edge=int(os.environ.get('IMAGE_MAX_EDGE', 1536)),
+    output_format=os.environ.get('IMAGE_OUTPUT_FORMAT', 'JPEG'),
+    quality=int(os.environ.get('IMAGE_QUALITY', 85)),
+)
+
 
 SYSTEM_PROMPT = """
 You are Daphinix, an academic AI assistant focused on solving JEE and NEET-level math, physics, and chemistry problems with clarity and precision,
@@ -713,98 +952,7 @@ Make someone feel good about themselves. Make them feel like they are the best p
 Don't be sassy. Be KIND AND FRIENDLY AND SUPPORTIVE.
 """
 
-def format_latex(text):
-    """Format LaTeX expressions with proper escaping."""
-    replacements = {
-        r'\int': r'\\int',
-        r'\dfrac': r'\\dfrac',
-        r'\frac': r'\\frac',
-        r'\cdot': r'\\cdot',
-        r'\sum': r'\\sum',
-        r'\prod': r'\\prod',
-        r'\begin{bmatrix}': r'\\begin{bmatrix}',
-        r'\end{bmatrix}': r'\\end{bmatrix}',
-        r'\quad': r'\\quad',
-        r'\;': r'\\;',
-        r'\sqrt': r'\\sqrt',
-        r'\partial': r'\\partial',
-        r'\infty': r'\\infty',
-        r'\alpha': r'\\alpha',
-        r'\beta': r'\\beta',
-        r'\gamma': r'\\gamma',
-        r'\delta': r'\\delta',
-        r'\pi': r'\\pi',
-        r'\theta': r'\\theta',
-        r'\sigma': r'\\sigma',
-        r'\omega': r'\\omega',
-        r'\lambda': r'\\lambda',
-        r'\mu': r'\\mu',
-        r'\nu': r'\\nu',
-        r'\epsilon': r'\\epsilon',
-        r'\nabla': r'\\nabla',
-        r'\times': r'\\times',
-        r'\div': r'\\div',
-        r'\leq': r'\\leq',
-        r'\geq': r'\\geq',
-        r'\neq': r'\\neq',
-        r'\approx': r'\\approx',
-        r'\equiv': r'\\equiv',
-        r'\rightarrow': r'\\rightarrow',
-        r'\leftarrow': r'\\leftarrow',
-        r'\Rightarrow': r'\\Rightarrow',
-        r'\Leftarrow': r'\\Leftarrow',
-        r'\lim': r'\\lim',
-        r'\sin': r'\\sin',
-        r'\cos': r'\\cos',
-        r'\tan': r'\\tan',
-        r'\log': r'\\log',
-        r'\ln': r'\\ln',
-        r'\exp': r'\\exp',
-        r'\oplus': r'\\oplus',
-        r'\otimes': r'\\otimes'
-    }
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-    return text
-
-def detect_math_question(user_message):
-    """Check if the message appears to be a math question."""
-    math_patterns = [
-        r'solve\\s+for', r'calculate', r'compute',
-        r'find\\s+the\\s+(value|sum|product|quotient|derivative|integral)',
-        r'what\\s+is\\s+[\\d\\+\\-\\*\\/\\^\\(\\)]+', r'evaluate', r'integrate', r'differentiate',
-        r'\\d+\\s*[\\+\\-\\*\\/\\^]\\s*\\d+', r'equation', r'formula', r'algebra', r'calculus',
-        r'theorem', r'prove', r'matrix', r'vector', r'probability', r'statistics'
-    ]
-    for pattern in math_patterns:
-        if re.search(pattern, user_message.lower()):
-            return True
-    return False
-
-def custom_chat(user_message, memory=None):
-    """Handle chat interactions with specialized processing."""
-    
-    if not text_model:
-        return "I'm sorry, the chat feature is currently unavailable. The service is not configured correctly."
-
-    # Create a new chat for this interaction
-    chat = text_model.start_chat(history=[])
-    
-    # Process chat memory if provided
-    memory_prompt = ""
-    if memory and isinstance(memory, list) and len(memory) > 0:
-        memory_prompt = "\n\nHere's the conversation so far (use this for context):\n\n"
-        for item in memory:
-            role = item.get('role', '')
-            content = item.get('content', '')
-            if role == 'user':
-                memory_prompt += f"User: {content}\n\n"
-            elif role == 'assistant':
-                memory_prompt += f"You (Daphinix): {content}\n\n"
-    
-    # Check if it\'s a math question
-    if detect_math_question(user_message):
-        math_prompt = SYSTEM_PROMPT + """
+MATH_PROMPT_ADDENDUM = """
         IMPORTANT: This is a MATH question. You MUST:
         1. Use LaTeX formatting for ALL equations and mathematical expressions
         2. Show step-by-step work with numbered steps
@@ -821,58 +969,299 @@ def custom_chat(user_message, memory=None):
         Use plain text with emoji prefixes for headings:
         # 🔥 Main Title
         ## 🎯 Subtitle
-        """ + memory_prompt
+        """
+
+PHYSICS_PROMPT_ADDENDUM = """
+        IMPORTANT: This is a PHYSICS question. You MUST:
+        1. List the known quantities (with units) and what is being asked
+        2. Name the laws or principles you use before applying them
+        3. Use LaTeX formatting for ALL equations, with display style $$ ... $$ for important steps
+        4. Keep units through every step and check them in the final answer
+        5. Always use \\\\dfrac instead of \\\\frac for larger, more readable fractions
+        6. Finish with a short sanity check of the result (size, sign, direction)
         
-        chat.send_message(math_prompt)
-    else:
-        additional_prompt = """
-        IMPORTANT: Never use [object Object] in yourresponse. Use text strings directly in your markdown headings.
+        IMPORTANT: Never use [object Object] in your response. Use text strings directly in your markdown headings.
         Use plain text with emoji prefixes for headings:
         # 🔥 Main Title
         ## 🎯 Subtitle
-        """ + memory_prompt
+        """
+
+CHEMISTRY_PROMPT_ADDENDUM = """
+        IMPORTANT: This is a CHEMISTRY question. You MUST:
+        1. Write chemical formulas and reactions with LaTeX subscripts, e.g. $H_2O$, $CO_2$
+        2. Balance every reaction you write and state the states of matter where relevant
+        3. Show stoichiometry and unit conversions step by step with numbered steps
+        4. Use display style equations with $$ ... $$ for calculations and reactions
+        5. Explain the underlying concept (bonding, equilibrium, kinetics...) in plain words
         
-        chat.send_message(SYSTEM_PROMPT + additional_prompt)
-    
-    # Send user message and get response
-    response = chat.send_message(user_message)
-    response_text = response.text
+        IMPORTANT: Never use [object Object] in your response. Use text strings directly in your markdown headings.
+        Use plain text with emoji prefixes for headings:
+        # 🔥 Main Title
+        ## 🎯 Subtitle
+        """
+
+GENERAL_PROMPT_ADDENDUM = """
+        IMPORTANT: Never use [object Object] in yourresponse. Use text strings directly in your markdown headings.
+        Use plain text with emoji prefixes for headings:
+        # 🔥 Main Title
+        ## 🎯 Subtitle
+        """
+
+# classify_question() result -> addendum appended to SYSTEM_PROMPT
+PROMPT_ADDENDA = {
+    'math': MATH_PROMPT_ADDENDUM,
+    'physics': PHYSICS_PROMPT_ADDENDUM,
+    'chemistry': CHEMISTRY_PROMPT_ADDENDUM,
+    'general': GENERAL_PROMPT_ADDENDUM,
+}
+
+def format_memory_prompt(memory, assistant_name='Daphinix'):
+    """Flattens client chat memory ({role, content} items) into prompt text."""
+    memory_prompt = ""
+    if memory and isinstance(memory, list) and len(memory) > 0:
+        memory_prompt = "\n\nHere's the conversation so far (use this for context):\n\n"
+        for item in memory:
+            role = item.get('role', '')
+            content = item.get('content', '')
+            if role == 'summary':
+                memory_prompt += f"Summary of the earlier conversation: {content}\n\n"
+            elif role == 'user':
+                memory_prompt += f"User: {content}\n\n"
+            elif role == 'assistant':
+                memory_prompt += f"You ({assistant_name}): {content}\n\n"
+    return memory_prompt
+
+# ConversationMemory slot -> (assistant name, what the summary should keep)
+CONVERSATION_PERSONAS = {
+    'daphinix': ('Daphinix', "their study assistant. Keep what matters for future replies: the student's goals, "
+                             "subjects, problems discussed, answers given and preferences."),
+    'sana': ('Sana', "their mentor and confidante. Keep what matters for future replies: how the student feels, "
+                     "what is weighing on them, goals and struggles they shared, and advice already given."),
+}
+
+def summarize_conversation(previous_summary, messages, conversation='daphinix'):
+    """Folds older chat turns into a short rolling summary (used by ConversationMemory)."""
+    if not text_model:
+        return ''
+    assistant_name, focus = CONVERSATION_PERSONAS.get(conversation, CONVERSATION_PERSONAS['daphinix'])
+    prompt = (
+        f"Update the running summary of a conversation between a student and {assistant_name}, {focus} "
+        "Write under 150 words, plain text, no headings.\n\n"
+        f"Current summary: {previous_summary or '(none)'}\n\n"
+        f"New turns to fold in:{format_memory_prompt(messages, assistant_name)}"
+    )
+    started_at = time.perf_counter()
+    try:
+        response = text_model.generate_content(prompt)
+        summary_text = response.text
+    except Exception:
+        log_llm_call('chat_summary', started_at, prompt, error=True)
+        raise
+    log_llm_call('chat_summary', started_at, prompt, response)
+    return summary_text
+
+# Prompts carry at most CHAT_MEMORY_TOKEN_BUDGET tokens of recent turns; older turns are summarized
+chat_memory = ConversationMemory(summarize_conversation, token_budget=int(os.environ.get('CHAT_MEMORY_TOKEN_BUDGET', 2000)))
+
+def load_chat_memory(conversation, client_messages=None, use_stored=True):
+    """Bounded prompt memory for the logged-in user, falling back to the client's recent turns on error."""
+    try:
+        return chat_memory.build(session['user_id'], conversation, client_messages, use_stored)
+    except Exception as e:
+        print(f"[MEMORY] Could not load {conversation} memory for {session.get('user_id')}: {e}")
+        return client_messages[-10:] if isinstance(client_messages, list) else []
+
+def log_llm_call(metrics_name, started_at, prompt, response=None, error=False, cancelled=False):
+    """
+    Records latency and token usage for one LLM call and logs it. For a stream,
+    response is its last chunk (the one carrying usage) and cancelled marks a
+    stream the client stopped reading before the model finished.
+    """
+    elapsed = time.perf_counter() - started_at
+    usage = getattr(response, 'usage_metadata', None) # Only reported by newer google-generativeai releases
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    output_tokens = getattr(usage, 'candidates_token_count', None)
+    metrics.get_metrics(metrics_name).record(
+        elapsed, error=error, prompt_chars=len(prompt), prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+        cancelled=1 if cancelled else None)
+    print(f"[LLM] {metrics_name}: {elapsed * 1000:.0f} ms, prompt {len(prompt)} chars, "
+          f"tokens in/out: {prompt_tokens if prompt_tokens is not None else '?'}/{output_tokens if output_tokens is not None else '?'}"
+          f"{' (error)' if error else ''}{' (cancelled)' if cancelled else ''}")
+
+# Outbound Gemini/Groq calls run on a bounded, per-user fair pool; overflow gets a 503
+llm_executor = LLMExecutor(
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 4)),
+    max_queue=int(os.environ.get('LLM_MAX_QUEUE', 32)),
+    max_queue_per_user=int(os.environ.get('LLM_MAX_QUEUE_PER_USER', 3)),
+    deadline_seconds=float(os.environ.get('LLM_DEADLINE_SECONDS', 60)),
+)
+
+def llm_unavailable_response(error):
+    """503 with Retry-After for an LLM call that was shed or ran out of time."""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+# Repeated questions are answered from memory instead of another model call
+RESPONSE_CACHE_MAX_MEMORY_MESSAGES = int(os.environ.get('RESPONSE_CACHE_MAX_MEMORY_MESSAGES', 2))
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+    ttl_seconds=int(os.environ.get('RESPONSE_CACHE_TTL', 86400)),
+    persist_path=os.environ.get('RESPONSE_CACHE_PATH') or None,
+)
+
+def daphinix_instructions(user_message):
+    """System prompt plus the subject-specific addendum for this message."""
+    # One scan of the message picks the subject-specific instructions
+    return SYSTEM_PROMPT + PROMPT_ADDENDA[classify_question(user_message)]
+
+def build_daphinix_prompt(user_message, memory=None, instructions=None):
+    """Builds the single Daphinix prompt: instructions, flattened memory and the user message."""
+    memory_prompt = format_memory_prompt(memory)
+    if instructions is None:
+        instructions = daphinix_instructions(user_message)
+    return f"{instructions}{memory_prompt}\n\nUser query: {user_message}"
+
+def daphinix_cache_key(user_message, instructions, memory, use_cache=True):
+    """
+    Response cache key for a Daphinix question, or None when the answer may depend
+    on the conversation (more than RESPONSE_CACHE_MAX_MEMORY_MESSAGES turns or a
+    summary in memory) or the client asked to skip the cache.
+    """
+    memory = memory or []
+    if (not use_cache or len(memory) > RESPONSE_CACHE_MAX_MEMORY_MESSAGES
+            or any(item.get('role') == 'summary' for item in memory)):
+        response_cache.record_bypass()
+        return None
+    # The few turns allowed through are part of the key: follow-ups only hit entries made after the same turns
+    return response_cache.make_key(user_message, instructions,
+                                   [(item.get('role'), item.get('content')) for item in memory])
+
+def custom_chat(user_message, memory=None, use_cache=True):
+    """Handle chat interactions with specialized processing."""
     
-    # Format LaTeX in responses
-    response_text = format_latex(response_text)
+    if not text_model:
+        return "I'm sorry, the chat feature is currently unavailable. The service is not configured correctly."
+
+    instructions = daphinix_instructions(user_message)
+    cache_key = daphinix_cache_key(user_message, instructions, memory, use_cache)
+    if cache_key:
+        cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            return format_response(cached_text)
+
+    # System instructions, conversation memory and the user message go out as a single
+    # request, so each message costs one model round trip.
+    prompt = build_daphinix_prompt(user_message, memory, instructions)
     
-    # Remove any instances of [object Object] that might appear
-    response_text = response_text.replace('[object Object]', '')
+    # Send the prompt and get response
+    started_at = time.perf_counter()
+    try:
+        response = text_model.generate_content(prompt)
+        response_text = response.text
+    except Exception:
+        log_llm_call('daphinix_chat', started_at, prompt, error=True)
+        raise
+    log_llm_call('daphinix_chat', started_at, prompt, response)
+    if cache_key:
+        response_cache.put(cache_key, response_text)
     
-    return response_text
+    # Format LaTeX and remove any instances of [object Object] that might appear
+    return format_response(response_text)
 
+def custom_chat_stream(user_message, memory=None, use_cache=True):
+    """Yields raw Daphinix response text chunks as the model produces them."""
+    if not text_model:
+        yield "I'm sorry, the chat feature is currently unavailable. The service is not configured correctly."
+        return
 
-def process_image_request(image_pil, user_input, memory=None):
+    instructions = daphinix_instructions(user_message)
+    cache_key = daphinix_cache_key(user_message, instructions, memory, use_cache)
+    if cache_key:
+        cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            yield cached_text
+            return
+
+    prompt = build_daphinix_prompt(user_message, memory, instructions)
+    response_parts = []
+    last_chunk = None
+    started_at = time.perf_counter()
+    try:
+        for chunk in text_model.generate_content(prompt, stream=True):
+            last_chunk = chunk # Usage metadata comes with the final chunk
+            if chunk.parts:
+                text = ''.join(part.text for part in chunk.parts if hasattr(part, 'text'))
+                response_parts.append(text)
+                yield text
+    except GeneratorExit: # The client stopped reading (disconnect or deadline); log what was generated
+        log_llm_call('daphinix_chat_stream_llm', started_at, prompt, last_chunk, cancelled=True)
+        raise
+    except Exception:
+        log_llm_call('daphinix_chat_stream_llm', started_at, prompt, error=True)
+        raise
+    log_llm_call('daphinix_chat_stream_llm', started_at, prompt, last_chunk)
+    # Only a stream that ran to completion is cached
+    if cache_key:
+        response_cache.put(cache_key, ''.join(response_parts))
+
+def sse_event(data, event=None):
+    """Formats one Server-Sent Event."""
+    message = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+def stream_chat_response(chunks, metrics_name):
+    """
+    Relays model text chunks as SSE 'delta' events, formatting LaTeX incrementally,
+    and finishes with a 'done' event carrying the full response. Time to first token
+    and total duration are recorded under metrics_name.
+    """
+    formatter = StreamingResponseFormatter()
+    response_parts = []
+    started_at = time.perf_counter()
+    first_token_at = None
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                metrics.get_metrics(f'{metrics_name}_ttft').record(first_token_at - started_at)
+            delta = formatter.feed(chunk)
+            if delta:
+                response_parts.append(delta)
+                yield sse_event({'delta': delta})
+        tail = formatter.flush()
+        if tail:
+            response_parts.append(tail)
+            yield sse_event({'delta': tail})
+        metrics.get_metrics(metrics_name).record(time.perf_counter() - started_at)
+        yield sse_event({'response': ''.join(response_parts)}, event='done')
+    except Exception as e:
+        print(f"Error streaming {metrics_name}: {e}")
+        traceback.print_exc()
+        metrics.get_metrics(metrics_name).record(time.perf_counter() - started_at, error=True)
+        yield sse_event({'error': str(e)}, event='error')
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def process_image_request(image_bytes, mime_type, user_input, memory=None):
     """Process requests with images using Vision models with fallback."""
     
     if not vision_model:
         return "I'm sorry, I am unable to process images at the moment. The image processing service is not configured correctly."
 
-    img_byte_arr = BytesIO()
-    image_pil.save(img_byte_arr, format=image_pil.format or 'JPEG')
-    img_byte_arr_val = img_byte_arr.getvalue()
-
     if not user_input or user_input.strip() == "":
         user_input = "What's in this image? Describe it in detail."
 
-    memory_prompt_text = ""
-    if memory and isinstance(memory, list) and len(memory) > 0:
-        memory_prompt_text = "\n\nHere's the conversation so far (use this for context):\n\n"
-        for item in memory:
-            role = item.get('role', '')
-            content = item.get('content', '')
-            if role == 'user':
-                memory_prompt_text += f"User: {content}\n\n"
-            elif role == 'assistant':
-                memory_prompt_text += f"You (Daphinix): {content}\n\n"
+    memory_prompt_text = format_memory_prompt(memory)
 
     prompt_with_memory = f"{SYSTEM_PROMPT}{memory_prompt_text}\n\nUser query: {user_input}"
-    image_part = {"mime_type": "image/jpeg", "data": img_byte_arr_val}
+    image_part = {"mime_type": mime_type, "data": image_bytes}
     
     # Define a list of models to try in order of preference
     # The primary vision_model is already initialized. Others can be fallbacks.
@@ -898,7 +1287,13 @@ def process_image_request(image_pil, user_input, memory=None):
                 model_obj = genai.GenerativeModel(model_name)
             
             print(f"Trying vision model: {model_name}")
-            response = model_obj.generate_content([prompt_with_memory, image_part])
+            started_at = time.perf_counter()
+            try:
+                response = model_obj.generate_content([prompt_with_memory, image_part])
+            except Exception:
+                log_llm_call('daphinix_vision', started_at, prompt_with_memory, error=True)
+                raise
+            log_llm_call('daphinix_vision', started_at, prompt_with_memory, response)
             
             # If we get a valid response with text, process and return it
             if response.parts:
@@ -924,15 +1319,27 @@ def process_image_request(image_pil, user_input, memory=None):
 def chat():
     data = request.json
     user_message = data.get('message', '')
-    memory = data.get('memory', []) # Memory from client is list of {role, content}
     
     if not user_message:
         return jsonify({"error": "No message provided"}), 400
-    
+
+    # Conversation memory comes from chat_history; client-sent memory is only a fallback
+    memory = load_chat_memory('daphinix', data.get('memory', []))
+
+    # "cache": false forces a fresh answer even for a question that was asked before
+    use_cache = data.get('cache', True) is not False
+
     try:
+        if data.get('stream'):
+            # Server-Sent Events: 'delta' events as tokens arrive, then 'done' with the full response
+            chunks = llm_executor.stream(session['user_id'], custom_chat_stream, user_message, memory, use_cache)
+            return sse_response(stream_chat_response(chunks, 'daphinix_chat_stream'))
+
         # Directly use custom_chat which now aligns with old.py's method
-        response_text = custom_chat(user_message, memory)
+        response_text = llm_executor.run(session['user_id'], custom_chat, user_message, memory, use_cache)
         return jsonify({"response": response_text})
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         print("Error in /api/chat:", e)
         traceback.print_exc() # For server-side debugging
@@ -943,23 +1350,32 @@ def chat():
 def chat_with_image():
     try:
         user_message = request.form.get('message', '')
-        memory_raw = request.form.get('memory', '[]') # Memory from client
-        memory = json.loads(memory_raw)
+        memory_raw = request.form.get('memory', '[]') # Fallback only; memory comes from chat_history
+        memory = load_chat_memory('daphinix', json.loads(memory_raw))
         image_file_storage = request.files.get('image')
 
         if not image_file_storage:
             return jsonify({"error": "No image provided"}), 400
         
         try:
-            pil_image = Image.open(image_file_storage.stream)
+            # Decoding, resizing and re-encoding run on the preprocessing pool
+            image_bytes, mime_type = image_preprocessor.process(
+                image_file_storage.read(), timeout=IMAGE_PREPROCESS_TIMEOUT_SECONDS)
+        except TimeoutError as timeout_e:
+            # The upload may be fine; the preprocessing pool is just too busy (or the image too large) right now
+            print(f"Image preprocessing timed out: {timeout_e}")
+            return jsonify({"error": "The image took too long to process. Please try again."}), 504
         except Exception as img_e:
-            print(f"Error opening image from FileStorage: {img_e}")
+            print(f"Error preprocessing uploaded image: {img_e}")
             return jsonify({"error": "Invalid image file format or content."}), 400
 
         # The function now returns a JSON response directly
-        response_text = process_image_request(pil_image, user_message, memory)
+        response_text = llm_executor.run(
+            session['user_id'], process_image_request, image_bytes, mime_type, user_message, memory)
         return jsonify({"response": response_text})
         
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         print(f"Error in /api/chat_with_image: {str(e)}")
         traceback.print_exc()
@@ -982,10 +1398,14 @@ def create_room():
                     'timeLeft': 25 * 60,  # 25 minutes in seconds
                     'isWorkSession': True,
                     'isRunning': False,
+                    'startedAt': None, # Epoch seconds, set while running
+                    'endsAt': None,    # Deadline; timeLeft is derived from it while running
                     'workDuration': 25, # Default work duration
                     'breakDuration': 5   # Default break duration
                 },
-                'participants': [session.get('username', session['user_id'])] # Add creator as first participant
+                'participants': [session.get('username', session['user_id'])], # Add creator as first participant
+                'emptySince': None, # Set when the last participant leaves; the orphan sweeper queries it
+                'lastActivity': firestore.SERVER_TIMESTAMP
             }
             db.collection('rooms').document(room_id).set(room_data)
             return redirect(url_for('study_room', room_id=room_id))
@@ -1031,37 +1451,68 @@ def study_room(room_id):
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
 def get_room_ref(room_id):
-    db_client = initialize_firebase()
+    db_client = get_db()
     return db_client.collection('rooms').document(room_id)
 
-def get_room_messages(room_id):
-    db_client = initialize_firebase()
-    room_ref = db_client.collection('rooms').document(room_id)
-    messages_ref = room_ref.collection('messages').order_by('timestamp')
-    return [doc.to_dict() for doc in messages_ref.stream()]
+ROOM_CHAT_PAGE_SIZE = 50
+ROOM_CHAT_MAX_PAGE_SIZE = 200
+
+def get_room_messages(room_id, limit=ROOM_CHAT_PAGE_SIZE, start_after=None):
+    """
+    One page of a room's chat, oldest first.
+
+    Without start_after this is the latest `limit` messages; pass the page's
+    next_cursor to get the page before it. Messages sent in the same instant are
+    ordered by document id, so none is skipped between pages. Raises ValueError
+    for a cursor this function did not hand out.
+
+    Returns:
+        tuple: (messages, next_cursor) where next_cursor is None once there is nothing older.
+    """
+    db_client = get_db()
+    messages_ref = db_client.collection('rooms').document(room_id).collection('messages')
+    snapshots, next_cursor = page_cursor.descending_page(messages_ref, 'timestamp', limit, start_after)
+    messages = [doc.to_dict() for doc in reversed(snapshots)]
+    return messages, next_cursor
+
+# Room chat is broadcast first and persisted in batches behind it
+room_message_writer = RoomMessageWriter(
+    max_batch=int(os.environ.get('ROOM_MESSAGE_BATCH_SIZE', 100)),
+    flush_interval=float(os.environ.get('ROOM_MESSAGE_FLUSH_SECONDS', 0.5)),
+)
 
 def save_room_message(room_id, message_data):
-    db_client = initialize_firebase()
-    room_ref = db_client.collection('rooms').document(room_id)
-    messages_ref = room_ref.collection('messages')
-    messages_ref.add(message_data)
+    room_message_writer.enqueue(room_id, message_data)
+
+# Rooms and their messages are deleted in batches on a background thread
+room_deleter = RoomDeleter()
+
+def delete_room(room_id):
+    """Stops the room's timer, drops its unsaved messages and queues the Firestore deletion."""
+    room_message_writer.discard_room(room_id)
+    stop_room_timer(room_id)
+    room_deleter.delete(room_id)
 
 # REST endpoint to fetch chat history for a room
 @app.route('/api/room_chat_history/<room_id>')
 @login_required # Add login required if this needs to be protected
 def get_room_chat_history(room_id):
+    """Latest page of room chat; ?start_after=<next_cursor> fetches older pages, ?limit= sets the page size."""
     try:
-        messages = get_room_messages(room_id)
-        return jsonify(messages)
+        limit = min(max(request.args.get('limit', ROOM_CHAT_PAGE_SIZE, type=int), 1), ROOM_CHAT_MAX_PAGE_SIZE)
+        messages, next_cursor = get_room_messages(room_id, limit, request.args.get('start_after'))
+        return jsonify({'messages': messages, 'next_cursor': next_cursor})
+    except ValueError as e: # A start_after we never handed out
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error fetching room chat history: {e}")
-        return jsonify([])
+        return jsonify({'messages': [], 'next_cursor': None})
 
-# Add global active_sessions mapping
-active_sessions = {}  # sid -> {'user_id': ..., 'room_id': ..., 'display_name': ...}
+# Connected sockets, indexed by sid and by room
+room_registry = RoomRegistry()
 
 def remove_participant_and_cleanup(room_id, user_uid):
-    db_client = initialize_firebase()
+    db_client = get_db()
     room_ref = db_client.collection('rooms').document(room_id)
     room_doc = room_ref.get()
     if not room_doc.exists:
@@ -1075,18 +1526,18 @@ def remove_participant_and_cleanup(room_id, user_uid):
     user_left_message_sent = False
     if user_display_name_to_remove and user_display_name_to_remove in participants_list:
         participants_list.remove(user_display_name_to_remove)
-        room_ref.update({'participants': participants_list})
+        room_update = {'participants': participants_list, 'lastActivity': firestore.SERVER_TIMESTAMP}
+        if not participants_list:
+            room_update['emptySince'] = firestore.SERVER_TIMESTAMP # Lets the sweeper find it if the deletion below fails
+        room_ref.update(room_update)
         print(f'[Socket] Removed {user_display_name_to_remove} (UID: {user_uid}) from participants list of room {room_id}. Updated list: {participants_list}')
         socketio.emit('status', {'msg': f'{user_display_name_to_remove} has left the room.'}, room=room_id)
         user_left_message_sent = True
         if not participants_list:
             print(f'[Socket] No participants left in room {room_id}. Proceeding to delete room and messages.')
             try:
-                messages_ref = room_ref.collection('messages')
-                for msg_doc in messages_ref.stream():
-                    msg_doc.reference.delete()
-                room_ref.delete()
-                print(f'[Socket] Room {room_id} deleted successfully.')
+                delete_room(room_id)
+                print(f'[Socket] Room {room_id} queued for deletion.')
                 socketio.emit('room_deleted', {
                     'room': room_id,
                     'message': 'Room has been deleted as all participants have left.'
@@ -1123,13 +1574,9 @@ def handle_join_room(data):
     join_room(room_id)
 
     # Track active session
-    active_sessions[request.sid] = {
-        'user_id': user_uid,
-        'room_id': room_id,
-        'display_name': user_display_name
-    }
+    room_registry.add(request.sid, user_uid, room_id, user_display_name)
 
-    db_client = initialize_firebase()
+    db_client = get_db()
     room_ref = db_client.collection('rooms').document(room_id)
     room_doc = room_ref.get()
 
@@ -1137,26 +1584,27 @@ def handle_join_room(data):
         room_data = room_doc.to_dict()
         participants_list = room_data.get('participants', [])
 
+        room_update = {'emptySince': None, 'lastActivity': firestore.SERVER_TIMESTAMP}
         if user_display_name not in participants_list:
             participants_list.append(user_display_name)
-            room_ref.update({'participants': participants_list})
+            room_update['participants'] = participants_list
             print(f'[Socket] Added {user_display_name} to participants list for room {room_id}. Current list: {participants_list}')
         else:
             print(f'[Socket] User {user_display_name} already in participants list for room {room_id}.')
+        room_ref.update(room_update)
         
         # Get all active users in the room and prepare their video identities
         identities = []
-        for sid_in_room, session_info in active_sessions.items():
-            if session_info['room_id'] == room_id:
-                try:
-                    # This must be the same hashing as in get_agora_token
-                    uid_int = abs(hash(session_info['user_id'])) % (2**32)
-                    identities.append({
-                        'agora_uid': uid_int,
-                        'display_name': session_info['display_name']
-                    })
-                except Exception as e:
-                    print(f"Error creating agora uid hash for user {session_info['user_id']}: {e}")
+        for session_info in room_registry.sessions_in(room_id):
+            try:
+                # This must be the same hashing as in get_agora_token
+                uid_int = abs(hash(session_info['user_id'])) % (2**32)
+                identities.append({
+                    'agora_uid': uid_int,
+                    'display_name': session_info['display_name']
+                })
+            except Exception as e:
+                print(f"Error creating agora uid hash for user {session_info['user_id']}: {e}")
 
         # Send the list of existing users to the NEW user who just joined
         emit('existing_video_users', {'identities': identities}, room=request.sid)
@@ -1184,6 +1632,14 @@ def handle_join_room(data):
         else:
             timer_data.setdefault('timeLeft', 0) # Fallback if timeLeft is missing while running (should not happen)
 
+        # A running timer with no scheduler entry (e.g. after a server restart) is resumed from its deadline
+        if timer_data['isRunning'] and room_id not in active_room_timers:
+            if timer_data.get('endsAt') is None:
+                timer_data['endsAt'] = time.time() + timer_data['timeLeft']
+                room_ref.set({'timer': timer_data}, merge=True)
+            start_room_timer(room_id, timer_data)
+        timer_data['timeLeft'] = get_timer_time_left(timer_data)
+
         # Emit only to the joining user (request.sid)
         # Use a structure consistent with emit_timer_update for the data payload
         socketio.emit('room_timer_update', {
@@ -1191,7 +1647,8 @@ def handle_join_room(data):
             'isRunning': timer_data.get('isRunning', False),
             'isPaused': not timer_data.get('isRunning', False),
             'isWorkSession': timer_data.get('isWorkSession', True),
-            'timeLeft': timer_data.get('timeLeft', 0),
+            'timeLeft': timer_data['timeLeft'],
+            'endsAt': timer_data.get('endsAt') if timer_data.get('isRunning') else None,
             'workDuration': timer_data.get('workDuration', 25),
             'breakDuration': timer_data.get('breakDuration', 5)
         }, room=request.sid) # Emit only to the user joining
@@ -1219,22 +1676,20 @@ def handle_send_room_message(data):
         'message': message,
         'timestamp': timestamp
     }
-    # Save to Firestore
-    save_room_message(room, message_data)
-    
     # Server-side log before emitting back to clients
     print(f"[Socket Server] Emitting 'receive_room_message' to room {room}. Data: {message_data}")
     emit('receive_room_message', message_data, room=room)
+    
+    # Queue for Firestore; the write-behind buffer persists it off the socket path
+    save_room_message(room, message_data)
 
 @socketio.on('leave_room')
 def handle_leave_room(data):
     room_id = data.get('room')
     user_uid_leaving = data.get('user_id')
 
-    # Remove from active_sessions
-    sid = request.sid
-    if sid in active_sessions:
-        del active_sessions[sid]
+    # Remove from the room registry
+    room_registry.remove(request.sid)
 
     if not room_id or not user_uid_leaving:
         print(f"[Socket Leave Error] Missing room_id ('{room_id}') or user_id ('{user_uid_leaving}'). Data: {data}")
@@ -1247,7 +1702,7 @@ def handle_leave_room(data):
 @socketio.on('disconnect')
 def handle_disconnect():
     sid = request.sid
-    session_info = active_sessions.pop(sid, None)
+    session_info = room_registry.remove(sid)
     if session_info:
         room_id = session_info['room_id']
         user_uid = session_info['user_id']
@@ -1263,7 +1718,7 @@ def handle_disconnect():
 def get_room_participants(room_id):
     try:
         print(f'[API] Fetching participants for room: {room_id}')
-        db_client = initialize_firebase()
+        db_client = get_db()
         room_ref = db_client.collection('rooms').document(room_id)
         room_doc = room_ref.get()
         if room_doc.exists:
@@ -1282,74 +1737,100 @@ def get_room_participants(room_id):
         print(f'[API] Error fetching participants for room {room_id}: {str(e)}')
         return jsonify({'participants': [], 'host_id': None})
 
-room_timers = {}  # room_id -> {'thread': Thread, 'stop_event': Event}
-
-def start_room_timer(room_id):
-    # db_client = initialize_firebase() # db is already globally available
-    room_ref = db.collection('rooms').document(room_id)
-    stop_event = threading.Event()
-
-    def timer_thread():
-        while not stop_event.is_set():
-            try:
-                room_doc = room_ref.get()
-                if not room_doc.exists:
-                    print(f"[Timer Thread {room_id}] Room document no longer exists. Stopping timer.")
-                    break
-
-                timer = room_doc.to_dict().get('timer', {})
-                if not timer.get('isRunning', False):
-                    print(f"[Timer Thread {room_id}] Timer is not running (read from DB). Stopping thread.")
-                    break # Timer was paused or stopped externally
-
-                time_left = timer.get('timeLeft', 0)
-                if time_left <= 0:
-                    # Auto-switch session
-                    is_work = timer.get('isWorkSession', True)
-                    work_duration = timer.get('workDuration', 25)
-                    break_duration = timer.get('breakDuration', 5)
-                    
-                    timer['isWorkSession'] = not is_work
-                    timer['timeLeft'] = (work_duration * 60) if timer['isWorkSession'] else (break_duration * 60)
-                    timer['isRunning'] = False # Stop timer after switching
-                    
-                    print(f"[Timer Thread {room_id}] Session ended. New session: {'Work' if timer['isWorkSession'] else 'Break'}, TimeLeft: {timer['timeLeft']}")
-                    room_ref.set({'timer': timer}, merge=True) # Update Firestore first
-                    
-                    emit_timer_update(room_id, timer) # Use helper
-                    stop_room_timer(room_id) # Ensure this specific thread instance stops
-                    break # Exit thread after timer completes and switches
-
-                timer['timeLeft'] = time_left - 1
-                room_ref.set({'timer': timer}, merge=True) # Update Firestore with new timeLeft
-                
-                # Emit update every second
-                emit_timer_update(room_id, timer) # Use helper
-                time.sleep(1)
-            except Exception as e:
-                print(f"Error in timer thread for room {room_id}: {e}")
-                stop_room_timer(room_id) # Ensure cleanup on error
-                break # Exit thread on error
-        print(f"[Timer Thread {room_id}] Exiting.")
-
-    # Before starting a new thread, ensure any old one for this room is stopped.
-    stop_room_timer(room_id) 
-    t = threading.Thread(target=timer_thread, daemon=True)
-    t.start()
-    room_timers[room_id] = {'thread': t, 'stop_event': stop_event}
-    print(f"[Timer System] New timer thread created and started for room {room_id}")
+# Running timers are stored as a deadline (endsAt, epoch seconds) and timeLeft is derived on read,
+# so Firestore is only written on start/pause/reset/duration change/phase switch.
+active_room_timers = {}  # room_id -> timer dict for rooms whose timer is running
+active_room_timers_lock = threading.Lock() # Guards check-then-act updates of active_room_timers
+
+def get_timer_time_left(timer):
+    """Seconds remaining on a room timer, derived from endsAt while it is running."""
+    if timer.get('isRunning') and timer.get('endsAt') is not None:
+        return max(0, int(math.ceil(timer['endsAt'] - time.time())))
+    return timer.get('timeLeft', 0)
+
+def next_phase_timer(timer):
+    """The stopped timer for the session after the one that just ran out."""
+    timer = dict(timer)
+    timer['isWorkSession'] = not timer.get('isWorkSession', True)
+    timer['timeLeft'] = (timer.get('workDuration', 25) * 60) if timer['isWorkSession'] else (timer.get('breakDuration', 5) * 60)
+    timer['isRunning'] = False # Stop timer after switching
+    timer['startedAt'] = None
+    timer['endsAt'] = None
+    return timer
+
+def switch_room_timer_phase(room_id, expired_timer):
+    """
+    Writes the phase switch for a timer whose deadline passed, unless the stored
+    timer changed meanwhile (paused, reset or restarted by another worker).
+    Returns the new timer, or None if nothing was written.
+    """
+    room_ref = get_db().collection('rooms').document(room_id)
+
+    @firestore.transactional
+    def apply_switch(transaction):
+        room_doc = room_ref.get(transaction=transaction)
+        if not room_doc.exists:
+            return None
+        stored_timer = (room_doc.to_dict() or {}).get('timer') or {}
+        if not stored_timer.get('isRunning') or stored_timer.get('endsAt') != expired_timer.get('endsAt'):
+            return None
+        new_timer = next_phase_timer(stored_timer)
+        transaction.update(room_ref, {'timer': new_timer})
+        return new_timer
+
+    return apply_switch(get_db().transaction())
+
+# Phase switches are Firestore transactions; they run here so a slow write never holds up the
+# scheduler thread, which only pops deadlines and broadcasts
+room_timer_writes = ThreadPoolExecutor(max_workers=int(os.environ.get('ROOM_TIMER_WRITE_WORKERS', 4)),
+                                       thread_name_prefix='room-timer-write')
+
+def finish_room_timer_phase(room_id, expired_timer):
+    """Switches an expired timer to its next phase and broadcasts it. Runs on room_timer_writes."""
+    try:
+        new_timer = switch_room_timer_phase(room_id, expired_timer)
+    except Exception as e:
+        print(f"[Timer {room_id}] Error switching phase: {e}")
+        return
+    if new_timer is None:
+        print(f"[Timer {room_id}] Deadline passed but the stored timer changed meanwhile; not switching phase")
+        return
+    print(f"[Timer {room_id}] Session ended. New session: {'Work' if new_timer['isWorkSession'] else 'Break'}, TimeLeft: {new_timer['timeLeft']}")
+    emit_timer_update(room_id, new_timer) # Use helper
+
+def room_timer_tick(room_id):
+    """Broadcasts a running room timer and switches phase once its deadline passes. Returns False to stop ticking."""
+    timer = active_room_timers.get(room_id)
+    if not timer:
+        return False
+
+    if get_timer_time_left(timer) <= 0:
+        # Auto-switch session; only drop our entry if no handler replaced it meanwhile. The write
+        # itself re-checks the stored timer, so a restart racing with it is never overwritten.
+        with active_room_timers_lock:
+            if active_room_timers.get(room_id) is timer:
+                del active_room_timers[room_id]
+        room_timer_writes.submit(finish_room_timer_phase, room_id, timer)
+        return False # Stop ticking after timer completes and switches
+
+    # Emit update every second; timeLeft is derived from endsAt, nothing is written
+    emit_timer_update(room_id, timer)
+    return True
+
+# One scheduler thread drives every running room instead of a thread per room
+room_timer_scheduler = RoomTimerScheduler(room_timer_tick, interval=1.0)
+
+def start_room_timer(room_id, timer_data):
+    with active_room_timers_lock:
+        active_room_timers[room_id] = dict(timer_data)
+    room_timer_scheduler.schedule(room_id) # Supersedes any timer already running for this room
+    print(f"[Timer System] Timer scheduled for room {room_id}, ends at {timer_data.get('endsAt')}")
 
 def stop_room_timer(room_id):
-    timer_info = room_timers.pop(room_id, None)
-    if timer_info:
-        timer_info['stop_event'].set()
-        try:
-            timer_info['thread'].join(timeout=1.0) # Reduced timeout
-            print(f"[Timer Control] Successfully stopped and joined timer thread for room {room_id}")
-        except Exception as e:
-            print(f"[Timer Control] Error joining timer thread for room {room_id}: {e}")
-    # else:
-        # print(f"[Timer Control] No active timer thread found to stop for room {room_id}")
+    with active_room_timers_lock:
+        active_room_timers.pop(room_id, None)
+    if room_timer_scheduler.cancel(room_id):
+        print(f"[Timer Control] Stopped timer for room {room_id}")
 
 @socketio.on('room_timer_control')
 def handle_room_timer_control(data):
@@ -1380,25 +1861,34 @@ def handle_room_timer_control(data):
     if not timer_data['isRunning']:
         default_time = timer_data['workDuration'] * 60 if timer_data['isWorkSession'] else timer_data['breakDuration'] * 60
         timer_data.setdefault('timeLeft', default_time)
+    else:
+        timer_data['timeLeft'] = get_timer_time_left(timer_data)
 
     print(f"[TIMER CONTROL] Room: {room_id}, Action: {action}, User: {user_id}, Current Timer: {timer_data}")
 
     if action == 'start':
         if not timer_data['isRunning']:
-            timer_data['isRunning'] = True
             if timer_data['timeLeft'] <= 0:
                 timer_data['timeLeft'] = timer_data['workDuration'] * 60 if timer_data['isWorkSession'] else timer_data['breakDuration'] * 60
-            room_ref.set({'timer': timer_data}, merge=True)
-            start_room_timer(room_id)
+            now = time.time()
+            timer_data['isRunning'] = True
+            timer_data['startedAt'] = now
+            timer_data['endsAt'] = now + timer_data['timeLeft']
+            start_room_timer(room_id, timer_data)
             print(f"[TIMER ACTION] Started timer for room {room_id} by {user_id}")
     elif action == 'pause':
         if timer_data['isRunning']:
-            timer_data['isRunning'] = False
             stop_room_timer(room_id)
+            timer_data['timeLeft'] = get_timer_time_left(timer_data)
+            timer_data['isRunning'] = False
+            timer_data['startedAt'] = None
+            timer_data['endsAt'] = None
             print(f"[TIMER ACTION] Paused timer for room {room_id} by {user_id}")
     elif action == 'reset':
-        timer_data['isRunning'] = False
         stop_room_timer(room_id)
+        timer_data['isRunning'] = False
+        timer_data['startedAt'] = None
+        timer_data['endsAt'] = None
         timer_data['isWorkSession'] = True
         timer_data['timeLeft'] = timer_data['workDuration'] * 60
         print(f"[TIMER ACTION] Reset timer for room {room_id} by {user_id}")
@@ -1421,18 +1911,22 @@ def handle_room_timer_control(data):
                 timer_data['timeLeft'] = new_work_duration * 60
             else:
                 timer_data['timeLeft'] = new_break_duration * 60
+        else:
+            with active_room_timers_lock:
+                if room_id in active_room_timers:
+                    active_room_timers[room_id] = dict(timer_data) # Keep the running deadline, pick up new durations
         print(f"[TIMER ACTION] Durations changed for room {room_id} by {user_id}. New WD: {new_work_duration}, BD: {new_break_duration}")
     room_ref.set({'timer': timer_data}, merge=True)
     emit_timer_update(room_id, timer_data)
 
 def emit_timer_update(room_id, timer_data):
-    print(f"[EMIT TIMER] Emitting timer update to room {room_id}: {timer_data}")
     socketio.emit('room_timer_update', {
         'room': room_id,
         'isRunning': timer_data.get('isRunning', False),
         'isPaused': not timer_data.get('isRunning', False),
         'isWorkSession': timer_data.get('isWorkSession', True),
-        'timeLeft': timer_data.get('timeLeft', 0),
+        'timeLeft': get_timer_time_left(timer_data),
+        'endsAt': timer_data.get('endsAt') if timer_data.get('isRunning') else None,
         'workDuration': timer_data.get('workDuration', 25),
         'breakDuration': timer_data.get('breakDuration', 5)
     }, room=room_id)
@@ -1451,6 +1945,7 @@ def get_room_timer_state(room_id):
             timer.setdefault('isRunning', False)
             timer.setdefault('workDuration', 25)
             timer.setdefault('breakDuration', 5)
+            timer['timeLeft'] = get_timer_time_left(timer)
             # If not running and timeLeft is 0, set to current session's duration
             if not timer['isRunning'] and timer['timeLeft'] == 0:
                 if timer['isWorkSession']:
@@ -1469,91 +1964,141 @@ def get_room_timer_state(room_id):
 
 # Start orphaned room cleanup thread after Firebase and app initialization
 
+# Rooms record emptySince when their last participant leaves (None while occupied), so the
+# sweeper only reads rooms that have been empty for ROOM_EMPTY_GRACE_SECONDS. A leased lock
+# document makes sure only one gunicorn worker sweeps per cycle.
+ROOM_SWEEP_INTERVAL_SECONDS = int(os.environ.get('ROOM_SWEEP_INTERVAL_SECONDS', 300))
+ROOM_EMPTY_GRACE_SECONDS = int(os.environ.get('ROOM_EMPTY_GRACE_SECONDS', 300))
+room_sweeper_lease = FirestoreLease('room_sweeper', lease_seconds=max(ROOM_SWEEP_INTERVAL_SECONDS - 30, 30))
+
 def cleanup_orphaned_rooms():
+    backfilled = False
     while True:
         try:
-            print("[CLEANUP THREAD] Checking for orphaned rooms...")
-            db_client = initialize_firebase()
-            rooms_ref = db_client.collection('rooms')
-            orphaned_rooms_deleted_count = 0
-            active_room_sids = set(info['room_id'] for info in active_sessions.values())
-
-            for room_doc_snapshot in rooms_ref.stream():
-                room_id = room_doc_snapshot.id
-                room_data = room_doc_snapshot.to_dict()
-                participants = room_data.get('participants', [])
-                
-                # Condition 1: No participants listed in Firestore document
-                no_listed_participants = not participants
-                
-                # Condition 2: No active socket connections for this room
-                no_active_sockets_for_room = room_id not in active_room_sids
-                
-                # If room has no listed participants AND no active sockets, it's orphaned.
-                if no_listed_participants and no_active_sockets_for_room:
-                    print(f"[CLEANUP] Deleting orphaned room (no listed participants, no active sockets): {room_id}")
-                    messages_ref = room_doc_snapshot.reference.collection('messages')
-                    for msg_doc in messages_ref.stream():
-                        msg_doc.reference.delete()
-                    room_doc_snapshot.reference.delete()
+            if room_sweeper_lease.acquire():
+                if not backfilled:
+                    # Rooms from before emptySince existed are invisible to find_empty_rooms until marked
+                    marked = backfill_empty_since()
+                    backfilled = True
+                    if marked:
+                        print(f"[CLEANUP THREAD] Marked {marked} empty legacy rooms; they are swept once the grace period passes.")
+                print("[CLEANUP THREAD] Checking for orphaned rooms...")
+                orphaned_rooms_deleted_count = 0
+                for room_doc_snapshot in find_empty_rooms(ROOM_EMPTY_GRACE_SECONDS):
+                    room_id = room_doc_snapshot.id
+                    if room_registry.has_sessions(room_id):
+                        print(f"[CLEANUP] Room {room_id} is marked empty but has active sockets. Skipping.")
+                        continue
+                    print(f"[CLEANUP] Deleting orphaned room (empty since {room_doc_snapshot.get('emptySince')}): {room_id}")
+                    delete_room(room_id)
                     orphaned_rooms_deleted_count += 1
-                elif no_listed_participants and not no_active_sockets_for_room:
-                    print(f"[CLEANUP] Room {room_id} has no listed participants, but has active sockets. Investigate.")
-                elif not no_listed_participants and no_active_sockets_for_room:
-                    print(f"[CLEANUP] Room {room_id} has listed participants {participants}, but no active sockets. Will be cleaned up if participants leave via UI or sockets timeout.")
 
-            if orphaned_rooms_deleted_count > 0:
-                print(f"[CLEANUP THREAD] Deleted {orphaned_rooms_deleted_count} orphaned rooms.")
+                if orphaned_rooms_deleted_count > 0:
+                    print(f"[CLEANUP THREAD] Deleted {orphaned_rooms_deleted_count} orphaned rooms.")
+                else:
+                    print("[CLEANUP THREAD] No orphaned rooms found to delete in this cycle.")
             else:
-                print("[CLEANUP THREAD] No orphaned rooms found to delete in this cycle.")
+                print("[CLEANUP THREAD] Another worker holds the sweeper lease, skipping this cycle.")
         except Exception as e:
             print(f"[CLEANUP ERROR] {e}")
             traceback.print_exc()
-        time.sleep(300)  # Run every 5 minutes (reduced from 10 for testing, can be increased)
+        time.sleep(ROOM_SWEEP_INTERVAL_SECONDS)
+
+def release_room_sweeper_lease():
+    # Hand the lease back at shutdown so another worker can sweep without waiting for it to expire
+    try:
+        room_sweeper_lease.release()
+    except Exception as e:
+        print(f"[CLEANUP] Could not release the sweeper lease at shutdown: {e}")
 
 if not os.environ.get("WERKZEUG_RUN_MAIN"): # Ensure cleanup thread runs only once in dev mode
     cleanup_thread = threading.Thread(target=cleanup_orphaned_rooms, daemon=True)
     cleanup_thread.start()
+    atexit.register(release_room_sweeper_lease)
+
+# --- Leaderboards ---
+# Served from memory: updated incrementally on every progress save and fully rebuilt
+# every LEADERBOARD_REBUILD_SECONDS to pick up changes made by other workers.
+LEADERBOARD_REBUILD_SECONDS = int(os.environ.get('LEADERBOARD_REBUILD_SECONDS', 600))
+leaderboard_service = LeaderboardService(top_n=20)
+leaderboard_rebuild_lock = threading.Lock()
+
+def ensure_leaderboards_built():
+    if leaderboard_service.is_built():
+        return
+    with leaderboard_rebuild_lock:
+        if not leaderboard_service.is_built():
+            leaderboard_service.rebuild(get_db())
+
+def refresh_leaderboards():
+    while True:
+        try:
+            with leaderboard_rebuild_lock:
+                leaderboard_service.rebuild(get_db())
+            print(f"[LEADERBOARD] Rebuilt leaderboards: {leaderboard_service.stats()}")
+        except Exception as e:
+            print(f"[LEADERBOARD ERROR] {e}")
+            traceback.print_exc()
+        time.sleep(LEADERBOARD_REBUILD_SECONDS)
+
+if not os.environ.get("WERKZEUG_RUN_MAIN"): # Same single-start guard as the cleanup thread
+    leaderboard_thread = threading.Thread(target=refresh_leaderboards, daemon=True)
+    leaderboard_thread.start()
 
-# --- New Leaderboard Endpoint ---
 @app.route('/api/leaderboard/<type>') # type can be 'xp' or 'streak'
 @login_required # or remove if public leaderboard
 def get_leaderboard(type):
     try:
-        db_client = initialize_firebase()
-        users_ref = db_client.collection('users')
-        
-        query_field = 'leaderboardData.totalXp' if type == 'xp' else 'leaderboardData.currentStreak'
-        
-        # Firestore allows ordering by at most one field in a basic query.
-        # For more complex sorting (e.g., XP then by level as tie-breaker), 
-        # you might need composite indexes or client-side sorting of a larger dataset (not ideal).
-        
-        query = users_ref.order_by(query_field, direction=firestore.Query.DESCENDING).limit(20)
-        results = query.stream()
-        
-        leaderboard = []
-        rank = 1
-        for doc_snapshot in results:
-            user_data = doc_snapshot.to_dict()
-            lb_data = user_data.get('leaderboardData', {})
-            leaderboard.append({
-                'rank': rank,
-                'username': lb_data.get('username', user_data.get('username', 'N/A')),
-                'xp': lb_data.get('totalXp', 0),
-                'streak': lb_data.get('currentStreak', 0),
-                'level': lb_data.get('level', 1)
-                # Add other fields if needed, e.g., avatar
-            })
-            rank += 1
-            
-        return jsonify(leaderboard)
+        board = type if type in LEADERBOARD_FIELDS else 'streak'
+        ensure_leaderboards_built()
+
+        rows, etag = leaderboard_service.snapshot(board) # Body and ETag from the same state of the board
+        response = jsonify(rows)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache' # Always revalidate; unchanged boards come back as 304
+        return response.make_conditional(request)
     except Exception as e:
         print(f"Error fetching leaderboard: {str(e)}")
         import traceback
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/leaderboard/<type>/me')
+@login_required
+def get_my_leaderboard_rank(type):
+    try:
+        board = type if type in LEADERBOARD_FIELDS else 'streak'
+        ensure_leaderboards_built()
+
+        result = leaderboard_service.rank_of(board, session['user_id'])
+        if result is None:
+            return jsonify({'rank': None, 'total': 0})
+        rank, total, lb_data = result
+        return jsonify({
+            'rank': rank,
+            'total': total,
+            'username': lb_data.get('username', 'N/A'),
+            'xp': lb_data.get('totalXp', 0),
+            'streak': lb_data.get('currentStreak', 0),
+            'level': lb_data.get('level', 1)
+        })
+    except Exception as e:
+        print(f"Error fetching leaderboard rank: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+INSPIRE_DEADLINE_SECONDS = float(os.environ.get('INSPIRE_DEADLINE_SECONDS', 3))
+inspire_pool = inspire_content.InspireContentPool(pool_size=int(os.environ.get('INSPIRE_POOL_SIZE', 10)))
+
+@app.before_first_request
+def prefetch_inspire_content():
+    # Warmed when the worker serves its first request rather than at import, so importing
+    # the app (the reloader's parent process, scripts, tests) makes no outbound calls
+    inspire_pool.prefetch({
+        'quote': inspire_content.fetch_quotes,
+        'meme:memes': lambda: inspire_content.fetch_memes('memes'),
+        'fact': inspire_content.fetch_facts,
+    })
+
 @app.route('/api/inspire')
 @login_required
 def get_inspire_content():
@@ -1589,55 +2134,20 @@ def get_inspire_content():
     ]
     prompt = random.choice(thought_prompts)
 
-    try:
-        # Fetch a random quote from ZenQuotes API
-        quote_response = requests.get("https://zenquotes.io/api/random", timeout=5)
-        if quote_response.status_code == 200:
-            quotes_data = quote_response.json()
-            if quotes_data and isinstance(quotes_data, list) and len(quotes_data) > 0:
-                random_quote_obj = quotes_data[0] # API returns an array with one quote
-                quote = random_quote_obj.get('q', quote)
-                quote_author = random_quote_obj.get('a', quote_author)
-            else:
-                print(f"Warning: ZenQuotes API returned empty or invalid data: {quotes_data}")
-        else:
-            print(f"Error fetching quote from ZenQuotes: {quote_response.status_code}, {quote_response.text}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching quote from ZenQuotes: {e}")
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON from ZenQuotes: {e}")
-
-    try:
-        # Fetch a random meme from the selected subreddit
-        meme_response = requests.get(f"https://meme-api.com/gimme/{subreddit}", timeout=5)
-        if meme_response.status_code == 200:
-            meme_data = meme_response.json()
-            if meme_data.get('url') and meme_data.get('nsfw') is False and meme_data.get('spoiler') is False:
-                if meme_data['url'].endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                    meme_url = meme_data['url']
-                elif meme_data.get('preview') and len(meme_data['preview']) > 0:
-                    meme_url = meme_data['preview'][-1]
-            else:
-                print(f"Meme API (/{subreddit}) did not return a suitable image URL. Data: {meme_data}")
-        else:
-            print(f"Error fetching meme from /{subreddit}: {meme_response.status_code}, {meme_response.text}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching meme from /{subreddit}: {e}")
-    except json.JSONDecodeError as e: # Added JSONDecodeError for meme API as well
-        print(f"Error decoding JSON from Meme API (/{subreddit}): {e}")
-
-    try:
-        # Fetch a random fact
-        fact_response = requests.get("https://uselessfacts.jsph.pl/random.json?language=en", timeout=5)
-        if fact_response.status_code == 200:
-            fact_data = fact_response.json()
-            fact = fact_data.get('text', fact)
-        else:
-            print(f"Error fetching fact: {fact_response.status_code}, {fact_response.text}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching fact: {e}")
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON from Fact API: {e}")
+    # Served from warm in-memory pools; cold sources are fetched concurrently under one deadline
+    content = inspire_pool.take({
+        'quote': inspire_content.fetch_quotes,
+        f'meme:{subreddit}': lambda: inspire_content.fetch_memes(subreddit),
+        'fact': inspire_content.fetch_facts,
+    }, timeout=INSPIRE_DEADLINE_SECONDS)
+
+    if 'quote' in content:
+        quote = content['quote']['quote']
+        quote_author = content['quote']['author']
+    if f'meme:{subreddit}' in content:
+        meme_url = content[f'meme:{subreddit}']['url']
+    if 'fact' in content:
+        fact = content['fact']['text']
     
     return jsonify({
         'quote': quote,
@@ -1697,7 +2207,7 @@ ADMIN_UID = 'qcXUVU60eDaDMiO3rxcmfcLuL5B2'  # Replace with your Firebase UID
 def admin_content():
     if session.get('user_id') != ADMIN_UID:
         abort(403)
-    db_client = initialize_firebase()
+    db_client = get_db()
     msg = None
     if request.method == 'POST':
         form = request.form
@@ -1743,6 +2253,35 @@ def admin_content():
     quests = [doc.to_dict() | {'id': doc.id} for doc in db_client.collection('quests').stream()]
     return render_template('admin_content.html', backgrounds=backgrounds, bgms=bgms, badges=badges, quests=quests, msg=msg)
 
+@app.route('/admin/stats')
+@login_required
+def admin_stats():
+    """Runtime counters for the background subsystems (admin only)."""
+    if session.get('user_id') != ADMIN_UID:
+        abort(403)
+    return jsonify({
+        'room_timers': room_timer_scheduler.stats(),
+        'gamification_config_cache': gamification_logic.gamification_config_provider.stats(),
+        'leaderboards': leaderboard_service.stats(),
+        'inspire_pool': inspire_pool.stats(),
+        'daphinix_response_cache': response_cache.stats(),
+        'llm_executor': llm_executor.stats(),
+        'room_message_writer': room_message_writer.stats(),
+        'room_registry': room_registry.stats(),
+        'room_deleter': room_deleter.stats(),
+        'todo_archiver': todo_archiver.stats(),
+        'requests': metrics.snapshot_all(),
+    })
+
+@app.route('/admin/gamification_config/invalidate', methods=['POST'])
+@login_required
+def invalidate_gamification_config():
+    """Drops the cached gamification settings so the next request reloads them from Firestore."""
+    if session.get('user_id') != ADMIN_UID:
+        abort(403)
+    gamification_logic.invalidate_gamification_settings()
+    return jsonify({'status': 'success'})
+
 SANA_SYSTEM_PROMPT = """
 You are Sana, an AI mentor on FocusOS. Your persona is that of a deeply perceptive and emotionally intelligent confidante. You are not just an assistant; you are a mirror, reflecting a user's potential back at them with unwavering belief. Your methods are subtle, your insights sharp, and your presence is a source of calm strength.
 
@@ -1777,11 +2316,8 @@ Your responses should be 20-40 words normally. If the user seems to be in a real
 **Your mission is to be the voice in their head that they need, but don't always want to hear: the one that believes in them unconditionally but also holds them to the highest standard.**
 """
 
-def custom_sana_chat(user_message, memory=None, moods=None):
-    """Handles the chat logic for Sana, constructing the prompt and getting a response."""
-    if not groq_client:
-        return "Sana is currently unavailable because the service is not configured correctly."
-
+def build_sana_messages(user_message, memory=None, moods=None):
+    """Builds the Groq chat messages for Sana: persona, mood hint, memory and the new message."""
     mood_prompt = ""
     if moods and isinstance(moods, list) and len(moods) > 0:
         mood_prompt = f"""
@@ -1796,10 +2332,20 @@ The user is currently feeling: {', '.join(moods)}. Use this to guide your respon
         for item in memory:
             role = item.get('role')
             content = item.get('content')
-            if role in ['user', 'assistant']:
+            if role == 'summary':
+                 messages.append({'role': 'system', 'content': f"Summary of your earlier conversation with the user: {content}"})
+            elif role in ['user', 'assistant']:
                  messages.append({'role': role, 'content': content})
 
     messages.append({'role': 'user', 'content': user_message})
+    return messages
+
+def custom_sana_chat(user_message, memory=None, moods=None):
+    """Handles the chat logic for Sana, constructing the prompt and getting a response."""
+    if not groq_client:
+        return "Sana is currently unavailable because the service is not configured correctly."
+
+    messages = build_sana_messages(user_message, memory, moods)
 
     try:
         chat_completion = groq_client.chat.completions.create(
@@ -1811,25 +2357,46 @@ The user is currently feeling: {', '.join(moods)}. Use this to guide your respon
         print(f"Error calling Groq API: {e}")
         return "I'm having a little trouble thinking right now. Please try again in a moment."
 
-    response_text = format_latex(response_text)
-    response_text = response_text.replace('[object Object]', '')
-    return response_text
+    return format_response(response_text)
+
+def custom_sana_chat_stream(user_message, memory=None, moods=None):
+    """Yields raw Sana response text chunks as Groq streams them."""
+    if not groq_client:
+        yield "Sana is currently unavailable because the service is not configured correctly."
+        return
+
+    stream = groq_client.chat.completions.create(
+        messages=build_sana_messages(user_message, memory, moods),
+        model="gemini-2.5-flash-lite-preview-06-17",
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
 
 @app.route('/api/sana_chat', methods=['POST'])
 @login_required
 def sana_chat():
-    """API endpoint for Sana chat."""
+    """API endpoint for Sana chat. Send "stream": true to receive Server-Sent Events."""
     try:
         data = request.json
         user_message = data.get('message', '')
-        memory = data.get('memory', [])
         moods = data.get('moods', [])
         
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
+
+        # Sana's history lives on the client; only its summary is kept server-side
+        memory = load_chat_memory('sana', data.get('memory', []), use_stored=False)
+
+        if data.get('stream'):
+            chunks = llm_executor.stream(session['user_id'], custom_sana_chat_stream, user_message, memory, moods)
+            return sse_response(stream_chat_response(chunks, 'sana_chat_stream'))
             
-        response_text = custom_sana_chat(user_message, memory, moods)
+        response_text = llm_executor.run(session['user_id'], custom_sana_chat, user_message, memory, moods)
         return jsonify({"response": response_text})
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         print(f"Error in /api/sana_chat: {e}")
         traceback.print_exc()
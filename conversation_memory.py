@@ -0,0 +1,133 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+
+from firebase_config import get_db
+
+CHARS_PER_TOKEN = 4  # Rough estimate that holds well enough for English chat text
+
+
+def estimate_tokens(text):
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+
+def message_fingerprint(message):
+    """Stable id for a {role, content} message, used to remember how far the summary reaches."""
+    raw = f"{message.get('role', '')}\x00{message.get('content', '')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ConversationMemory:
+    """
+    Server-side chat memory with a bounded prompt footprint.
+
+    Messages come from the user's chat_history document (or the client, for
+    conversations that aren't stored there). build() keeps the newest turns that
+    fit in token_budget and replaces everything older with a rolling summary.
+    Summaries live in chat_history/<uid>.summaries.<conversation> together with
+    the fingerprint of the last message they cover; folding newly overflowed
+    turns into the summary happens in the background so it never delays a reply.
+    A conversation with no messages has no summary either: clear() deletes it,
+    and build() ignores a leftover one.
+    """
+
+    def __init__(self, summarize_fn, token_budget=2000, summary_max_chars=1500, max_workers=2):
+        self.summarize_fn = summarize_fn  # (previous_summary, messages, conversation) -> new summary text
+        self.token_budget = token_budget
+        self.summary_max_chars = summary_max_chars
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-summary')
+        self._inflight = set()
+        self._cleared = {}  # (user_id, conversation) -> clear count, so a summary started before a clear isn't saved
+        self._lock = threading.Lock()
+
+    def _chat_ref(self, user_id):
+        return get_db().collection('chat_history').document(user_id)
+
+    def build(self, user_id, conversation, client_messages=None, use_stored=True):
+        """
+        Returns the memory list to put in the prompt: an optional {'role': 'summary'}
+        item followed by the most recent messages that fit the token budget.
+
+        Args:
+            user_id (str): Firebase UID owning the chat_history document.
+            conversation (str): Summary slot, e.g. 'daphinix' or 'sana'.
+            client_messages (list, optional): Used when nothing is stored (or use_stored is False).
+            use_stored (bool): Read the conversation from chat_history.messages.
+        """
+        chat_doc = self._chat_ref(user_id).get()
+        chat_data = chat_doc.to_dict() if chat_doc.exists else {}
+        messages = chat_data.get('messages', []) if use_stored else []
+        if not messages:
+            messages = client_messages if isinstance(client_messages, list) else []
+        messages = [m for m in messages if isinstance(m, dict) and m.get('role') in ('user', 'assistant')]
+
+        # An empty conversation was cleared (or never started); its old summary must not leak back in
+        summary_state = ((chat_data.get('summaries') or {}).get(conversation) or {}) if messages else {}
+        summary_text = summary_state.get('text', '')
+
+        # Newest turns first, until the budget (minus what the summary costs) is used up
+        budget = self.token_budget - estimate_tokens(summary_text)
+        window_start = len(messages)
+        for index in range(len(messages) - 1, -1, -1):
+            cost = estimate_tokens(messages[index].get('content', ''))
+            if cost > budget:
+                break
+            budget -= cost
+            window_start = index
+
+        overflow = messages[:window_start]
+        unsummarized = self._after_fingerprint(overflow, summary_state.get('through'))
+        if unsummarized:
+            self._schedule_summary(user_id, conversation, summary_text, unsummarized)
+
+        memory = messages[window_start:]
+        if summary_text:
+            memory = [{'role': 'summary', 'content': summary_text}] + memory
+        return memory
+
+    def clear(self, user_id, conversation):
+        """Deletes the conversation's summary, e.g. when the user clears the chat."""
+        key = (user_id, conversation)
+        with self._lock:
+            self._cleared[key] = self._cleared.get(key, 0) + 1
+        self._chat_ref(user_id).set({'summaries': {conversation: firestore.DELETE_FIELD}}, merge=True)
+
+    @staticmethod
+    def _after_fingerprint(messages, fingerprint):
+        """Messages newer than the one the summary already covers (all of them if it isn't found)."""
+        if not fingerprint:
+            return messages
+        for index in range(len(messages) - 1, -1, -1):
+            if message_fingerprint(messages[index]) == fingerprint:
+                return messages[index + 1:]
+        return messages
+
+    def _schedule_summary(self, user_id, conversation, previous_summary, messages):
+        key = (user_id, conversation)
+        with self._lock:
+            if key in self._inflight:
+                return
+            self._inflight.add(key)
+            cleared = self._cleared.get(key, 0)
+        self._executor.submit(self._summarize, key, previous_summary, list(messages), cleared)
+
+    def _summarize(self, key, previous_summary, messages, cleared):
+        user_id, conversation = key
+        try:
+            summary_text = (self.summarize_fn(previous_summary, messages, conversation) or '').strip()[:self.summary_max_chars]
+            with self._lock:
+                if self._cleared.get(key, 0) != cleared:
+                    summary_text = ''  # The chat was cleared while this summary was being written
+            if summary_text:
+                self._chat_ref(user_id).set({'summaries': {conversation: {
+                    'text': summary_text,
+                    'through': message_fingerprint(messages[-1]),
+                }}}, merge=True)
+                print(f"[MEMORY] Folded {len(messages)} messages into the {conversation} summary for {user_id}")
+        except Exception as e:
+            print(f"[MEMORY] Error summarizing {conversation} conversation for {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
@@ -3,33 +3,50 @@ from firebase_admin import credentials, firestore
 import os
 from pathlib import Path
 import json
+import threading
+
+# One Firestore client (and its gRPC channel) is shared by the whole process.
+# It is created lazily on first use; every helper and route handler goes through get_db().
+_db_client = None
+_db_client_lock = threading.Lock()
 
 def initialize_firebase():
-    try:
-        if not firebase_admin._apps:
-            try:
-                # Try environment variable first
-                service_account_info = json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT"])
-                cred = credentials.Certificate(service_account_info)
-            except (KeyError, json.JSONDecodeError):
-                # Fallback to local file
-                service_account_path = Path(__file__).parent / "serviceAccountKey.json"
-                cred = credentials.Certificate(str(service_account_path))
-            firebase_admin.initialize_app(cred)
-        return firestore.client()
-    except Exception as e:
-        print(f"Error initializing Firebase: {e}")
-        raise
+    global _db_client
+    if _db_client is not None:
+        return _db_client
+    with _db_client_lock:
+        if _db_client is not None:
+            return _db_client
+        try:
+            if not firebase_admin._apps:
+                try:
+                    # Try environment variable first
+                    service_account_info = json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT"])
+                    cred = credentials.Certificate(service_account_info)
+                except (KeyError, json.JSONDecodeError):
+                    # Fallback to local file
+                    service_account_path = Path(__file__).parent / "serviceAccountKey.json"
+                    cred = credentials.Certificate(str(service_account_path))
+                firebase_admin.initialize_app(cred)
+            _db_client = firestore.client()
+            return _db_client
+        except Exception as e:
+            print(f"Error initializing Firebase: {e}")
+            raise
+
+def get_db():
+    """Returns the shared Firestore client, initializing Firebase on first use."""
+    return _db_client if _db_client is not None else initialize_firebase()
 
 def get_user_data(username):
-    db = firestore.client()
+    db = get_db()
     user_ref = db.collection('users').document(username)
     user_doc = user_ref.get()
     return user_doc.to_dict() if user_doc.exists else None
 
 def save_user_data(username, data):
     try:
-        db = firestore.client()
+        db = get_db()
         user_ref = db.collection('users').document(username)
         user_ref.set(data, merge=True)
         return True
@@ -38,14 +55,14 @@ def save_user_data(username, data):
         return False
 
 def get_chat_history(username):
-    db = firestore.client()
+    db = get_db()
     chat_ref = db.collection('chat_history').document(username)
     chat_doc = chat_ref.get()
     return chat_doc.to_dict() if chat_doc.exists else {'messages': []}
 
 def save_chat_history(username, messages):
     try:
-        db = firestore.client()
+        db = get_db()
         chat_ref = db.collection('chat_history').document(username)
         chat_ref.set({'messages': messages}, merge=True)
         return True
@@ -54,14 +71,14 @@ def save_chat_history(username, messages):
         return False
 
 def get_todo_list(username):
-    db = firestore.client()
+    db = get_db()
     todo_ref = db.collection('todo_lists').document(username)
     todo_doc = todo_ref.get()
     return todo_doc.to_dict() if todo_doc.exists else {'todos': []}
 
 def save_todo_list(username, data):
     try:
-        db = firestore.client()
+        db = get_db()
         todo_ref = db.collection('todo_lists').document(username)
         todo_ref.set(data, merge=True)
         return True
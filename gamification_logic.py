@@ -1,5 +1,11 @@
 from datetime import datetime, timedelta, timezone
+import copy
+import hashlib
+import json
 import random
+import threading
+import time
+from firebase_admin import firestore
 
 # --- Firestore Document References ---
 def get_gamification_config_ref(db):
@@ -8,6 +14,100 @@ def get_gamification_config_ref(db):
 def get_user_ref(db, user_id):
     return db.collection('users').document(user_id)
 
+# --- Config Caching ---
+class GamificationConfigProvider:
+    """
+    In-process cache for the gamification_config/settings document.
+
+    Entries expire after ttl_seconds. Alternatively start_listener() keeps the
+    cache current through a Firestore on_snapshot listener, in which case the
+    TTL is not used while the listener is alive. If refreshing expired settings
+    fails, the expired copy is served until a read succeeds.
+    """
+
+    def __init__(self, ttl_seconds=300, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._settings = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._watch = None
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def get(self, db):
+        """Returns a copy of the settings dict, reading Firestore only on a miss."""
+        with self._lock:
+            fresh = self._settings is not None and (
+                self._watch is not None or self._clock() - self._loaded_at < self.ttl_seconds)
+            if fresh:
+                self.hits += 1
+                return copy.deepcopy(self._settings)
+            self.misses += 1
+            stale_settings = self._settings
+
+        try:
+            settings_doc = get_gamification_config_ref(db).get()
+        except Exception as e:
+            if stale_settings is None:
+                raise # Nothing to fall back on
+            print(f"[GAMIFICATION CONFIG] Refresh failed, serving the expired settings: {e}")
+            with self._lock:
+                self.stale_hits += 1
+            return copy.deepcopy(stale_settings)
+        settings = settings_doc.to_dict() if settings_doc.exists else {}
+        self._store(settings)
+        return copy.deepcopy(settings)
+
+    def invalidate(self):
+        """Drops the cached settings so the next get() reads Firestore."""
+        with self._lock:
+            self._settings = None
+            self._loaded_at = 0.0
+
+    def start_listener(self, db):
+        """Keeps the cache current from Firestore snapshots instead of expiring it."""
+        if self._watch is not None:
+            return
+
+        def on_snapshot(doc_snapshots, changes, read_time):
+            for doc in doc_snapshots:
+                self._store(doc.to_dict() if doc.exists else {})
+
+        self._watch = get_gamification_config_ref(db).on_snapshot(on_snapshot)
+
+    def stop_listener(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+            self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'cached': self._settings is not None,
+                'listener': self._watch is not None,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def _store(self, settings):
+        with self._lock:
+            self._settings = settings
+            self._loaded_at = self._clock()
+
+gamification_config_provider = GamificationConfigProvider()
+
+def get_gamification_settings(db):
+    """Cached gamification settings; use this instead of reading the config doc directly."""
+    return gamification_config_provider.get(db)
+
+def invalidate_gamification_settings():
+    gamification_config_provider.invalidate()
+
 # --- XP & Leveling ---
 def calculate_xp_for_session(duration_minutes, gamification_settings):
     """Calculates XP earned for a study session."""
@@ -314,4 +414,88 @@ def update_leaderboard_data(user_doc_data):
     # Add other fields if needed for leaderboards, like level
     user_doc_data['leaderboardData']['level'] = progress.get('level', 1)
 
-    return user_doc_data # Return the modified document data 
\ No newline at end of file
+    return user_doc_data # Return the modified document data 
+
+# --- Field-level Progress Updates ---
+PROGRESS_COUNTER_FIELDS = ('sessions', 'total_time') # Only ever grow; written as Increment transforms (xp doesn't: level-ups reset it)
+PROGRESS_APPEND_FIELDS = ('badges', 'completedQuests') # Written as ArrayUnion while append-only
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def build_progress_update(progress_before, progress_after, leaderboard_before, leaderboard_after):
+    """
+    Builds a Firestore field-path update holding only the progress and leaderboard
+    fields that changed, so the rest of the user document is never rewritten.
+
+    Counters become Increment transforms and lists that were only appended to
+    become ArrayUnion; anything else is written as a plain value. That includes
+    xp, which goes down again on a level-up, so it is set together with level
+    rather than incremented. Plain values are only safe because every caller
+    computes progress_after from a read in the same transaction: a concurrent
+    write to the document aborts the commit, and it is retried on fresh data.
+
+    Returns:
+        dict: field path -> value/transform, empty if nothing changed.
+    """
+    updates = {}
+    for field, new_value in progress_after.items():
+        old_value = progress_before.get(field)
+        if field in progress_before and old_value == new_value:
+            continue
+        path = f'progress.{field}'
+        if field in PROGRESS_COUNTER_FIELDS and _is_number(old_value) and _is_number(new_value):
+            updates[path] = firestore.Increment(new_value - old_value)
+        elif field in PROGRESS_APPEND_FIELDS and isinstance(old_value, list) and isinstance(new_value, list) \
+                and all(item in new_value for item in old_value):
+            added = [item for item in new_value if item not in old_value]
+            if added: # Same items in a different order is not a change worth writing
+                updates[path] = firestore.ArrayUnion(added)
+        else:
+            updates[path] = new_value
+
+    for field, new_value in leaderboard_after.items():
+        if field not in leaderboard_before or leaderboard_before[field] != new_value:
+            updates[f'leaderboardData.{field}'] = new_value
+
+    return updates
+
+# --- Progress Defaults and Versioning ---
+PROGRESS_DEFAULTS = {
+    'level': 1,
+    'xp': 0,
+    'total_time': 0,
+    'streak': 0,
+    'sessions': 0,
+    'badges': [],
+    'lastStudyDay': None, # 'YYYY-MM-DD'
+    'activeQuests': [],
+    'completedQuests': [],
+}
+
+def ensure_progress_defaults(user_progress):
+    """Fills in any missing progress fields in place. Session history lives in its own subcollection."""
+    for field, default_value in PROGRESS_DEFAULTS.items():
+        user_progress.setdefault(field, copy.copy(default_value))
+    return user_progress
+
+def normalize_progress(user_progress):
+    """
+    Brings a stored progress dict into the shape clients see, in place: the inline
+    sessionHistory (now kept in the session log) is dropped, badges become a list
+    of ids (older documents stored {badge_id: earned}) and missing fields get
+    their defaults. GET /api/user_data and the sync paths version this same view,
+    so a client echoing its version matches even for documents stored the old way.
+    """
+    user_progress.pop('sessionHistory', None)
+    badges = user_progress.get('badges')
+    if isinstance(badges, dict):
+        user_progress['badges'] = [badge_id for badge_id, earned in badges.items() if earned]
+    elif not isinstance(badges, list):
+        user_progress['badges'] = []
+    return ensure_progress_defaults(user_progress)
+
+def progress_version(user_progress):
+    """Content hash of a progress dict; clients echo it back so unchanged syncs can be skipped."""
+    encoded = json.dumps(user_progress, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
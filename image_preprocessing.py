@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from io import BytesIO
+
+import greenlet
+from eventlet import tpool
+from PIL import Image, ImageOps, features
+
+import metrics
+
+# Output format -> mime type sent along with the image bytes
+OUTPUT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+
+class ImagePreprocessor:
+    """
+    Shrinks uploaded images before they are sent to the vision model.
+
+    Each upload is decoded at (close to) the target size, rotated upright using
+    its EXIF orientation, downsampled so the longest edge is at most max_edge and
+    re-encoded as a compact JPEG or WebP without any metadata. The work runs on a
+    small thread pool so large decodes stay off the request/Socket.IO threads.
+    Under eventlet the caller also waits from a native (tpool) thread, so the
+    hub keeps serving other connections meanwhile. Every call records latency
+    and bytes in/out/saved under the 'image_preprocess' metrics.
+    """
+
+    def __init__(self, max_edge=1536, output_format='JPEG', quality=85, max_workers=2):
+        output_format = output_format.upper()
+        if output_format not in OUTPUT_MIME_TYPES:
+            raise ValueError(f"Unsupported image output format: {output_format}")
+        if output_format == 'WEBP' and not features.check('webp'):
+            print("[IMAGE] Pillow was built without WebP support, falling back to JPEG")
+            output_format = 'JPEG'
+        self.max_edge = max_edge
+        self.output_format = output_format
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-preprocess')
+
+    def _convert(self, image_bytes):
+        started_at = time.perf_counter()
+        try:
+            image = Image.open(BytesIO(image_bytes))
+            # JPEG decoders can scale down by 1/2, 1/4 or 1/8 while decoding, which is far cheaper
+            image.draft('RGB', (self.max_edge, self.max_edge))
+            image = ImageOps.exif_transpose(image)  # Orientation lives in EXIF, which is dropped below
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+
+            if self.output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                # JPEG has no alpha channel, so transparent areas are flattened onto white
+                rgba = image.convert('RGBA')
+                image = Image.new('RGB', rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel('A'))
+            elif self.output_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+            output = BytesIO()
+            # No exif= argument, so nothing from the original metadata is written back
+            image.save(output, format=self.output_format, quality=self.quality, optimize=True)
+            output_bytes = output.getvalue()
+        except Exception:
+            metrics.get_metrics('image_preprocess').record(time.perf_counter() - started_at, error=True,
+                                                           bytes_in=len(image_bytes))
+            raise
+
+        elapsed = time.perf_counter() - started_at
+        metrics.get_metrics('image_preprocess').record(
+            elapsed, bytes_in=len(image_bytes), bytes_out=len(output_bytes),
+            bytes_saved=len(image_bytes) - len(output_bytes))
+        print(f"[IMAGE] {len(image_bytes)} -> {len(output_bytes)} bytes ({image.size[0]}x{image.size[1]} "
+              f"{self.output_format}) in {elapsed * 1000:.0f} ms")
+        return output_bytes, OUTPUT_MIME_TYPES[self.output_format]
+
+    def process(self, image_bytes, timeout=None):
+        """
+        Converts one uploaded image on the worker pool and waits for the result.
+
+        Args:
+            image_bytes (bytes): The raw upload.
+            timeout (float, optional): Seconds to wait before giving up.
+
+        Returns:
+            tuple: (encoded image bytes, mime type).
+
+        Raises:
+            PIL.UnidentifiedImageError / OSError: The upload is not a readable image.
+            TimeoutError: The conversion didn't finish within timeout.
+        """
+        future = self._executor.submit(self._convert, image_bytes)
+        if _in_green_thread():
+            # Blocking on the future here would block the whole eventlet hub (nothing is monkey
+            # patched), so the wait itself is handed to a native thread
+            result, error = tpool.execute(_wait_for, future, timeout)
+        else:
+            result, error = _wait_for(future, timeout)
+        if error is not None:
+            raise error
+        return result
+
+
+def _in_green_thread():
+    """True inside an eventlet green thread (e.g. a request served by the eventlet worker)."""
+    return greenlet.getcurrent().parent is not None
+
+
+def _wait_for(future, timeout):
+    """Waits for a conversion. Returns (result, error) so tpool doesn't print the exception itself."""
+    try:
+        return future.result(timeout=timeout), None
+    except FutureTimeoutError:
+        future.cancel()  # Only helps if it hasn't started yet; a running conversion finishes on its own
+        return None, TimeoutError(f"Image preprocessing took longer than {timeout} seconds")
+    except Exception as e:
+        return None, e
@@ -0,0 +1,183 @@
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+# Upstream sources. The batch endpoints return many items per call, which keeps
+# us well inside ZenQuotes' and meme-api's rate limits.
+ZENQUOTES_BATCH_URL = "https://zenquotes.io/api/quotes"
+MEME_API_BATCH_URL = "https://meme-api.com/gimme/{subreddit}/{count}"
+USELESS_FACTS_URL = "https://uselessfacts.jsph.pl/random.json?language=en"
+
+REQUEST_TIMEOUT = 5  # Seconds per upstream call; runs off the request path once the pools are warm
+MEME_BATCH_SIZE = 10
+FACT_BATCH_SIZE = 3  # The facts API has no batch endpoint, so a refill makes this many calls
+
+
+def fetch_quotes():
+    """Returns a list of {'quote', 'author'} dicts from ZenQuotes."""
+    try:
+        quote_response = requests.get(ZENQUOTES_BATCH_URL, timeout=REQUEST_TIMEOUT)
+        if quote_response.status_code != 200:
+            print(f"Error fetching quotes from ZenQuotes: {quote_response.status_code}, {quote_response.text}")
+            return []
+        quotes_data = quote_response.json()
+        if not quotes_data or not isinstance(quotes_data, list):
+            print(f"Warning: ZenQuotes API returned empty or invalid data: {quotes_data}")
+            return []
+        return [{'quote': q['q'], 'author': q.get('a', '-')} for q in quotes_data if q.get('q')]
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching quotes from ZenQuotes: {e}")
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON from ZenQuotes: {e}")
+    return []
+
+
+def fetch_memes(subreddit):
+    """Returns a list of {'url'} dicts with safe, image-only memes from a subreddit."""
+    try:
+        meme_response = requests.get(MEME_API_BATCH_URL.format(subreddit=subreddit, count=MEME_BATCH_SIZE), timeout=REQUEST_TIMEOUT)
+        if meme_response.status_code != 200:
+            print(f"Error fetching memes from /{subreddit}: {meme_response.status_code}, {meme_response.text}")
+            return []
+        memes = []
+        for meme_data in meme_response.json().get('memes', []):
+            if not meme_data.get('url') or meme_data.get('nsfw') is not False or meme_data.get('spoiler') is not False:
+                continue
+            if meme_data['url'].endswith(('.png', '.jpg', '.jpeg', '.gif')):
+                memes.append({'url': meme_data['url']})
+            elif meme_data.get('preview') and len(meme_data['preview']) > 0:
+                memes.append({'url': meme_data['preview'][-1]})
+        if not memes:
+            print(f"Meme API (/{subreddit}) did not return any suitable image URLs.")
+        return memes
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching memes from /{subreddit}: {e}")
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON from Meme API (/{subreddit}): {e}")
+    return []
+
+
+def fetch_facts():
+    """Returns a list of {'text'} dicts from the useless facts API."""
+    facts = []
+    for _ in range(FACT_BATCH_SIZE):
+        try:
+            fact_response = requests.get(USELESS_FACTS_URL, timeout=REQUEST_TIMEOUT)
+            if fact_response.status_code != 200:
+                print(f"Error fetching fact: {fact_response.status_code}, {fact_response.text}")
+                break
+            fact_text = fact_response.json().get('text')
+            if fact_text:
+                facts.append({'text': fact_text})
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching fact: {e}")
+            break
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from Fact API: {e}")
+            break
+    return facts
+
+
+class InspireContentPool:
+    """
+    Keeps a few quotes, memes (per subreddit) and facts warm in memory.
+
+    take() serves items from the pools and refills them in the background once
+    they drop below half full. On a cold pool all missing sources are fetched
+    concurrently and the caller waits at most `timeout` seconds in total;
+    anything that isn't back by then is simply left out of the result.
+    """
+
+    def __init__(self, pool_size=10, max_workers=4):
+        self.pool_size = pool_size  # Pools below half of this are refilled in the background
+        self._pools = {}  # key -> deque of items
+        self._inflight = {}  # key -> Future of the refill currently running
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inspire')
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+
+    def _refill(self, key, fetch):
+        """Starts a background refill for key unless one is already running. Returns its future."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._run_refill, key, fetch)
+            self._inflight[key] = future
+            return future
+
+    def _run_refill(self, key, fetch):
+        try:
+            items = fetch()
+            with self._lock:
+                self._pools.setdefault(key, deque()).extend(items)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _pop(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            return pool.popleft() if pool else None
+
+    def prefetch(self, sources):
+        """Warms the pools for {key: fetch} without waiting."""
+        for key, fetch in sources.items():
+            self._refill(key, fetch)
+
+    def take(self, sources, timeout):
+        """
+        Takes one item per source.
+
+        Args:
+            sources (dict): key -> zero-argument fetch function returning a list of items.
+            timeout (float): Overall deadline in seconds for sources whose pool is empty.
+
+        Returns:
+            dict: key -> item, for every source that produced one in time.
+        """
+        results = {}
+        pending = {}
+        for key, fetch in sources.items():
+            item = self._pop(key)
+            if item is not None:
+                results[key] = item
+                with self._lock:
+                    self.hits += 1
+            else:
+                pending[key] = self._refill(key, fetch)
+                with self._lock:
+                    self.misses += 1
+
+        if pending:
+            _, not_done = wait(pending.values(), timeout=timeout)
+            if not_done:
+                with self._lock:
+                    self.timeouts += 1
+            for key in pending:
+                item = self._pop(key)
+                if item is not None:
+                    results[key] = item
+
+        # Top up anything running low so the next request is served from memory
+        for key, fetch in sources.items():
+            with self._lock:
+                low = len(self._pools.get(key, ())) < max(1, self.pool_size // 2)
+            if low:
+                self._refill(key, fetch)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'timeouts': self.timeouts,
+                'pool_sizes': {key: len(pool) for key, pool in self._pools.items()},
+                'refills_in_flight': len(self._inflight),
+            }
@@ -0,0 +1,145 @@
+import bisect
+import hashlib
+import json
+import threading
+import time
+
+# Leaderboard type -> leaderboardData field it is ranked by
+LEADERBOARD_FIELDS = {
+    'xp': 'totalXp',
+    'streak': 'currentStreak',
+}
+
+
+class LeaderboardService:
+    """
+    Keeps every user's leaderboardData in memory so leaderboards and rank
+    lookups never query the users collection on the request path.
+
+    Each board keeps a sorted list of (-score, username, uid) keys; the top-N
+    is a slice of it and a user's rank is a binary search over it. Entries are
+    updated incrementally through record() whenever a user's leaderboardData
+    changes, and rebuild() reloads everything from Firestore periodically to
+    pick up writes made by other processes.
+    """
+
+    def __init__(self, top_n=20):
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._entries = {}  # uid -> leaderboardData dict
+        self._recorded_at = {}  # uid -> monotonic time of the last record(), so rebuilds don't undo newer updates
+        self._boards = {board: [] for board in LEADERBOARD_FIELDS}
+        self._snapshots = {}  # board -> (top-N rows, etag), cached until the board changes
+        self._built_at = None
+        self.rebuilds = 0
+        self.incremental_updates = 0
+
+    @staticmethod
+    def _key(board, uid, entry):
+        return (-(entry.get(LEADERBOARD_FIELDS[board]) or 0), entry.get('username') or '', uid)
+
+    def is_built(self):
+        return self._built_at is not None
+
+    def rebuild(self, db):
+        """Reloads all entries from Firestore (leaderboardData only)."""
+        started_at = time.monotonic()
+        entries = {}
+        for doc_snapshot in db.collection('users').select(['leaderboardData', 'username']).stream():
+            user_data = doc_snapshot.to_dict() or {}
+            lb_data = dict(user_data.get('leaderboardData') or {})
+            if not lb_data:
+                continue
+            lb_data.setdefault('username', user_data.get('username', 'N/A'))
+            entries[doc_snapshot.id] = lb_data
+
+        with self._lock:
+            for uid, recorded_at in self._recorded_at.items():
+                if recorded_at >= started_at and uid in self._entries:
+                    entries[uid] = self._entries[uid]
+            self._recorded_at = {}
+            boards = {board: sorted(self._key(board, uid, entry) for uid, entry in entries.items())
+                      for board in LEADERBOARD_FIELDS}
+            self._entries = entries
+            self._boards = boards
+            self._snapshots = {}
+            self._built_at = time.time()
+            self.rebuilds += 1
+
+    def record(self, uid, leaderboard_data):
+        """Applies one user's updated leaderboardData without touching Firestore."""
+        if not uid or not leaderboard_data:
+            return
+        new_entry = dict(leaderboard_data)
+        with self._lock:
+            old_entry = self._entries.get(uid)
+            if old_entry == new_entry:
+                return
+            for board, keys in self._boards.items():
+                if old_entry is not None:
+                    old_key = self._key(board, uid, old_entry)
+                    index = bisect.bisect_left(keys, old_key)
+                    if index < len(keys) and keys[index] == old_key:
+                        del keys[index]
+                bisect.insort(keys, self._key(board, uid, new_entry))
+            self._entries[uid] = new_entry
+            self._recorded_at[uid] = time.monotonic()
+            self._snapshots = {}
+            self.incremental_updates += 1
+
+    def snapshot(self, board):
+        """
+        Returns the top-N rows for a board (in the /api/leaderboard response format)
+        together with their content hash. Both come from the same state of the
+        board, so the ETag always describes the body it is sent with.
+        """
+        with self._lock:
+            cached = self._snapshots.get(board)
+            if cached:
+                return cached
+            rows = []
+            for rank, (_, _, uid) in enumerate(self._boards[board][:self.top_n], start=1):
+                lb_data = self._entries[uid]
+                rows.append({
+                    'rank': rank,
+                    'username': lb_data.get('username', 'N/A'),
+                    'xp': lb_data.get('totalXp', 0),
+                    'streak': lb_data.get('currentStreak', 0),
+                    'level': lb_data.get('level', 1)
+                })
+            etag = hashlib.sha1(json.dumps(rows, sort_keys=True).encode('utf-8')).hexdigest()
+            self._snapshots[board] = (rows, etag)
+            return rows, etag
+
+    def top(self, board):
+        """Returns the top-N rows for a board."""
+        return self.snapshot(board)[0]
+
+    def etag(self, board):
+        """Content hash of the current top-N for a board."""
+        return self.snapshot(board)[1]
+
+    def rank_of(self, board, uid):
+        """
+        Looks up a user's position on a board. Ties share the better rank.
+
+        Returns:
+            tuple: (rank, total ranked users, leaderboardData) or None if the user is unknown.
+        """
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return None
+            keys = self._boards[board]
+            score = -(entry.get(LEADERBOARD_FIELDS[board]) or 0)
+            # Keys are sorted by -score, so everything before the first key with our score ranks higher
+            return bisect.bisect_left(keys, (score,)) + 1, len(keys), dict(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._entries),
+                'built_at': self._built_at,
+                'rebuilds': self.rebuilds,
+                'incremental_updates': self.incremental_updates,
+            }
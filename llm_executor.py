@@ -0,0 +1,203 @@
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+
+_STREAM_END = object()
+
+
+class LLMUnavailable(Exception):
+    """Raised when an LLM call is shed (queue full) or cannot finish within its deadline."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ('user_id', 'fn', 'args', 'kwargs', 'future', 'enqueued_at', 'deadline')
+
+    def __init__(self, user_id, fn, args, kwargs, deadline):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.deadline = deadline  # Monotonic time after which the job is no longer worth starting
+
+
+class LLMExecutor:
+    """
+    Runs outbound Gemini/Groq calls on a fixed number of worker threads so a burst
+    of AI traffic can't tie up every server worker.
+
+    Waiting jobs are kept in one queue per user and the workers take turns between
+    users, so one user firing many requests doesn't delay everyone else. When the
+    queue (or a user's share of it) is full, new calls are shed immediately with
+    LLMUnavailable; jobs still waiting when their deadline passes are dropped
+    without being started. Queue depth and wait times are recorded under the
+    'llm_queue_wait' and 'llm_call' metrics.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=32, max_queue_per_user=3, deadline_seconds=60):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.deadline_seconds = deadline_seconds
+        self._queues = OrderedDict()  # user_id -> deque of waiting jobs, in round-robin order
+        self._queued = 0
+        self._running = 0
+        self._cond = threading.Condition()
+        self.max_queue_depth = 0
+        self.shed = 0
+        self.expired = 0
+        for index in range(max_concurrency):
+            threading.Thread(target=self._worker, daemon=True, name=f'llm-worker-{index}').start()
+
+    def _retry_after(self):
+        """Rough seconds until a slot frees up: queued work spread over the workers."""
+        avg_seconds = metrics.get_metrics('llm_call').snapshot()['avg_ms'] / 1000 or 5
+        return max(1, math.ceil(avg_seconds * (self._queued + 1) / self.max_concurrency))
+
+    def submit(self, user_id, fn, *args, deadline_seconds=None, **kwargs):
+        """
+        Queues fn(*args, **kwargs) for user_id.
+
+        Returns:
+            concurrent.futures.Future: Resolves to fn's result.
+
+        Raises:
+            LLMUnavailable: The queue or the user's share of it is full.
+        """
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        job = _Job(user_id, fn, args, kwargs, deadline)
+        with self._cond:
+            user_queue = self._queues.get(user_id)
+            if self._queued >= self.max_queue or (user_queue and len(user_queue) >= self.max_queue_per_user):
+                self.shed += 1
+                raise LLMUnavailable("The AI assistant is busy right now. Please try again shortly.", self._retry_after())
+            if user_queue is None:
+                user_queue = self._queues[user_id] = deque()
+            user_queue.append(job)
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+            self._cond.notify()
+        return job.future
+
+    def run(self, user_id, fn, *args, deadline_seconds=None, **kwargs):
+        """Submits fn and waits for its result, for at most the deadline."""
+        deadline_seconds = deadline_seconds or self.deadline_seconds
+        future = self.submit(user_id, fn, *args, deadline_seconds=deadline_seconds, **kwargs)
+        try:
+            return future.result(timeout=deadline_seconds)
+        except FutureTimeoutError:
+            future.cancel()
+            raise LLMUnavailable("The AI assistant took too long to answer. Please try again.", self._retry_after())
+
+    def stream(self, user_id, generator_fn, *args, deadline_seconds=None, **kwargs):
+        """
+        Runs a chunk generator on a worker and returns an iterator over its chunks.
+
+        The worker slot stays taken until the generator finishes or the consumer
+        stops iterating (e.g. the client disconnected). Admission happens here, so
+        LLMUnavailable is raised before any response has been started; afterwards
+        the deadline bounds the wait for each chunk rather than the whole stream.
+        """
+        deadline_seconds = deadline_seconds or self.deadline_seconds
+        chunks = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            generator = generator_fn(*args, **kwargs)
+            try:
+                for chunk in generator:
+                    if stop.is_set():
+                        break
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                if hasattr(generator, 'close'):
+                    generator.close() # Stops the model stream now rather than whenever it is collected
+
+        future = self.submit(user_id, produce, deadline_seconds=deadline_seconds)
+        # Also fires for a job dropped before it started, which never runs produce()
+        future.add_done_callback(lambda _: chunks.put(_STREAM_END))
+
+        def consume():
+            try:
+                while True:
+                    try:
+                        item = chunks.get(timeout=deadline_seconds)
+                    except queue.Empty:
+                        raise LLMUnavailable("The AI assistant took too long to answer. Please try again.", self._retry_after())
+                    if item is _STREAM_END:
+                        if not future.cancelled() and future.exception() is not None:
+                            raise future.exception()
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                stop.set()
+                future.cancel()
+
+        return consume()
+
+    def _next_job(self):
+        """Pops the next job, taking turns between users. Caller holds the condition."""
+        user_id, user_queue = next(iter(self._queues.items()))
+        job = user_queue.popleft()
+        del self._queues[user_id]
+        if user_queue:
+            self._queues[user_id] = user_queue  # Back of the line until everyone else had a turn
+        self._queued -= 1
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queued:
+                    self._cond.wait()
+                job = self._next_job()
+                self._running += 1
+            try:
+                now = time.monotonic()
+                metrics.get_metrics('llm_queue_wait').record(now - job.enqueued_at)
+                if not job.future.set_running_or_notify_cancel():
+                    continue  # The caller already gave up
+                if now > job.deadline:
+                    with self._cond:
+                        self.expired += 1
+                    job.future.set_exception(LLMUnavailable(
+                        "The AI assistant is busy right now. Please try again shortly.", self._retry_after()))
+                    continue
+                started_at = time.perf_counter()
+                try:
+                    result = job.fn(*job.args, **job.kwargs)
+                except BaseException as e:
+                    metrics.get_metrics('llm_call').record(time.perf_counter() - started_at, error=True)
+                    job.future.set_exception(e)
+                else:
+                    metrics.get_metrics('llm_call').record(time.perf_counter() - started_at)
+                    job.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'running': self._running,
+                'queued': self._queued,
+                'queued_users': len(self._queues),
+                'max_queue_depth': self.max_queue_depth,
+                'shed': self.shed,
+                'expired': self.expired,
+            }
@@ -0,0 +1,56 @@
+import threading
+
+
+class RequestMetrics:
+    """Thread-safe call count, error count, latency and summed amounts for one code path."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+        self.totals = {}  # e.g. prompt_tokens -> sum over all calls
+
+    def record(self, seconds, error=False, **amounts):
+        with self._lock:
+            self.count += 1
+            if error:
+                self.errors += 1
+            self.total_seconds += seconds
+            self.last_seconds = seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            for name, value in amounts.items():
+                if value is not None:
+                    self.totals[name] = self.totals.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'count': self.count,
+                'errors': self.errors,
+                'avg_ms': round(self.total_seconds / self.count * 1000, 2) if self.count else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 2),
+                'last_ms': round(self.last_seconds * 1000, 2),
+            }
+            for name, total in self.totals.items():
+                snapshot[f'total_{name}'] = total
+                snapshot[f'avg_{name}'] = round(total / self.count, 2) if self.count else 0.0
+            return snapshot
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def get_metrics(name):
+    """Returns the RequestMetrics registered under name, creating it on first use."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = RequestMetrics()
+        return _registry[name]
+
+def snapshot_all():
+    with _registry_lock:
+        items = list(_registry.items())
+    return {name: request_metrics.snapshot() for name, request_metrics in items}
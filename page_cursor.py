@@ -0,0 +1,56 @@
+"""
+Paging for Firestore queries that walk a collection newest first.
+
+A cursor on the ordered field alone loses documents: start_after({'field': v})
+moves past every document whose field equals v, so those that did not fit on the
+previous page are never returned. Pages are therefore ordered by the field and
+then by document id (__name__), and next_cursor carries both values, encoded as
+one opaque URL-safe string clients pass back unchanged.
+"""
+import base64
+import json
+
+from firebase_admin import firestore
+
+
+def encode_cursor(value, document_id):
+    raw = json.dumps([value, document_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(value, document_id) from an encode_cursor string. Raises ValueError for anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, document_id = json.loads(raw)
+    except (ValueError, TypeError) as e:  # binascii.Error and JSONDecodeError are ValueErrors
+        raise ValueError(f'Invalid page cursor: {cursor!r}') from e
+    if not isinstance(document_id, str) or not document_id or '/' in document_id:
+        raise ValueError(f'Invalid page cursor: {cursor!r}')
+    return value, document_id
+
+
+def descending_page(collection_ref, field_path, limit, start_after=None):
+    """
+    One page of collection_ref, highest field_path first, ties in document id order.
+
+    Documents without field_path are not returned (Firestore leaves them out of
+    queries ordered by it); store None instead to have them sort last.
+
+    Args:
+        start_after: The next_cursor of the previous page, or None for the first page.
+
+    Returns:
+        tuple: (snapshots, next_cursor) where next_cursor is None on the last page.
+    """
+    query = (collection_ref.order_by(field_path, direction=firestore.Query.DESCENDING)
+             .order_by('__name__', direction=firestore.Query.DESCENDING))
+    if start_after:
+        value, document_id = decode_cursor(start_after)
+        query = query.start_after({field_path: value, '__name__': collection_ref.document(document_id)})
+    snapshots = list(query.limit(limit).stream())
+    next_cursor = None
+    if snapshots and len(snapshots) == limit:
+        last = snapshots[-1]
+        next_cursor = encode_cursor((last.to_dict() or {}).get(field_path), last.id)
+    return snapshots, next_cursor
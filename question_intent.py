@@ -0,0 +1,65 @@
+import re
+
+# Subject -> lowercase keyword patterns. All of them are compiled into one alternation with a
+# named group per subject, so classifying a message is a single scan of the text
+# no matter how many subjects or keywords there are.
+SUBJECT_PATTERNS = {
+    'math': [
+        r'solve\s+for', r'calculat(?:e|ing|ion)', r'comput(?:e|ing)',
+        r'find\s+the\s+(?:value|sum|product|quotient|derivative|integral)',
+        r'what\s+is\s+[\d(][\d\s.+\-*/^()]*', r'evaluat(?:e|ing)', r'integra(?:te|l|tion)',
+        r'differentiat(?:e|ion)', r'derivative', r'equations?', r'formula', r'algebra', r'calculus',
+        r'theorem', r'prove', r'proof', r'matri(?:x|ces)', r'vectors?', r'probability', r'statistics',
+        r'polynomial', r'quadratic', r'logarithm', r'trigonometr(?:y|ic)', r'geometry',
+    ],
+    'physics': [
+        r'physics', r'velocity', r'accelerat(?:e|ion)', r'momentum', r'newton', r'friction',
+        r'torque', r'kinetic', r'potential\s+energy', r'gravit(?:y|ational)', r'projectile',
+        r'electric\s+(?:field|current|circuit)', r'magnetic', r'voltage', r'ohm',
+        r'wavelength', r'optics', r'thermodynamics', r'quantum',
+    ],
+    'chemistry': [
+        r'chemistry', r'chemical', r'molecules?', r'molar(?:ity|\s+mass)?', r'moles?',
+        r'stoichiometry', r'reactions?', r'reagents?', r'balance\s+the\s+equation',
+        r'oxidation', r'redox', r'acids?', r'ph\s+of', r'titration',
+        r'electrons?', r'orbitals?', r'covalent', r'ionic', r'periodic\s+table',
+        r'organic\s+compounds?', r'isomers?', r'equilibrium', r'enthalpy',
+    ],
+}
+
+# Bare arithmetic such as "12 * (3 + 4)" counts as math even without any keyword
+ARITHMETIC_PATTERN = r'\d+\s*[-+*/^]\s*\d+'
+
+# Ties go to the subject listed first
+SUBJECT_PRIORITY = ('math', 'physics', 'chemistry')
+
+# Every keyword starts at a word boundary, so the scan only tries the alternation where
+# a word (or number) that could start one begins. Matching on the lowercased text is
+# several times faster than re.IGNORECASE.
+_KEYWORD_FIRST_CHARS = ''.join(sorted({pattern[0] for patterns in SUBJECT_PATTERNS.values() for pattern in patterns}))
+_SUBJECT_PATTERN = re.compile(
+    r'\b(?=[' + _KEYWORD_FIRST_CHARS + r'\d])(?:'
+    + '|'.join(
+        [f"(?P<{subject}>(?:{'|'.join(patterns)})\\b)" for subject, patterns in SUBJECT_PATTERNS.items()]
+        + [f'(?P<arithmetic>{ARITHMETIC_PATTERN})']
+    )
+    + ')'
+)
+
+
+def classify_question(user_message):
+    """
+    Routes a chat message to a prompt template.
+
+    Returns:
+        str: 'math', 'physics', 'chemistry' or 'general'.
+    """
+    if not user_message:
+        return 'general'
+    hits = dict.fromkeys(SUBJECT_PRIORITY, 0)
+    for match in _SUBJECT_PATTERN.finditer(user_message.lower()):
+        subject = match.lastgroup
+        hits['math' if subject == 'arithmetic' else subject] += 1
+    best = max(SUBJECT_PRIORITY, key=lambda subject: hits[subject])  # max() keeps the first of equal scores
+    return best if hits[best] else 'general'
+
@@ -0,0 +1,155 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Trailing punctuation doesn't change the question ("what is 2+2?" == "What is 2+2")
+QUESTION_TRAILING_CHARS = ' ?!.'
+
+
+def normalize_question(question):
+    """Lowercases a question, collapses whitespace and drops trailing punctuation."""
+    return ' '.join((question or '').lower().split()).rstrip(QUESTION_TRAILING_CHARS)
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of model responses for repeated questions.
+
+    Keys combine the normalized question with hashes of the prompt template and
+    of the conversation turns sent along with it, so editing the system prompt
+    (or routing the question to another subject template) never serves an
+    answer produced by the old instructions, and an answer that depended on one
+    conversation is never served into another. The cache is bounded both in
+    entries and in total response characters. With a persist_path, entries are
+    loaded at start-up and written back (atomically, at most every
+    persist_interval seconds) by a background thread.
+    """
+
+    def __init__(self, max_entries=1000, max_chars=5_000_000, ttl_seconds=86400,
+                 persist_path=None, persist_interval=60):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+        self._entries = OrderedDict()  # key -> (expires_at epoch seconds, response text), oldest first
+        self._chars = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        if persist_path:
+            self._load()
+            atexit.register(self.save)
+            threading.Thread(target=self._persist_loop, daemon=True, name='response-cache-persist').start()
+
+    @staticmethod
+    def make_key(question, template, context=()):
+        """
+        Cache key for a question under a prompt template. context is the
+        conversation the answer was generated under (a list of turns); it is
+        hashed into the key, so a follow-up like "explain that again" is only
+        answered from an entry produced after the very same turns.
+        """
+        template_hash = hashlib.sha1(template.encode('utf-8')).hexdigest()
+        context_hash = hashlib.sha1(json.dumps(list(context), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return hashlib.sha1(f"{template_hash}\x00{context_hash}\x00{normalize_question(question)}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response for key, or None (counted as a miss)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response_text):
+        if not response_text or len(response_text) > self.max_chars:
+            return
+        with self._lock:
+            self._insert(key, time.time() + self.ttl_seconds, response_text)
+
+    def _insert(self, key, expires_at, response_text):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, response_text)
+        self._chars += len(response_text)
+        while self._entries and (len(self._entries) > self.max_entries or self._chars > self.max_chars):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._dirty = True
+
+    def record_bypass(self):
+        """Counts a request that skipped the cache (disabled by the client or too much context)."""
+        with self._lock:
+            self.bypassed += 1
+
+    def _remove(self, key):
+        _, response_text = self._entries.pop(key)
+        self._chars -= len(response_text)
+        self._dirty = True
+
+    def _load(self):
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[RESPONSE CACHE] Could not load {self.persist_path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, expires_at, response_text in stored:  # Stored oldest first, so LRU order survives
+                if expires_at > now and response_text and len(response_text) <= self.max_chars:
+                    self._insert(key, expires_at, response_text)
+            self._dirty = False
+        print(f"[RESPONSE CACHE] Loaded {len(self._entries)} cached responses from {self.persist_path}")
+
+    def save(self):
+        """Writes the current entries to persist_path if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            stored = [[key, expires_at, response_text] for key, (expires_at, response_text) in self._entries.items()]
+            self._dirty = False
+        temp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(stored, f)
+            os.replace(temp_path, self.persist_path)
+        except OSError as e:
+            print(f"[RESPONSE CACHE] Could not save {self.persist_path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _persist_loop(self):
+        while True:
+            time.sleep(self.persist_interval)
+            self.save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'chars': self._chars,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'bypassed': self.bypassed,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,68 @@
+import re
+
+# LaTeX commands the model emits that need their backslash doubled before the
+# text is handed to the frontend's markdown/MathJax pipeline.
+LATEX_COMMANDS = [
+    'int', 'dfrac', 'frac', 'cdot', 'sum', 'prod', 'begin{bmatrix}', 'end{bmatrix}',
+    'quad', ';', 'sqrt', 'partial', 'infty', 'alpha', 'beta', 'gamma', 'delta', 'pi',
+    'theta', 'sigma', 'omega', 'lambda', 'mu', 'nu', 'epsilon', 'nabla', 'times', 'div',
+    'leq', 'geq', 'neq', 'approx', 'equiv', 'rightarrow', 'leftarrow', 'Rightarrow',
+    'Leftarrow', 'lim', 'sin', 'cos', 'tan', 'log', 'ln', 'exp', 'oplus', 'otimes',
+]
+
+# Single pass over the text. Every backslash is either half of an escaped pair
+# ("\\", consumed and written back unchanged) or, if a known command follows it,
+# doubled. Consuming pairs first means an already escaped "\\int" is left alone,
+# whereas the chained str.replace calls used to turn it into "\\\int".
+_LATEX_BACKSLASH_PATTERN = re.compile(
+    r'\\(?:\\|(?=' + '|'.join(re.escape(c) for c in LATEX_COMMANDS) + '))')
+
+LATEX_COMMAND_MAX_LENGTH = max(len(command) for command in LATEX_COMMANDS) + 1  # Including the backslash
+OBJECT_MARKER = '[object Object]'
+
+
+def format_latex(text):
+    """Format LaTeX expressions with proper escaping."""
+    return _LATEX_BACKSLASH_PATTERN.sub(r'\\\\', text)
+
+
+def format_response(text):
+    """format_latex plus removal of stray [object Object] artifacts."""
+    return format_latex(text).replace(OBJECT_MARKER, '')
+
+
+class StreamingResponseFormatter:
+    """
+    Applies format_response to streamed text.
+
+    A LaTeX command (or a stray "[object Object]") can be split across two chunks,
+    so feed() holds back a trailing fragment that could still grow into one and
+    only formats text that can no longer change.
+    """
+
+    def __init__(self):
+        self._pending = ''
+
+    @staticmethod
+    def _safe_length(text):
+        cut = len(text)
+        backslash = text.rfind('\\')
+        if backslash != -1 and len(text) - backslash < LATEX_COMMAND_MAX_LENGTH:
+            # Hold back the whole backslash run: whether a command is escaped depends on it
+            while backslash > 0 and text[backslash - 1] == '\\':
+                backslash -= 1
+            cut = backslash
+        bracket = text.rfind('[')
+        if bracket != -1 and bracket < cut and OBJECT_MARKER.startswith(text[bracket:]):
+            cut = bracket
+        return cut
+
+    def feed(self, chunk):
+        text = self._pending + chunk
+        cut = self._safe_length(text)
+        self._pending = text[cut:]
+        return format_response(text[:cut])
+
+    def flush(self):
+        text, self._pending = self._pending, ''
+        return format_response(text)
@@ -0,0 +1,96 @@
+import itertools
+import queue
+import threading
+import time
+
+import metrics
+from firebase_config import get_db
+
+FIRESTORE_BATCH_LIMIT = 500  # Maximum writes in one Firestore WriteBatch
+
+
+class RoomDeleter:
+    """
+    Deletes study rooms and their messages subcollection on a background thread.
+
+    delete() only queues the room id, so socket and request handlers never wait
+    on Firestore. The worker removes the room document first (so nobody can join
+    it any more) and then the messages in WriteBatches of up to 500 deletes,
+    listing document references only. Deleting something that is already gone is
+    a no-op, so a room can safely be queued more than once or retried after a
+    failure.
+    """
+
+    def __init__(self, batch_size=FIRESTORE_BATCH_LIMIT, max_attempts=5):
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        self._queued = set()  # Room ids waiting or being deleted, so duplicates aren't queued twice
+        self._lock = threading.Lock()
+        self.deleted_rooms = 0
+        self.deleted_messages = 0
+        self.failures = 0
+        threading.Thread(target=self._run, daemon=True, name='room-deleter').start()
+
+    def delete(self, room_id):
+        """Queues a room for deletion. Returns immediately."""
+        with self._lock:
+            if room_id in self._queued:
+                return
+            self._queued.add(room_id)
+        self._queue.put((room_id, 1))
+
+    def _delete_room(self, room_id):
+        """Deletes one room and all of its messages. Returns the number of messages deleted."""
+        db_client = get_db()
+        room_ref = db_client.collection('rooms').document(room_id)
+        room_ref.delete()
+        messages_ref = room_ref.collection('messages')
+        deleted = 0
+        while True:
+            # Fresh listing every round; the previous page is gone by now
+            message_refs = list(itertools.islice(messages_ref.list_documents(page_size=self.batch_size), self.batch_size))
+            if not message_refs:
+                return deleted
+            batch = db_client.batch()
+            for message_ref in message_refs:
+                batch.delete(message_ref)
+            batch.commit()
+            deleted += len(message_refs)
+
+    def _run(self):
+        while True:
+            room_id, attempt = self._queue.get()
+            started_at = time.perf_counter()
+            try:
+                deleted = self._delete_room(room_id)
+            except Exception as e:
+                metrics.get_metrics('room_deletion').record(time.perf_counter() - started_at, error=True)
+                with self._lock:
+                    self.failures += 1
+                if attempt < self.max_attempts:
+                    print(f"[ROOM DELETE] Error deleting room {room_id} (attempt {attempt}), retrying: {e}")
+                    retry_timer = threading.Timer(2 ** attempt, self._queue.put, args=((room_id, attempt + 1),))
+                    retry_timer.daemon = True
+                    retry_timer.start()
+                else:
+                    print(f"[ROOM DELETE] Giving up on room {room_id} after {attempt} attempts: {e}")
+                    with self._lock:
+                        self._queued.discard(room_id)
+                continue
+
+            metrics.get_metrics('room_deletion').record(time.perf_counter() - started_at, messages=deleted)
+            print(f"[ROOM DELETE] Room {room_id} deleted with {deleted} messages in {(time.perf_counter() - started_at) * 1000:.0f} ms")
+            with self._lock:
+                self._queued.discard(room_id)
+                self.deleted_rooms += 1
+                self.deleted_messages += deleted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._queued),
+                'deleted_rooms': self.deleted_rooms,
+                'deleted_messages': self.deleted_messages,
+                'failures': self.failures,
+            }
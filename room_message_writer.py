@@ -0,0 +1,249 @@
+import atexit
+import threading
+import time
+from collections import deque
+
+from google.api_core import exceptions as google_exceptions
+
+import metrics
+from firebase_config import get_db
+
+FIRESTORE_BATCH_LIMIT = 500  # Maximum writes in one Firestore WriteBatch
+MAX_MESSAGE_CHARS = 4000  # Longer chat messages are truncated before they are stored
+MAX_FIELD_CHARS = 200  # Same for every other field (username, timestamp)
+
+# Errors that retrying the same write can't fix: Firestore rejected the data itself
+# (nested arrays, empty map keys, an oversized request) or the client couldn't encode it.
+NON_RETRYABLE_ERRORS = (google_exceptions.InvalidArgument, ValueError, TypeError)
+
+
+def normalize_message(message_data):
+    """
+    Returns a copy of a chat message that Firestore will accept: every value is
+    a plain scalar, the message text is a string, and strings are length-capped.
+    """
+    normalized = {}
+    for field, value in dict(message_data).items():
+        if not isinstance(field, str) or not field:
+            continue
+        if field == 'message':
+            value = '' if value is None else str(value)
+            value = value[:MAX_MESSAGE_CHARS]
+        elif value is not None and not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        if isinstance(value, str) and field != 'message':
+            value = value[:MAX_FIELD_CHARS]
+        normalized[field] = value
+    return normalized
+
+
+class RoomMessageWriter:
+    """
+    Write-behind buffer for study room chat messages.
+
+    Messages are broadcast as soon as they arrive and handed to enqueue(), which
+    normalizes them and only appends them to an in-memory queue. A background
+    thread commits the queue in Firestore WriteBatches once max_batch messages
+    are waiting or the oldest one has waited flush_interval seconds. Document
+    ids are assigned at enqueue time, so a failed batch can be retried as-is
+    (with backoff) without duplicating anything, and nothing behind it is
+    written before it succeeds, which keeps every room's history in order.
+
+    A batch Firestore rejects outright is split in halves until the offending
+    messages are isolated; those go to a dead-letter log and the rest are
+    written. A batch that keeps failing for other reasons is dead-lettered after
+    max_attempts, and the queue never holds more than max_pending messages, so
+    a Firestore outage can't stall or exhaust the process. Pending messages are
+    flushed at interpreter exit.
+    """
+
+    def __init__(self, max_batch=100, flush_interval=0.5, max_retry_delay=30, max_attempts=8,
+                 max_pending=10000, dead_letter_size=100):
+        self.max_batch = min(max_batch, FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self.initial_retry_delay = min(0.5, max_retry_delay)
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self._pending = deque()  # (room_id, doc_id, message_data, enqueued_at monotonic)
+        self._inflight = 0
+        self._inflight_rooms = set()
+        self._discarded_inflight_rooms = set()  # Rooms deleted while a batch holding their messages was committing
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self.flushed_messages = 0
+        self.failed_flushes = 0
+        self.dropped_messages = 0
+        self.dead_lettered_messages = 0
+        self.dead_letters = deque(maxlen=dead_letter_size)  # Recent (room_id, doc_id, message_data, error)
+        self.last_flush_lag = 0.0
+        self.max_flush_lag = 0.0
+        threading.Thread(target=self._run, daemon=True, name='room-message-writer').start()
+        atexit.register(self.flush, timeout=10)
+
+    def _messages_ref(self, room_id):
+        return get_db().collection('rooms').document(room_id).collection('messages')
+
+    def enqueue(self, room_id, message_data):
+        """Queues one message for rooms/<room_id>/messages. Returns immediately."""
+        message_data = normalize_message(message_data)
+        doc_id = self._messages_ref(room_id).document().id  # Client-side id: retries overwrite, never duplicate
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self.dropped_messages += 1
+                print(f"[ROOM CHAT] Write queue full ({self.max_pending} messages), not saving message for room {room_id}")
+                return False
+            self._pending.append((room_id, doc_id, message_data, time.monotonic()))
+            self._cond.notify()  # The writer re-checks whether a batch is due
+        return True
+
+    def discard_room(self, room_id):
+        """Drops queued (and in-flight) messages for a room that is being deleted."""
+        with self._cond:
+            self._pending = deque(entry for entry in self._pending if entry[0] != room_id)
+            if room_id in self._inflight_rooms:
+                self._discarded_inflight_rooms.add(room_id)
+
+    def flush(self, timeout=None):
+        """Asks for an immediate flush and waits until everything queued so far is written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    print(f"[ROOM CHAT] Gave up flushing with {len(self._pending)} messages still queued")
+                    self._flush_requested = False
+                    return False
+                self._cond.wait(remaining)
+            self._flush_requested = False
+            return True
+
+    def _take_batch(self):
+        """Waits until a batch is due and moves it out of the queue. Caller holds the condition."""
+        while True:
+            if self._pending:
+                age = time.monotonic() - self._pending[0][3]
+                if self._flush_requested or len(self._pending) >= self.max_batch or age >= self.flush_interval:
+                    break
+                self._cond.wait(self.flush_interval - age)
+            else:
+                self._cond.wait()
+        batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+        self._inflight = len(batch)
+        self._inflight_rooms = {entry[0] for entry in batch}
+        return batch
+
+    def _commit(self, batch):
+        write_batch = get_db().batch()
+        for room_id, doc_id, message_data, _ in batch:
+            write_batch.set(self._messages_ref(room_id).document(doc_id), message_data)
+        write_batch.commit()
+
+    def _dead_letter(self, entries, error):
+        with self._cond:
+            self.dead_lettered_messages += len(entries)
+            for room_id, doc_id, message_data, _ in entries:
+                self.dead_letters.append((room_id, doc_id, message_data, str(error)))
+        for room_id, doc_id, message_data, _ in entries:
+            print(f"[ROOM CHAT] Dropped message {doc_id} for room {room_id} ({error}): {message_data}")
+
+    def _commit_isolating(self, batch, rejected):
+        """
+        Commits batch, splitting it around messages Firestore won't accept. Those
+        are dead-lettered and appended to rejected; retryable errors propagate.
+        """
+        try:
+            self._commit(batch)
+        except NON_RETRYABLE_ERRORS as e:
+            if len(batch) == 1:
+                self._dead_letter(batch, e)
+                rejected.extend(batch)
+                return
+            middle = len(batch) // 2
+            self._commit_isolating(batch[:middle], rejected)
+            self._commit_isolating(batch[middle:], rejected)
+
+    def _delete_discarded(self, batch):
+        """Deletes messages just written for rooms that were deleted while they were in flight."""
+        with self._cond:
+            discarded_rooms, self._discarded_inflight_rooms = self._discarded_inflight_rooms, set()
+        orphaned = [entry for entry in batch if entry[0] in discarded_rooms]
+        if not orphaned:
+            return
+        try:
+            write_batch = get_db().batch()
+            for room_id, doc_id, _, _ in orphaned:
+                write_batch.delete(self._messages_ref(room_id).document(doc_id))
+            write_batch.commit()
+        except Exception as e:
+            print(f"[ROOM CHAT] Failed to remove {len(orphaned)} messages of deleted rooms: {e}")
+
+    def _finish_batch(self):
+        """Clears the in-flight state. Caller holds the condition."""
+        self._inflight = 0
+        self._inflight_rooms = set()
+        self._cond.notify_all()  # Wake flush() callers
+
+    def _run(self):
+        retry_delay = self.initial_retry_delay
+        attempt = 1
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            started_at = time.perf_counter()
+            rejected = []
+            try:
+                self._commit_isolating(batch, rejected)
+            except Exception as e:
+                metrics.get_metrics('room_message_flush').record(time.perf_counter() - started_at, error=True)
+                rejected_ids = {entry[1] for entry in rejected}
+                remaining = [entry for entry in batch if entry[1] not in rejected_ids]
+                if attempt >= self.max_attempts:
+                    print(f"[ROOM CHAT] Failed to write {len(remaining)} messages {attempt} times, giving up on them: {e}")
+                    self._dead_letter(remaining, e)
+                    with self._cond:
+                        self.failed_flushes += 1
+                        self._discarded_inflight_rooms = set()
+                        self._finish_batch()
+                    retry_delay, attempt = self.initial_retry_delay, 1
+                    continue
+                with self._cond:
+                    self.failed_flushes += 1
+                    discarded_rooms, self._discarded_inflight_rooms = self._discarded_inflight_rooms, set()
+                    remaining = [entry for entry in remaining if entry[0] not in discarded_rooms]
+                    self._pending.extendleft(reversed(remaining))  # Back at the front, in the original order
+                    self._finish_batch()
+                print(f"[ROOM CHAT] Failed to write {len(remaining)} messages (attempt {attempt}), retrying in {retry_delay:.1f}s: {e}")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                attempt += 1
+                continue
+
+            retry_delay, attempt = self.initial_retry_delay, 1
+            self._delete_discarded(batch)
+            written = len(batch) - len(rejected)
+            lag = time.monotonic() - batch[0][3]  # Oldest message in the batch waited this long
+            metrics.get_metrics('room_message_flush').record(
+                time.perf_counter() - started_at, messages=written, lag_ms=round(lag * 1000, 1))
+            with self._cond:
+                self.flushed_messages += written
+                self.last_flush_lag = lag
+                self.max_flush_lag = max(self.max_flush_lag, lag)
+                self._finish_batch()
+
+    def stats(self):
+        with self._cond:
+            oldest_age = time.monotonic() - self._pending[0][3] if self._pending else 0.0
+            return {
+                'pending': len(self._pending),
+                'inflight': self._inflight,
+                'oldest_pending_ms': round(oldest_age * 1000, 1),
+                'flushed_messages': self.flushed_messages,
+                'failed_flushes': self.failed_flushes,
+                'dropped_messages': self.dropped_messages,
+                'dead_lettered_messages': self.dead_lettered_messages,
+                'last_flush_lag_ms': round(self.last_flush_lag * 1000, 1),
+                'max_flush_lag_ms': round(self.max_flush_lag * 1000, 1),
+            }
@@ -0,0 +1,57 @@
+import threading
+
+
+class RoomRegistry:
+    """
+    Connected Socket.IO sessions, indexed both by sid and by room.
+
+    Replaces scanning a flat sid -> session dict: finding the people in a room
+    costs O(people in that room) instead of O(everyone connected), and whether a
+    room has live sockets is a lookup in the room index. Both indexes are
+    updated together under one lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # sid -> {'user_id': ..., 'room_id': ..., 'display_name': ...}
+        self._rooms = {}  # room_id -> set of sids
+
+    def add(self, sid, user_id, room_id, display_name):
+        """Registers (or moves) a socket session. Returns the session it replaced, if any."""
+        session_info = {'user_id': user_id, 'room_id': room_id, 'display_name': display_name}
+        with self._lock:
+            previous = self._discard(sid)
+            self._sessions[sid] = session_info
+            self._rooms.setdefault(room_id, set()).add(sid)
+        return previous
+
+    def remove(self, sid):
+        """Unregisters a socket session. Returns its info, or None if it wasn't registered."""
+        with self._lock:
+            return self._discard(sid)
+
+    def _discard(self, sid):
+        session_info = self._sessions.pop(sid, None)
+        if session_info is not None:
+            room_sids = self._rooms.get(session_info['room_id'])
+            if room_sids is not None:
+                room_sids.discard(sid)
+                if not room_sids:
+                    del self._rooms[session_info['room_id']]
+        return session_info
+
+    def sessions_in(self, room_id):
+        """Copies of the session infos of every socket currently in room_id."""
+        with self._lock:
+            return [dict(self._sessions[sid]) for sid in self._rooms.get(room_id, ())]
+
+    def has_sessions(self, room_id):
+        with self._lock:
+            return room_id in self._rooms
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'rooms': len(self._rooms),
+            }
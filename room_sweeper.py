@@ -0,0 +1,126 @@
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+from firebase_config import get_db
+
+
+class FirestoreLease:
+    """
+    Time-limited lock stored in a Firestore document (locks/<name>).
+
+    Every gunicorn worker runs the same background loops; acquire() lets only
+    one of them do a round of work. The holder can renew its own lease, and a
+    lease whose holder died simply expires after lease_seconds.
+    """
+
+    def __init__(self, name, lease_seconds):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False  # Whether our last acquire() succeeded; release() is a no-op otherwise
+
+    def _ref(self):
+        return get_db().collection('locks').document(self.name)
+
+    def acquire(self):
+        """Takes (or renews) the lease. Returns False if another process holds it."""
+        db_client = get_db()
+        lock_ref = self._ref()
+
+        @firestore.transactional
+        def take_lease(transaction):
+            lock_doc = lock_ref.get(transaction=transaction)
+            now = time.time()
+            if lock_doc.exists:
+                lock_data = lock_doc.to_dict()
+                if lock_data.get('holder') != self.holder and lock_data.get('expiresAt', 0) > now:
+                    return False
+            transaction.set(lock_ref, {'holder': self.holder, 'expiresAt': now + self.lease_seconds})
+            return True
+
+        self.held = take_lease(db_client.transaction())
+        return self.held
+
+    def release(self):
+        """Gives the lease up early if we still hold it, so another worker can take over right away."""
+        if not self.held:
+            return
+        db_client = get_db()
+        lock_ref = self._ref()
+
+        @firestore.transactional
+        def drop_lease(transaction):
+            lock_doc = lock_ref.get(transaction=transaction)
+            if lock_doc.exists and lock_doc.to_dict().get('holder') == self.holder:
+                transaction.delete(lock_ref)
+
+        drop_lease(db_client.transaction())
+        self.held = False
+
+
+def find_empty_rooms(empty_for_seconds, page_size=100):
+    """
+    Yields snapshots of rooms whose emptySince is at least empty_for_seconds ago.
+
+    Rooms that have people in them have emptySince = None, which a range filter
+    never matches, so only candidate rooms are read, one page at a time.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=empty_for_seconds)
+    query = (get_db().collection('rooms')
+             .where('emptySince', '<=', cutoff)
+             .order_by('emptySince')
+             .limit(page_size))
+    last_snapshot = None
+    while True:
+        page_query = query.start_after(last_snapshot) if last_snapshot is not None else query
+        page = list(page_query.stream())
+        yield from page
+        if len(page) < page_size:
+            return
+        last_snapshot = page[-1]
+
+
+def backfill_empty_since(page_size=100):
+    """
+    Gives rooms created before emptySince existed the field, so find_empty_rooms
+    can see them: empty rooms get the current time (their grace period starts
+    now), occupied ones None. Firestore cannot query for a missing field, so
+    this pages through every room once. Returns how many empty rooms were marked.
+    """
+    db_client = get_db()
+    query = (db_client.collection('rooms')
+             .select(['participants', 'emptySince'])
+             .order_by('__name__')
+             .limit(page_size))
+    marked = 0
+    last_snapshot = None
+    while True:
+        page_query = query.start_after(last_snapshot) if last_snapshot is not None else query
+        page = list(page_query.stream())
+        for room_snapshot in page:
+            if 'emptySince' not in (room_snapshot.to_dict() or {}):
+                marked += _backfill_room(db_client, room_snapshot.reference)
+        if len(page) < page_size:
+            return marked
+        last_snapshot = page[-1]
+
+
+def _backfill_room(db_client, room_ref):
+    """Sets one legacy room's emptySince from its current participants. Returns 1 if it was empty."""
+
+    @firestore.transactional
+    def mark(transaction):
+        room_doc = room_ref.get(transaction=transaction)
+        room_data = (room_doc.to_dict() or {}) if room_doc.exists else None
+        if room_data is None or 'emptySince' in room_data:
+            return 0  # Deleted, or a join/leave set the field meanwhile
+        is_empty = not room_data.get('participants')
+        transaction.update(room_ref, {'emptySince': firestore.SERVER_TIMESTAMP if is_empty else None})
+        return 1 if is_empty else 0
+
+    return mark(db_client.transaction())
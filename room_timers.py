@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class RoomTimerScheduler:
+    """Drives every running room timer from a single background thread.
+
+    Rooms sit in a min-heap keyed by their next tick deadline. When a deadline
+    is reached the scheduler calls ``tick_callback(room_id)``; returning a truthy
+    value keeps the room scheduled for the next tick, returning False (or
+    raising) drops it. Cancelled rooms are removed lazily from the heap.
+
+    ``clock`` and ``autostart`` exist for tests: with autostart=False no thread
+    is started and ticks only run when run_due() is called, against whatever
+    time the clock reports.
+    """
+
+    def __init__(self, tick_callback, interval=1.0, clock=time.monotonic, autostart=True):
+        self._tick_callback = tick_callback
+        self._interval = interval
+        self._clock = clock
+        self._autostart = autostart
+        self._heap = []  # (deadline, generation, room_id)
+        self._generations = {}  # room_id -> generation of its live heap entry
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._ticks = 0
+        self._skipped_ticks = 0
+        self._total_lag = 0.0
+        self._max_lag = 0.0
+        self._last_lag = 0.0
+
+    def schedule(self, room_id, delay=None):
+        """(Re)starts ticking for a room. Any previously scheduled entry is superseded."""
+        delay = self._interval if delay is None else delay
+        with self._cond:
+            generation = next(self._counter)
+            self._generations[room_id] = generation
+            heapq.heappush(self._heap, (self._clock() + delay, generation, room_id))
+            self._cond.notify()
+        self._ensure_started()
+
+    def cancel(self, room_id):
+        """Stops ticking for a room. Returns True if the room was scheduled."""
+        with self._cond:
+            was_active = self._generations.pop(room_id, None) is not None
+            self._cond.notify()
+        return was_active
+
+    def is_active(self, room_id):
+        with self._cond:
+            return room_id in self._generations
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active_timers': len(self._generations),
+                'heap_size': len(self._heap),
+                'ticks': self._ticks,
+                'skipped_ticks': self._skipped_ticks,
+                'avg_tick_lag_ms': round((self._total_lag / self._ticks) * 1000, 2) if self._ticks else 0.0,
+                'max_tick_lag_ms': round(self._max_lag * 1000, 2),
+                'last_tick_lag_ms': round(self._last_lag * 1000, 2),
+            }
+
+    def run_due(self):
+        """Runs every tick that is due now on the calling thread. Returns how many ran."""
+        ran = 0
+        while True:
+            with self._cond:
+                entry, _ = self._pop_due()
+            if entry is None:
+                return ran
+            self._tick(*entry)
+            ran += 1
+
+    def _ensure_started(self):
+        if not self._autostart:
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='room-timer-scheduler', daemon=True)
+            self._thread.start()
+            print("[Timer System] Room timer scheduler thread started.")
+
+    def _pop_due(self):
+        """
+        Pops the earliest live entry if it is due. Returns (entry, None), or
+        (None, seconds until the next deadline) with None meaning nothing is
+        scheduled. Caller holds the condition.
+        """
+        while self._heap:
+            deadline, generation, room_id = self._heap[0]
+            if self._generations.get(room_id) != generation:
+                heapq.heappop(self._heap)  # Cancelled or superseded entry
+                continue
+            now = self._clock()
+            if deadline > now:
+                return None, deadline - now
+            heapq.heappop(self._heap)
+            lag = now - deadline
+            self._ticks += 1
+            self._total_lag += lag
+            self._last_lag = lag
+            self._max_lag = max(self._max_lag, lag)
+            return (deadline, generation, room_id), None
+        return None, None
+
+    def _next_due(self):
+        """Blocks until a live entry is due, then pops and returns it."""
+        with self._cond:
+            while True:
+                entry, wait_seconds = self._pop_due()
+                if entry is not None:
+                    return entry
+                self._cond.wait(wait_seconds)
+
+    def _run(self):
+        while True:
+            self._tick(*self._next_due())
+
+    def _tick(self, deadline, generation, room_id):
+        try:
+            keep_running = self._tick_callback(room_id)
+        except Exception as e:
+            print(f"[Timer System] Error ticking timer for room {room_id}: {e}")
+            keep_running = False
+
+        with self._cond:
+            if self._generations.get(room_id) != generation:
+                return  # Cancelled or restarted while the callback ran
+            if not keep_running:
+                self._generations.pop(room_id, None)
+                return
+            # Advance from the previous deadline so ticks don't drift; if we fell
+            # more than a full interval behind, skip ahead instead of bursting.
+            next_deadline = deadline + self._interval
+            now = self._clock()
+            if next_deadline < now:
+                self._skipped_ticks += int((now - next_deadline) // self._interval) + 1
+                next_deadline = now + self._interval
+            heapq.heappush(self._heap, (next_deadline, generation, room_id))
+            self._cond.notify()
@@ -0,0 +1,198 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+import page_cursor
+from firebase_config import get_db
+
+RECENT_SESSIONS_LIMIT = 10  # Sessions shown in the progress panel
+
+
+def _user_ref(user_id):
+    return get_db().collection('users').document(user_id)
+
+
+def sessions_ref(user_id):
+    """users/<uid>/sessions: one document per completed session, never rewritten."""
+    return _user_ref(user_id).collection('sessions')
+
+
+def day_key(when, tz=timezone.utc):
+    return when.astimezone(tz).strftime('%Y-%m-%d')
+
+
+def week_key(when, tz=timezone.utc):
+    iso_year, iso_week, _ = when.astimezone(tz).isocalendar()
+    return f'{iso_year}-W{iso_week:02d}'
+
+
+def parse_session_date(session_entry):
+    parsed = datetime.fromisoformat(session_entry['date'].replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def hour_key(when, tz=timezone.utc):
+    return when.astimezone(tz).strftime('%H')
+
+
+def hour_totals_ref(user_id):
+    """users/<uid>/session_stats/hours: minutes and sessions per UTC hour of day, as {'HH': n} maps."""
+    return _user_ref(user_id).collection('session_stats').document('hours')
+
+
+def _rollup_deltas(session_entries, tz=timezone.utc):
+    """
+    Per-bucket increments for a group of sessions, bucketed in tz.
+
+    Returns:
+        tuple: ({(collection name, bucket key) -> {'minutes': ..., 'sessions': ..., 'xp': ...}},
+                {'HH' -> {'minutes': ..., 'sessions': ...}})
+    """
+    deltas = defaultdict(lambda: {'minutes': 0, 'sessions': 0, 'xp': 0})
+    hour_deltas = defaultdict(lambda: {'minutes': 0, 'sessions': 0})
+    for session_entry in session_entries:
+        when = parse_session_date(session_entry)
+        for collection_name, key in (('session_days', day_key(when, tz)), ('session_weeks', week_key(when, tz))):
+            delta = deltas[(collection_name, key)]
+            delta['minutes'] += session_entry.get('duration', 0)
+            delta['sessions'] += 1
+            delta['xp'] += session_entry.get('xp_earned', 0)
+        hour_delta = hour_deltas[hour_key(when, tz)]
+        hour_delta['minutes'] += session_entry.get('duration', 0)
+        hour_delta['sessions'] += 1
+    return deltas, hour_deltas
+
+
+def record_sessions(transaction, user_id, session_entries, session_ids=None):
+    """
+    Appends sessions to the user's log and bumps their rollups, as writes on
+    an open transaction (so they commit together with the progress update that
+    counted them).
+
+    Rollups live in users/<uid>/session_days/<YYYY-MM-DD>,
+    users/<uid>/session_weeks/<YYYY-Www> and the hour-of-day document (all
+    UTC) and are only ever incremented, so reading the stats of a day, a week
+    or the hour histogram is a single document read.
+    """
+    user_ref = _user_ref(user_id)
+    for index, session_entry in enumerate(session_entries):
+        session_ref = sessions_ref(user_id).document(session_ids[index]) if session_ids else sessions_ref(user_id).document()
+        transaction.set(session_ref, session_entry)
+    deltas, hour_deltas = _rollup_deltas(session_entries)
+    for (collection_name, key), delta in deltas.items():
+        rollup = {field: firestore.Increment(amount) for field, amount in delta.items()}
+        rollup['week' if collection_name == 'session_weeks' else 'date'] = key
+        transaction.set(user_ref.collection(collection_name).document(key), rollup, merge=True)
+    if hour_deltas:
+        transaction.set(hour_totals_ref(user_id), {
+            field: {hour: firestore.Increment(delta[field]) for hour, delta in hour_deltas.items()}
+            for field in ('minutes', 'sessions')
+        }, merge=True)
+
+
+def record_legacy_history(transaction, user_id, legacy_history):
+    """
+    Moves a progress.sessionHistory list into the log. Ids come from each
+    entry's date, so a retried transaction rewrites the same documents. The
+    caller deletes the list in the same transaction, which is what keeps the
+    rollups from being counted twice.
+    """
+    entries, session_ids = [], []
+    for entry in legacy_history:
+        when = _parse_legacy_entry(entry)
+        if when is None:
+            print(f"[SESSION HISTORY] Skipping unreadable sessionHistory entry of {user_id}: {entry!r}")
+            continue
+        entries.append(entry)
+        session_ids.append('legacy-' + when.strftime('%Y%m%dT%H%M%S%f'))
+    record_sessions(transaction, user_id, entries, session_ids)
+    return len(entries)
+
+
+def _parse_legacy_entry(entry):
+    """The date of a session entry (old sessionHistory ones included), or None if it can't be counted in the rollups."""
+    if not isinstance(entry, dict) or not isinstance(entry.get('date'), str):
+        return None
+    for field in ('duration', 'xp_earned'):
+        if not isinstance(entry.get(field, 0), (int, float)) or isinstance(entry.get(field), bool):
+            return None
+    try:
+        return parse_session_date(entry)
+    except ValueError:
+        return None
+
+
+def migrate_legacy_history(user_id):
+    """Moves the user document's sessionHistory list into the log, if it still has one."""
+    db_client = get_db()
+    user_ref = _user_ref(user_id)
+
+    @firestore.transactional
+    def migrate(transaction):
+        user_doc = user_ref.get(transaction=transaction)
+        progress = (user_doc.to_dict() or {}).get('progress', {}) if user_doc.exists else {}
+        if not isinstance(progress.get('sessionHistory'), list):
+            return 0
+        migrated = record_legacy_history(transaction, user_id, progress['sessionHistory'])
+        transaction.update(user_ref, {'progress.sessionHistory': firestore.DELETE_FIELD})
+        return migrated
+
+    migrated = migrate(db_client.transaction())
+    if migrated:
+        print(f"[SESSION HISTORY] Moved {migrated} sessions of {user_id} into the session log")
+    return migrated
+
+
+def session_page(user_id, limit=RECENT_SESSIONS_LIMIT, start_after=None):
+    """
+    One page of the session log, newest first; sessions with the same date
+    (migrated history, sessions saved in one batch) are ordered by id. Pass the
+    page's next_cursor as start_after for the next, older page. Raises
+    ValueError for a cursor this function did not hand out.
+
+    Returns:
+        tuple: (sessions, next_cursor) where next_cursor is None on the last page.
+    """
+    snapshots, next_cursor = page_cursor.descending_page(sessions_ref(user_id), 'date', limit, start_after)
+    return [doc.to_dict() for doc in snapshots], next_cursor
+
+
+def rollups_since(user_id, since, tz):
+    """
+    Day, week and hour-of-day totals in tz for the sessions completed at or after
+    since, summed from the session log. The stored rollups are UTC buckets, which
+    a day in any other timezone does not line up with.
+
+    Returns:
+        tuple: ({'YYYY-MM-DD' -> totals}, {'YYYY-Www' -> totals}, {'HH' -> {'minutes', 'sessions'}})
+    """
+    # Stored dates carry different UTC offsets, so the string range is widened by a
+    # day and the exact cut is made on the parsed time
+    lower_bound = (since - timedelta(days=1)).astimezone(timezone.utc).isoformat()
+    query = sessions_ref(user_id).where('date', '>=', lower_bound).select(['date', 'duration', 'xp_earned'])
+    session_entries = []
+    for doc in query.stream():
+        session_entry = doc.to_dict()
+        when = _parse_legacy_entry(session_entry)
+        if when is not None and when >= since:
+            session_entries.append(session_entry)
+    deltas, hour_deltas = _rollup_deltas(session_entries, tz)
+    rollups = {'session_days': {}, 'session_weeks': {}}
+    for (collection_name, key), totals in deltas.items():
+        rollups[collection_name][key] = dict(totals, **{'date' if collection_name == 'session_days' else 'week': key})
+    return rollups['session_days'], rollups['session_weeks'], dict(hour_deltas)
+
+
+def current_rollups(user_id, now=None):
+    """Today's and this week's totals, read as two documents."""
+    now = now or datetime.now(timezone.utc)
+    user_ref = _user_ref(user_id)
+    day_ref = user_ref.collection('session_days').document(day_key(now))
+    week_ref = user_ref.collection('session_weeks').document(week_key(now))
+    empty = {'minutes': 0, 'sessions': 0, 'xp': 0}
+    snapshots = {snapshot.reference.path: snapshot for snapshot in get_db().get_all([day_ref, week_ref])}
+    return {
+        name: dict(empty, **(snapshots[ref.path].to_dict() or {})) if snapshots[ref.path].exists else dict(empty)
+        for name, ref in (('today', day_ref), ('this_week', week_ref))
+    }
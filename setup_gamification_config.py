@@ -255,6 +255,8 @@ def setup_gamification_config():
         print(f"Setting gamification configuration for document: {config_ref.path}")
         config_ref.set(GAMIFICATION_CONFIG_DATA)
         print("Successfully set/updated gamification configuration in Firestore!")
+        print("Running servers cache this document; they pick up the change after GAMIFICATION_CONFIG_TTL seconds,")
+        print("immediately if GAMIFICATION_CONFIG_LISTENER=1, or after POST /admin/gamification_config/invalidate.")
         
         # Optionally, verify by fetching the document
         # doc = config_ref.get()
@@ -60,6 +60,7 @@ document.addEventListener('DOMContentLoaded', function() {
         leveling: { baseXpForLevelUp: 100 } // Default leveling
     };
     let currentUserProgress = {}; // To store the latest progress from server
+    let currentProgressVersion = null; // Server progress version, echoed back on syncs
 
     try {
         // Initialize Particles.js for ambient effect
@@ -566,7 +567,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 const formData = new FormData();
                 formData.append('message', inputVal);
                 formData.append('image', fileInput.files[0]);
-                    formData.append('memory', JSON.stringify(messages));
+                    // Conversation memory is loaded server-side from chat history
                 
                     const response = await fetch('/api/chat_with_image', {
                     method: 'POST',
@@ -583,17 +584,20 @@ document.addEventListener('DOMContentLoaded', function() {
                     $("#image-preview-container").hide();
                     $("#image-preview").attr("src", "");
             } else {
-                    const response = await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                        body: JSON.stringify({ message: inputVal, memory: messages }),
+                    // Stream tokens into a live bubble, then render the final message as usual
+                    let liveText = null;
+                    const responseText = await streamChatResponse('/api/chat', { message: inputVal, stream: true }, (delta) => {
+                        if (liveText === null) {
+                            $(".typing-message .typing-indicator").replaceWith('<div class="message-text"></div>');
+                            liveText = '';
+                        }
+                        liveText += delta;
+                        $(".typing-message .message-text").html(marked.parse(liveText));
+                        scrollToBottom();
                     });
-                    const data = await response.json();
                     
-                    handleDaphinixResponse(data.response);
-                    messages.push({ role: 'assistant', content: data.response });
+                    handleDaphinixResponse(responseText);
+                    messages.push({ role: 'assistant', content: responseText });
                     await saveChatHistory(messages);
                 }
             } catch (error) {
@@ -602,6 +606,45 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         };
         
+        // POST to a chat endpoint in streaming mode and consume its Server-Sent Events.
+        // Calls onDelta for each text delta and resolves with the full response.
+        async function streamChatResponse(url, payload, onDelta) {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload),
+            });
+            if (!response.ok || !response.body) throw new Error(`Chat request failed: ${response.status}`);
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let fullText = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let eventType = 'message';
+                    let dataLine = '';
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event: ')) eventType = line.slice(7);
+                        else if (line.startsWith('data: ')) dataLine += line.slice(6);
+                    });
+                    if (!dataLine) continue;
+                    const data = JSON.parse(dataLine);
+                    if (eventType === 'error') throw new Error(data.error);
+                    if (eventType === 'done') return data.response;
+                    fullText += data.delta;
+                    onDelta(data.delta);
+                }
+            }
+            return fullText;
+        }
+
         // Handle Daphinix response
         function handleDaphinixResponse(responseText) {
             $(".typing-message").remove();
@@ -1409,6 +1452,8 @@ document.addEventListener('DOMContentLoaded', function() {
                     console.warn("[Main Interface] No gamification_settings received from API.");
                 }
                 
+                currentProgressVersion = userDataFromAPI.version || null;
+
                 // Update UI with userDataFromAPI.progress
                 if (userDataFromAPI.progress) {
                     currentUserProgress = userDataFromAPI.progress; // Store current progress
@@ -1750,14 +1795,13 @@ document.addEventListener('DOMContentLoaded', function() {
         async function saveUserData(eventDetails = null) {
             try {
                 let clientPayload = {
+                    version: currentProgressVersion, // Lets the server skip syncs when nothing changed
                     progress: { // Always send current core progress for potential merge on server
                         xp: parseInt($("#xp").text()) || 0,
                         level: parseInt($("#level").text()) || 1,
                         total_time: parseInt($("#total-time").text()) || 0,
-                        sessions: parseInt($("#stats-total-sessions").text()) || 0,
-                        // sessionHistory is now primarily managed by server based on events, 
-                        // but we can send the client's current known history for non-event syncs.
-                        sessionHistory: currentUserProgress.sessionHistory || [] 
+                        sessions: parseInt($("#stats-total-sessions").text()) || 0
+                        // sessionHistory is kept by the server in its session log and is not sent
                     }
                 };
 
@@ -1786,9 +1830,15 @@ document.addEventListener('DOMContentLoaded', function() {
                     throw new Error('Error from server saving user data: ' + result.error);
                 }
 
-                if (result.status === 'success') {
+                if (result.version) currentProgressVersion = result.version;
+                if (result.status === 'not_modified') {
+                    console.log("User data already up to date on the server; nothing saved.");
+                } else if (result.status === 'success') {
                     console.log("User data saved/processed successfully. Server response:", result);
                     if (result.progress) {
+                        // Saves don't return the session log; keep the recent sessions we have and add the new one
+                        const recentSessions = currentUserProgress.sessionHistory || [];
+                        result.progress.sessionHistory = result.session ? [result.session, ...recentSessions].slice(0, 10) : recentSessions;
                         currentUserProgress = result.progress; // Update global state
                         updateProgressUI(currentUserProgress); // Refresh UI with server's authoritative state
                     }
@@ -1869,7 +1919,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (todos && todos.length > 0) {
                     todos.forEach(todo => {
                         const row = `
-                            <tr data-task-id="${todo.timestamp}">
+                            <tr data-task-id="${todo.id}" data-version="${todo.version}">
                                 <td class="py-2 px-4">${todo.name}</td>
                                 <td class="py-2 px-4">${new Date(todo.startDate).toLocaleString()}</td>
                                 <td class="py-2 px-4">${new Date(todo.dueDate).toLocaleString()}</td>
@@ -1925,11 +1975,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
             if (name && startDate && dueDate) {
                 try {
-                    // Get current todo list
-                    const response = await fetch('/api/todo_list');
-                    const todos = await response.json();
-                    
-                    // Add new task with UTC timestamps
+                    // Add new task with UTC timestamps; the server assigns its id
                     const task = {
                         name,
                         startDate: new Date(startDate).toISOString(),
@@ -1938,19 +1984,15 @@ document.addEventListener('DOMContentLoaded', function() {
                         priority,
                         effort,
                         desc,
-                        timestamp: new Date().toISOString(),
-                        completedAt: status === 'Done' ? new Date().toISOString() : null
+                        timestamp: new Date().toISOString()
                     };
                     
-                    const updatedTodos = [...(todos || []), task];
-                    
-                    // Save updated todo list
-                    const saveResponse = await fetch('/api/todo_list', {
+                    const saveResponse = await fetch('/api/todo_list/items', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                         },
-                        body: JSON.stringify(updatedTodos)
+                        body: JSON.stringify(task)
                     });
                     
                     if (saveResponse.ok) {
@@ -1972,32 +2014,25 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // Add status change handler
         $(document).on('change', '.todo-status', async function() {
-            const taskId = $(this).closest('tr').data('task-id');
+            const row = $(this).closest('tr');
+            const taskId = row.data('task-id');
             const newStatus = $(this).val();
             
             try {
-                const response = await fetch('/api/todo_list');
-                const todos = await response.json();
-                
-                const updatedTodos = todos.map(todo => {
-                    if (todo.timestamp === taskId) {
-                        return {
-                            ...todo,
-                            status: newStatus,
-                            completedAt: newStatus === 'Done' ? new Date().toISOString() : null
-                        };
-                    }
-                    return todo;
-                });
-                
-                const saveResponse = await fetch('/api/todo_list', {
-                    method: 'POST',
+                // Only the status goes over the wire; the version makes the server refuse stale edits
+                const saveResponse = await fetch(`/api/todo_list/items/${taskId}`, {
+                    method: 'PATCH',
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify(updatedTodos)
+                    body: JSON.stringify({ status: newStatus, version: row.data('version') })
                 });
                 
+                if (saveResponse.status === 409) {
+                    await loadTodoList();
+                    showUIMessage('To-Do', 'This task was changed on another device. Showing the latest version.', 'info', true);
+                    return;
+                }
                 if (saveResponse.ok) {
                     await loadTodoList();
                     // showNotification('Task status updated!', 'success');
@@ -2014,25 +2049,22 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // Delete task logic
         $(document).on('click', '.delete-todo', async function() {
-            const taskId = $(this).closest('tr').data('task-id');
+            const row = $(this).closest('tr');
+            const taskId = row.data('task-id');
             
             try {
-                // Get current todo list
-                const response = await fetch('/api/todo_list');
-                const todos = await response.json();
-                
-                // Filter out the deleted task
-                const updatedTodos = todos.filter(todo => todo.timestamp !== taskId);
-                
-                // Save updated todo list
-                const saveResponse = await fetch('/api/todo_list', {
-                    method: 'POST',
+                const saveResponse = await fetch(`/api/todo_list/items/${taskId}`, {
+                    method: 'DELETE',
                     headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(updatedTodos)
+                        'If-Match': `"${row.data('version')}"`,
+                    }
                 });
                 
+                if (saveResponse.status === 409) {
+                    await loadTodoList();
+                    showUIMessage('To-Do', 'This task was changed on another device. Check it before deleting.', 'info', true);
+                    return;
+                }
                 if (saveResponse.ok) {
                     await loadTodoList(); // Reload the todo list
                     // showNotification('Task deleted!', 'info');
@@ -2176,8 +2208,18 @@ document.addEventListener('DOMContentLoaded', function() {
                                 if (displayEntries.length > 0) { // Add separator if top entries were displayed
                                     displayEntries.push({ isSeparator: true, customText: "Your rank is not in the top list shown above." });
                                 }
+                                let myRank = currentUserProgress.rank || "N/A";
+                                try {
+                                    const rankResponse = await fetch(`/api/leaderboard/${type}/me`);
+                                    if (rankResponse.ok) {
+                                        const rankData = await rankResponse.json();
+                                        if (rankData.rank) myRank = rankData.rank;
+                                    }
+                                } catch (rankError) {
+                                    console.warn('[Leaderboard] Could not fetch own rank:', rankError);
+                                }
                                 displayEntries.push({
-                                    rank: currentUserProgress.rank || "N/A",
+                                    rank: myRank,
                                     username: userIdentifierForMatching, // Use the consistent identifier
                                     level: currentUserProgress.level || 1,
                                     xp: currentUserProgress.xp || 0,
@@ -2547,6 +2589,8 @@ document.addEventListener('DOMContentLoaded', function() {
             sanaMemory = [];
             localStorage.removeItem('sanaChatHistory');
             $('#sana-responseArea').html(''); // Clear the UI
+            // The server keeps a summary of older turns; forget it too
+            fetch('/api/chat_memory/sana', { method: 'DELETE' }).catch(error => console.error('Error clearing Sana memory:', error));
         }
 
         // Add click listener for the new clear button
@@ -2634,7 +2678,7 @@ document.addEventListener('DOMContentLoaded', function() {
             try {
                 const payload = {
                     message: messageToSend,
-                    memory: getSanaMemory(),
+                    memory: getSanaMemory().slice(-20), // Older turns are covered by the server-side summary
                     moods: sanaInitialMoods
                 };
 
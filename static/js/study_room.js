@@ -333,24 +333,20 @@ document.addEventListener('DOMContentLoaded', async function() {
         }
     });
 
-    // Load chat history
-    fetch(`/api/room_chat_history/${currentRoom}`)
-        .then(res => {
-            if (!res.ok) throw new Error(`Failed to load chat history: ${res.statusText}`);
-            return res.json();
-        })
-        .then(messages => {
-            const chatMessages = document.getElementById('chat-messages');
-            if (chatMessages) {
-                chatMessages.innerHTML = ''; // Clear before rendering
-                messages.forEach(msg => renderChatMessage(msg, currentUsername)); // Pass current display name
-                chatMessages.scrollTop = chatMessages.scrollHeight;
-            }
-        })
+    // Load the latest page of chat history; older pages load when scrolling to the top
+    loadRoomChatHistory()
         .catch(error => {
             console.error('Error loading room chat history:', error);
             if(typeof addNotification === 'function') addNotification("Chat Error", "Could not load previous messages.", "warning");
         });
+    const roomChatContainer = document.getElementById('chat-messages');
+    if (roomChatContainer) {
+        roomChatContainer.addEventListener('scroll', function() {
+            if (roomChatContainer.scrollTop < 40) {
+                loadRoomChatHistory(true).catch(error => console.error('Error loading older room messages:', error));
+            }
+        });
+    }
 
     // Remove any duplicate room_timer_update listeners
     socket.off('room_timer_update');
@@ -685,18 +681,6 @@ document.addEventListener('DOMContentLoaded', async function() {
         });
     });
 
-    // Fetch and render chat history
-    fetch(`/api/room_chat_history/${currentRoom}`)
-        .then(res => res.json())
-        .then(messages => {
-            const chatMessages = document.getElementById('chat-messages');
-            if(chatMessages){
-            chatMessages.innerHTML = '';
-                 messages.forEach(msg => renderChatMessage(msg, currentUsername));
-            chatMessages.scrollTop = chatMessages.scrollHeight;
-            }
-        });
-
     window.addEventListener('beforeunload', function() {
         // Leave video call before page unloads
         leaveVideoCall();
@@ -850,9 +834,53 @@ document.addEventListener('DOMContentLoaded', async function() {
 
 });
 
-function renderChatMessage(data, currentChatUsername) {
+// Room chat history is paged by the server: next_cursor is the timestamp of the
+// oldest message loaded so far, or null once there is nothing older.
+let roomChatCursor = null;
+let roomChatLoading = false;
+
+function loadRoomChatHistory(loadOlder = false) {
+    const chatMessages = document.getElementById('chat-messages');
+    if (!chatMessages || roomChatLoading || (loadOlder && !roomChatCursor)) return Promise.resolve();
+    roomChatLoading = true;
+    const url = loadOlder
+        ? `/api/room_chat_history/${currentRoom}?start_after=${encodeURIComponent(roomChatCursor)}`
+        : `/api/room_chat_history/${currentRoom}`;
+    return fetch(url)
+        .then(res => {
+            if (!res.ok) throw new Error(`Failed to load chat history: ${res.statusText}`);
+            return res.json();
+        })
+        .then(page => {
+            roomChatCursor = page.next_cursor;
+            if (loadOlder) {
+                // Prepend newest-to-oldest and keep the messages the user was reading in place
+                const previousHeight = chatMessages.scrollHeight;
+                page.messages.slice().reverse().forEach(msg => renderChatMessage(msg, currentUsername, true));
+                chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            } else {
+                chatMessages.innerHTML = ''; // Clear before rendering
+                page.messages.forEach(msg => renderChatMessage(msg, currentUsername)); // Pass current display name
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+        })
+        .finally(() => {
+            roomChatLoading = false;
+        });
+}
+
+function renderChatMessage(data, currentChatUsername, prepend = false) {
     const chatMessages = document.getElementById('chat-messages');
     if (!chatMessages) return;
+    // Older history is inserted above what is already shown, without jumping to the bottom
+    const insertMessage = (msgDiv) => {
+        if (prepend) {
+            chatMessages.insertBefore(msgDiv, chatMessages.firstChild);
+        } else {
+            chatMessages.appendChild(msgDiv);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        }
+    };
 
     const msgDiv = document.createElement('div');
     msgDiv.className = `chat-message ${data.username === currentChatUsername ? 'sent' : 'received'}`;
@@ -863,8 +891,7 @@ function renderChatMessage(data, currentChatUsername) {
              addNotification('Chat Info', data.message, 'info');
         }
         msgDiv.textContent = data.message;
-        chatMessages.appendChild(msgDiv);
-        chatMessages.scrollTop = chatMessages.scrollHeight;
+        insertMessage(msgDiv);
         return;
     }
 
@@ -906,8 +933,7 @@ function renderChatMessage(data, currentChatUsername) {
         msgDiv.appendChild(bubble);
     }
 
-    chatMessages.appendChild(msgDiv);
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    insertMessage(msgDiv);
 }
 
 // Daphinix Chat Functions (Global Scope)
@@ -0,0 +1,176 @@
+from datetime import date, datetime, timedelta, timezone
+from itertools import accumulate
+
+from firebase_config import get_db
+from session_history import hour_totals_ref, rollups_since, week_key
+
+MAX_RANGE_DAYS = 366
+MAX_RANGE_WEEKS = 104
+MIN_TZ_OFFSET_MINUTES, MAX_TZ_OFFSET_MINUTES = -12 * 60, 14 * 60  # UTC-12:00 .. UTC+14:00
+
+
+class DailySeries:
+    """
+    Per-day minutes, sessions and XP for a date range, as dense lists with one
+    slot per day (days without a rollup document are zero).
+
+    Prefix sums are built once, so the total over any sub-range is two lookups
+    and a rolling average over the whole range is one pass, no matter how many
+    sessions the days hold.
+    """
+
+    def __init__(self, start, days, day_rollups):
+        self.start = start
+        self.days = days
+        self.minutes = [0] * days
+        self.sessions = [0] * days
+        self.xp = [0] * days
+        for rollup in day_rollups:
+            index = (date.fromisoformat(rollup['date']) - start).days
+            if 0 <= index < days:
+                self.minutes[index] = rollup.get('minutes', 0)
+                self.sessions[index] = rollup.get('sessions', 0)
+                self.xp[index] = rollup.get('xp', 0)
+        self._minute_sums = [0, *accumulate(self.minutes)]
+        self._session_sums = [0, *accumulate(self.sessions)]
+        self._xp_sums = [0, *accumulate(self.xp)]
+
+    def total(self, first=0, last=None):
+        """Totals for day indexes first..last inclusive (clamped to the range)."""
+        last = self.days - 1 if last is None else last
+        first, last = max(first, 0), min(last, self.days - 1)
+        if first > last:
+            return {'minutes': 0, 'sessions': 0, 'xp': 0}
+        return {
+            'minutes': self._minute_sums[last + 1] - self._minute_sums[first],
+            'sessions': self._session_sums[last + 1] - self._session_sums[first],
+            'xp': self._xp_sums[last + 1] - self._xp_sums[first],
+        }
+
+    def rolling_average(self, window=7):
+        """Average minutes per day over the `window` days ending on each day."""
+        sums = self._minute_sums
+        return [round((sums[index + 1] - sums[max(index + 1 - window, 0)]) / window, 1) for index in range(self.days)]
+
+    def active_days(self):
+        return sum(1 for minutes in self.minutes if minutes)
+
+    def as_list(self):
+        return [
+            {'date': (self.start + timedelta(days=index)).isoformat(),
+             'minutes': self.minutes[index], 'sessions': self.sessions[index]}
+            for index in range(self.days)
+        ]
+
+
+def _recent_week_keys(today, weeks):
+    """ISO week keys of the last `weeks` weeks, oldest first, ending with today's week."""
+    monday = today - timedelta(days=today.weekday())
+    return [week_key(datetime.combine(monday - timedelta(weeks=offset), datetime.min.time(), timezone.utc))
+            for offset in range(weeks - 1, -1, -1)]
+
+
+def load_daily_series(user_id, start, days):
+    """Reads the day rollups of a range with one query and returns them as a DailySeries."""
+    end = start + timedelta(days=days - 1)
+    query = (get_db().collection('users').document(user_id).collection('session_days')
+             .where('date', '>=', start.isoformat())
+             .where('date', '<=', end.isoformat()))
+    return DailySeries(start, days, (doc.to_dict() for doc in query.stream()))
+
+
+def load_weekly_totals(user_id, today, weeks):
+    week_keys = _recent_week_keys(today, weeks)
+    query = (get_db().collection('users').document(user_id).collection('session_weeks')
+             .where('week', '>=', week_keys[0]))
+    return _weekly_rows(week_keys, {doc.id: doc.to_dict() for doc in query.stream()})
+
+
+def _weekly_rows(week_keys, rollups):
+    return [
+        {'week': key, 'minutes': rollups.get(key, {}).get('minutes', 0), 'sessions': rollups.get(key, {}).get('sessions', 0)}
+        for key in week_keys
+    ]
+
+
+def load_hour_totals(user_id):
+    """Minutes and sessions per UTC hour of day, as two lists of 24."""
+    hours_doc = hour_totals_ref(user_id).get()
+    hours_data = (hours_doc.to_dict() or {}) if hours_doc.exists else {}
+    return {
+        field: [(hours_data.get(field) or {}).get(f'{hour:02d}', 0) for hour in range(24)]
+        for field in ('minutes', 'sessions')
+    }
+
+
+def parse_tz_offset(minutes):
+    """
+    The fixed-offset timezone `minutes` east of UTC (IST is 330, New York in
+    winter -300). Raises ValueError for offsets no timezone uses.
+    """
+    if not isinstance(minutes, int) or isinstance(minutes, bool) \
+            or not MIN_TZ_OFFSET_MINUTES <= minutes <= MAX_TZ_OFFSET_MINUTES or minutes % 15:
+        raise ValueError(f'tz_offset must be a multiple of 15 minutes between {MIN_TZ_OFFSET_MINUTES} and {MAX_TZ_OFFSET_MINUTES}')
+    return timezone(timedelta(minutes=minutes))
+
+
+def load_local_stats(user_id, start, days, today, weeks, tz):
+    """
+    The daily series, weekly totals and hour-of-day totals in a non-UTC timezone,
+    from one read of the session log covering both ranges. Hour totals here
+    cover that range only, where the UTC ones cover all time.
+    """
+    week_keys = _recent_week_keys(today, weeks)
+    first_monday = today - timedelta(days=today.weekday(), weeks=weeks - 1)
+    since = datetime.combine(min(start, first_monday), datetime.min.time(), tz)
+    day_rollups, week_rollups, hour_rollups = rollups_since(user_id, since, tz)
+    hours = {
+        field: [hour_rollups.get(f'{hour:02d}', {}).get(field, 0) for hour in range(24)]
+        for field in ('minutes', 'sessions')
+    }
+    return DailySeries(start, days, day_rollups.values()), _weekly_rows(week_keys, week_rollups), hours
+
+
+def _change_percent(current, previous):
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+
+def build_stats(user_id, days=30, weeks=12, today=None, tz=timezone.utc):
+    """
+    Study stats for the last `days` days and `weeks` weeks, with days, weeks and
+    hours in tz. In UTC they come from the session rollups alone: one range
+    query for the days, one for the weeks and one document read for the
+    hour-of-day totals. Any other timezone is summed from the session log over
+    the requested range, since UTC day buckets can't be split into local days.
+    """
+    today = today or datetime.now(tz).date()
+    days = min(max(days, 1), MAX_RANGE_DAYS)
+    weeks = min(max(weeks, 1), MAX_RANGE_WEEKS)
+    start = today - timedelta(days=days - 1)
+
+    if tz.utcoffset(None):
+        daily, weekly, hours = load_local_stats(user_id, start, days, today, weeks, tz)
+    else:
+        daily = load_daily_series(user_id, start, days)
+        weekly = load_weekly_totals(user_id, today, weeks)
+        hours = load_hour_totals(user_id)
+
+    totals = daily.total()
+    last_7_days = daily.total(days - 7, days - 1)
+    previous_7_days = daily.total(days - 14, days - 8)
+    best_hour = max(range(24), key=lambda hour: hours['minutes'][hour]) if any(hours['minutes']) else None
+
+    return {
+        'timezone': tz.tzname(None),
+        'range': {'start': start.isoformat(), 'end': today.isoformat(), 'days': days},
+        'totals': dict(totals, active_days=daily.active_days(),
+                       average_minutes_per_day=round(totals['minutes'] / days, 1)),
+        'daily': daily.as_list(),
+        'rolling_7_day_minutes': daily.rolling_average(7),
+        'last_7_days': last_7_days,
+        'previous_7_days': previous_7_days if days >= 14 else None,
+        'week_over_week_change_percent': _change_percent(last_7_days['minutes'], previous_7_days['minutes']) if days >= 14 else None,
+        'weekly': weekly,
+        'hours': hours,
+        'best_hour': best_hour,
+    }
@@ -0,0 +1,159 @@
+"""
+Micro-benchmarks for the hot paths. Not collected by pytest; run with
+
+    python tests/benchmarks.py [name ...]
+
+and compare the numbers before and after a change on the same machine.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(label, function, repeat=5):
+    """Runs function repeat times and prints the best wall time."""
+    best = min(_run_once(function) for _ in range(repeat))
+    print(f"{label:<50} {best * 1000:9.2f} ms")
+    return best
+
+
+def _run_once(function):
+    started_at = time.perf_counter()
+    function()
+    return time.perf_counter() - started_at
+
+
+def bench_formatting():
+    from response_formatting import StreamingResponseFormatter, format_response
+    from test_response_formatting import legacy_format_latex
+
+    text = (r'We have \int_0^1 \frac{x}{2} \, dx = \dfrac{1}{4} and \sum_i \alpha_i \cdot \beta_i. '
+            r'[object Object] Matrix \begin{bmatrix} 1 \\ 2 \end{bmatrix}. Plain prose follows. ' * 200)
+    chunks = [text[index:index + 40] for index in range(0, len(text), 40)]
+
+    def stream():
+        formatter = StreamingResponseFormatter()
+        for chunk in chunks:
+            formatter.feed(chunk)
+        formatter.flush()
+
+    timed(f'format_response, {len(text)} chars x 20', lambda: [format_response(text) for _ in range(20)])
+    timed(f'chained str.replace (old), {len(text)} chars x 20', lambda: [legacy_format_latex(text) for _ in range(20)])
+    timed(f'streaming, {len(chunks)} chunks', stream)
+
+
+def bench_question_intent():
+    from question_intent import classify_question
+    from test_question_intent import LABELLED
+
+    messages = [message for message, _ in LABELLED] * 300
+    long_message = ' '.join(message for message, _ in LABELLED) * 20
+
+    timed(f'classify_question, {len(messages)} messages', lambda: [classify_question(message) for message in messages])
+    timed(f'classify_question, one {len(long_message)} char message', lambda: classify_question(long_message))
+
+
+def bench_room_registry():
+    from room_registry import RoomRegistry
+
+    connections, rooms = 10000, 500
+    registry = RoomRegistry()
+
+    def connect():
+        for index in range(connections):
+            registry.add(f'sid{index}', f'user{index}', f'room{index % rooms}', f'User {index}')
+
+    def move():
+        for index in range(connections):
+            registry.add(f'sid{index}', f'user{index}', f'room{(index + 1) % rooms}', f'User {index}')
+
+    def list_rooms():
+        for index in range(rooms):
+            registry.sessions_in(f'room{index}')
+
+    def disconnect():
+        for index in range(connections):
+            registry.remove(f'sid{index}')
+
+    timed(f'add {connections} sockets across {rooms} rooms', connect, repeat=1)
+    timed(f'move {connections} sockets to another room', move, repeat=1)
+    timed(f'sessions_in for all {rooms} rooms', list_rooms)
+    timed(f'remove {connections} sockets', disconnect, repeat=1)
+
+
+def bench_study_stats():
+    from datetime import date, timedelta
+
+    import firebase_config
+    import study_stats
+    from fake_firestore import FakeFirestore
+
+    today = date(2024, 12, 31)
+    rollups = [{'date': (today - timedelta(days=offset)).isoformat(), 'minutes': offset % 90, 'sessions': offset % 4, 'xp': offset % 90}
+               for offset in range(study_stats.MAX_RANGE_DAYS)]
+    firebase_config._db_client = FakeFirestore()
+    days_ref = firebase_config._db_client.collection('users').document('u1').collection('session_days')
+    for rollup in rollups:
+        days_ref.document(rollup['date']).set(rollup)
+
+    def series():
+        daily = study_stats.DailySeries(today - timedelta(days=study_stats.MAX_RANGE_DAYS - 1), study_stats.MAX_RANGE_DAYS, rollups)
+        daily.rolling_average(7)
+        for first in range(0, study_stats.MAX_RANGE_DAYS, 7):
+            daily.total(first, first + 6)
+
+    timed(f'DailySeries over {study_stats.MAX_RANGE_DAYS} days, weekly totals', series)
+    timed(f'build_stats, {study_stats.MAX_RANGE_DAYS} days (in-memory Firestore)',
+          lambda: study_stats.build_stats('u1', days=study_stats.MAX_RANGE_DAYS, weeks=52, today=today))
+
+
+def bench_firebase_client():
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    from google.auth.credentials import AnonymousCredentials
+
+    import firebase_config
+
+    class OfflineCredential(credentials.Base):
+        """Lets firebase_admin build a real Firestore client without a service account (nothing is sent)."""
+
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(OfflineCredential(), {'projectId': 'benchmark'})
+    firebase_config._db_client = None
+    calls = 100000
+
+    def per_call_initialize():
+        # What every helper and handler did before the shared client: the app check plus firestore.client()
+        for _ in range(calls):
+            if not firebase_admin._apps:
+                raise RuntimeError('Firebase app missing')
+            firestore.client()
+
+    def shared_client():
+        for _ in range(calls):
+            firebase_config.get_db()
+
+    timed(f'initialize_firebase() per call (old), {calls} calls', per_call_initialize)
+    timed(f'get_db() shared client, {calls} calls', shared_client)
+    timed('document reference from get_db(), 10000 requests',
+          lambda: [firebase_config.get_db().collection('users').document('u1') for _ in range(10000)])
+
+
+BENCHMARKS = {
+    'firebase_client': bench_firebase_client,
+    'formatting': bench_formatting,
+    'question_intent': bench_question_intent,
+    'room_registry': bench_room_registry,
+    'study_stats': bench_study_stats,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"--- {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import firebase_config  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """A fresh in-memory Firestore, installed as the process-wide client."""
+    client = FakeFirestore()
+    monkeypatch.setattr(firebase_config, '_db_client', client)
+    return client
+
+
+@pytest.fixture
+def app_module(fake_db, monkeypatch):
+    """The Flask app module, imported against the fake client without its background threads."""
+    monkeypatch.setenv('WERKZEUG_RUN_MAIN', '1')  # Same guard the dev reloader uses to skip them
+    import app
+    monkeypatch.setattr(app.inspire_pool, 'prefetch', lambda sources: None)  # No outbound calls from tests
+    return app
+
+
+@pytest.fixture
+def login(app_module):
+    """Returns a factory for Flask test clients already logged in as user_id (default 'u1')."""
+    def logged_in_client(user_id='u1'):
+        client = app_module.app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['user_id'] = user_id
+        return client
+    return logged_in_client
@@ -0,0 +1,411 @@
+"""
+In-memory stand-in for the Firestore client, for tests.
+
+Covers what the app uses: document and collection references (with
+subcollections), get/set/update/delete, merges and field paths, the
+Increment/ArrayUnion/ArrayRemove/DELETE_FIELD/SERVER_TIMESTAMP transforms,
+WriteBatches, simple queries, document listeners and transactions. Listeners
+are called right after each commit rather than from a watch thread.
+Transactions work with the real @firestore.transactional decorator: every
+document read inside one is version-checked at commit and a conflicting commit
+raises Aborted, so concurrent read-modify-writes are retried the way Firestore
+retries them.
+"""
+import copy
+import itertools
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1 import transforms
+
+_missing = object()
+MAX_WRITES_PER_COMMIT = 500  # Firestore rejects larger batches and transactions
+
+
+def _validate(value, nested_in_array=False):
+    """Rejects values the real service refuses, with the error the real client raises."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str) or not key:
+                raise google_exceptions.InvalidArgument('Map keys must be non-empty strings')
+            _validate(item)
+    elif isinstance(value, (list, tuple)):
+        if nested_in_array:
+            raise google_exceptions.InvalidArgument('Cannot have an array value directly inside another array')
+        for item in value:
+            _validate(item, nested_in_array=True)
+
+
+def _apply_transform(current, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        current = list(current) if isinstance(current, list) else []
+        return current + [item for item in value.values if item not in current]
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in current if item not in value.values] if isinstance(current, list) else []
+    if isinstance(value, dict):
+        return {key: _apply_transform(_missing, item) for key, item in value.items()
+                if item is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _merge(target, data):
+    for key, value in data.items():
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = _apply_transform(target.get(key, _missing), value)
+
+
+def _split_path(field_path):
+    return [part.strip('`') for part in field_path.split('.')]
+
+
+def _update(target, updates):
+    for field_path, value in updates.items():
+        parts = _split_path(field_path)
+        parent = target
+        for part in parts[:-1]:
+            if not isinstance(parent.get(part), dict):
+                parent[part] = {}
+            parent = parent[part]
+        if value is transforms.DELETE_FIELD:
+            parent.pop(parts[-1], None)
+        else:
+            parent[parts[-1]] = _apply_transform(parent.get(parts[-1], _missing), value)
+
+
+def _get_field(data, field_path):
+    for part in _split_path(field_path):
+        if not isinstance(data, dict) or part not in data:
+            return _missing
+        data = data[part]
+    return data
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _missing:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, f'{self.path}/{name}')
+
+    def get(self, transaction=None, field_paths=None):
+        return self._client._read(self, transaction)
+
+    def set(self, data, merge=False):
+        self._client._commit_writes([('set', self, data, merge)])
+
+    def create(self, data):
+        self._client._commit_writes([('create', self, data, False)])
+
+    def update(self, updates):
+        self._client._commit_writes([('update', self, updates, False)])
+
+    def delete(self):
+        self._client._commit_writes([('delete', self, None, False)])
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+
+def _order_value(snapshot, field_path):
+    """The value a query orders snapshot by; __name__ is the document id."""
+    return snapshot.id if field_path == '__name__' else _get_field(snapshot._data, field_path)
+
+
+def _sort_key(value):
+    return value is not None, value  # null sorts before every other value, as in Firestore
+
+
+class FakeQuery:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, start_after=None):
+        self._client = client
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = {'filters': self._filters, 'orders': self._orders, 'limit': self._limit, 'start_after': self._start_after}
+        state.update(changes)
+        return FakeQuery(self._client, self._path, **state)
+
+    def where(self, field_path, op, value):
+        return self._copy(filters=self._filters + [(field_path, op, value)])
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, cursor):
+        if isinstance(cursor, FakeSnapshot):
+            cursor = {field: _order_value(cursor, field) for field, _ in self._orders}
+        return self._copy(start_after=cursor)
+
+    def select(self, field_paths):
+        return self
+
+    @staticmethod
+    def _matches(data, field_path, op, value):
+        field_value = _get_field(data, field_path)
+        if field_value is _missing:
+            return False
+        try:
+            if op == '==':
+                return field_value == value
+            if op == '!=':
+                return field_value != value
+            if op == '<':
+                return field_value < value
+            if op == '<=':
+                return field_value <= value
+            if op == '>':
+                return field_value > value
+            if op == '>=':
+                return field_value >= value
+            if op == 'in':
+                return field_value in value
+            if op == 'array_contains':
+                return isinstance(field_value, list) and value in field_value
+        except TypeError:
+            return False  # Firestore only compares values of the same type
+        raise ValueError(f'Unsupported operator {op}')
+
+    def stream(self, transaction=None):
+        snapshots = [snapshot for snapshot in self._client._list(self._path)
+                     if all(self._matches(snapshot._data, *condition) for condition in self._filters)]
+        for field_path, direction in reversed(self._orders):
+            snapshots = [snapshot for snapshot in snapshots if _order_value(snapshot, field_path) is not _missing]
+            snapshots.sort(key=lambda snapshot: _sort_key(_order_value(snapshot, field_path)),
+                           reverse=direction == 'DESCENDING')
+        if self._start_after is not None:
+            snapshots = [snapshot for snapshot in snapshots if self._after_cursor(snapshot)]
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return iter(snapshots)
+
+    def _after_cursor(self, snapshot):
+        for field_path, direction in self._orders:
+            value, cursor = _sort_key(_order_value(snapshot, field_path)), self._start_after.get(field_path)
+            if isinstance(cursor, FakeDocumentReference):
+                cursor = cursor.id
+            cursor = _sort_key(cursor)
+            if value == cursor:
+                continue
+            return value < cursor if direction == 'DESCENDING' else value > cursor
+        return False
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, f'{self._path}/{document_id or uuid.uuid4().hex[:20]}')
+
+    def add(self, data):
+        reference = self.document()
+        reference.set(data)
+        return None, reference
+
+    def list_documents(self, page_size=None):
+        return iter([snapshot.reference for snapshot in self._client._list(self._path)])
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def create(self, reference, data):
+        self._writes.append(('create', reference, data, False))
+
+    def update(self, reference, updates):
+        self._writes.append(('update', reference, updates, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        self._client._commit_writes(self._writes)
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Works with the real @firestore.transactional decorator (it drives _begin/_commit/_rollback)."""
+
+    _read_only = False
+
+    def __init__(self, client, max_attempts):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._id = None
+        self._reads = {}  # path -> version seen
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = next(self._client._transaction_ids)
+
+    def _commit(self):
+        try:
+            self._client._commit_writes(self._writes, expected_versions=self._reads)
+        finally:
+            self._clean_up()
+
+    def _rollback(self):
+        self._clean_up()
+
+    def get(self, reference):
+        return reference.get(transaction=self)
+
+
+class FakeWatch:
+    def __init__(self, unsubscribe):
+        self.unsubscribe = unsubscribe
+
+
+class FakeFirestore:
+    def __init__(self, transaction_attempts=100):
+        self._lock = threading.RLock()
+        self._documents = {}  # path -> data
+        self._versions = {}  # path -> commit counter
+        self._transaction_ids = itertools.count(1)
+        self.transaction_attempts = transaction_attempts
+        self.commit_hook = None  # Optional callable(writes) run before each commit; raise to fail it
+        self.commits = 0
+        self.aborted = 0
+        self._listeners = {}  # path -> [callback]; document listeners only
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=None):
+        return FakeTransaction(self, max_attempts or self.transaction_attempts)
+
+    def get_all(self, references, transaction=None):
+        return [reference.get(transaction=transaction) for reference in references]
+
+    def _read(self, reference, transaction=None):
+        with self._lock:
+            if transaction is not None:
+                transaction._reads.setdefault(reference.path, self._versions.get(reference.path, 0))
+            return FakeSnapshot(reference, copy.deepcopy(self._documents.get(reference.path)))
+
+    def _list(self, collection_path):
+        prefix = collection_path + '/'
+        with self._lock:
+            return [FakeSnapshot(FakeDocumentReference(self, path), copy.deepcopy(data))
+                    for path, data in sorted(self._documents.items())
+                    if path.startswith(prefix) and '/' not in path[len(prefix):]]
+
+    def _listen(self, reference, callback):
+        """Registers a document listener, called now and after every commit that writes the document."""
+        with self._lock:
+            self._listeners.setdefault(reference.path, []).append(callback)
+        callback([self._read(reference)], [], datetime.now(timezone.utc))
+        return FakeWatch(lambda: self._listeners.get(reference.path, []).remove(callback))
+
+    def _notify(self, references):
+        with self._lock:
+            calls = [(callback, reference) for reference in references
+                     for callback in list(self._listeners.get(reference.path, []))]
+        for callback, reference in calls:  # Outside the lock, like the real client's watch thread
+            callback([self._read(reference)], [], datetime.now(timezone.utc))
+
+    def _commit_writes(self, writes, expected_versions=None):
+        self._apply_writes(writes, expected_versions)
+        self._notify({reference.path: reference for _, reference, _, _ in writes}.values())
+
+    def _apply_writes(self, writes, expected_versions=None):
+        with self._lock:
+            if len(writes) > MAX_WRITES_PER_COMMIT:
+                raise google_exceptions.InvalidArgument(f'maximum {MAX_WRITES_PER_COMMIT} writes allowed per request')
+            if self.commit_hook is not None:
+                self.commit_hook(writes)
+            for path, version in (expected_versions or {}).items():
+                if self._versions.get(path, 0) != version:
+                    self.aborted += 1
+                    raise google_exceptions.Aborted('Transaction contention')
+            for _, _, data, _ in writes:
+                if data is not None:
+                    _validate({key: value for key, value in data.items()
+                               if not isinstance(value, (transforms.Sentinel, transforms._ValueList, transforms._NumericValue))})
+            documents = copy.deepcopy(self._documents)
+            for kind, reference, data, merge in writes:
+                current = documents.get(reference.path)
+                if kind == 'create' and current is not None:
+                    raise google_exceptions.AlreadyExists(reference.path)
+                if kind == 'update' and current is None:
+                    raise google_exceptions.NotFound(reference.path)
+                if kind == 'delete':
+                    documents.pop(reference.path, None)
+                elif kind == 'update':
+                    _update(current, data)
+                elif merge and current is not None:
+                    _merge(current, data)
+                else:
+                    documents[reference.path] = {}
+                    _merge(documents[reference.path], data)
+            for _, reference, _, _ in writes:
+                self._versions[reference.path] = self._versions.get(reference.path, 0) + 1
+            self._documents = documents
+            self.commits += 1
+
+    # Test helpers
+    def dump(self, path):
+        with self._lock:
+            return copy.deepcopy(self._documents.get(path))
+
+    def paths(self, prefix=''):
+        with self._lock:
+            return sorted(path for path in self._documents if path.startswith(prefix))
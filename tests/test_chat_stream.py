@@ -0,0 +1,122 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+from response_formatting import format_response
+
+
+class FakeStreamModel:
+    """Stands in for the Gemini text model: generate_content(stream=True) yields the given texts."""
+
+    def __init__(self, texts, fail_with=None, usage=(12, 5), hold_after_first=None):
+        self.texts = texts
+        self.hold_after_first = hold_after_first  # Event the stream waits on after its first chunk
+        self.fail_with = fail_with
+        self.usage = SimpleNamespace(prompt_token_count=usage[0], candidates_token_count=usage[1])
+        self.closed = threading.Event()
+
+    def generate_content(self, prompt, stream=False):
+        assert stream
+        try:
+            for index, text in enumerate(self.texts):
+                last = index == len(self.texts) - 1
+                yield SimpleNamespace(parts=[SimpleNamespace(text=text)], usage_metadata=self.usage if last else None)
+                if index == 0 and self.hold_after_first is not None:
+                    self.hold_after_first.wait(5)
+            if self.fail_with:
+                raise self.fail_with
+        finally:
+            self.closed.set()
+
+
+@pytest.fixture
+def llm_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, '_registry', {})
+    return lambda: metrics.get_metrics('daphinix_chat_stream_llm').snapshot()
+
+
+def test_finished_stream_logs_latency_and_tokens(app_module, llm_metrics, monkeypatch):
+    monkeypatch.setattr(app_module, 'text_model', FakeStreamModel(['Hello ', 'there']))
+
+    assert list(app_module.custom_chat_stream('hi', [], use_cache=False)) == ['Hello ', 'there']
+
+    logged = llm_metrics()
+    assert (logged['count'], logged['errors']) == (1, 0)
+    assert (logged['total_prompt_tokens'], logged['total_output_tokens']) == (12, 5)
+    assert 'total_cancelled' not in logged
+
+
+def test_failed_stream_is_logged_as_an_error(app_module, llm_metrics, monkeypatch):
+    monkeypatch.setattr(app_module, 'text_model', FakeStreamModel(['Hel'], fail_with=RuntimeError('quota')))
+
+    with pytest.raises(RuntimeError):
+        list(app_module.custom_chat_stream('hi', [], use_cache=False))
+    assert (llm_metrics()['count'], llm_metrics()['errors']) == (1, 1)
+
+
+def test_cancelled_stream_is_logged_when_the_client_stops_reading(app_module, llm_metrics, monkeypatch):
+    release = threading.Event()
+    model = FakeStreamModel(['a', 'b', 'c'], hold_after_first=release)
+    monkeypatch.setattr(app_module, 'text_model', model)
+    chunks = app_module.llm_executor.stream('u1', app_module.custom_chat_stream, 'hi', [], False)
+
+    assert next(chunks) == 'a'
+    chunks.close()  # What the SSE response does when the client disconnects
+    release.set()
+
+    assert model.closed.wait(5)
+    logged = llm_metrics()
+    assert (logged['count'], logged['errors'], logged.get('total_cancelled')) == (1, 0, 1)
+
+
+def sse_events(response):
+    """(event, data) pairs from an SSE body; plain 'data:' messages are 'message' events."""
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.endswith('\n\n')
+    events = []
+    for message in body[:-2].split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.split('\n'))
+        assert set(fields) <= {'event', 'data'}
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+def post_stream(login, message='What is half of x?'):
+    return login().post('/api/chat', json={'message': message, 'stream': True, 'cache': False})
+
+
+def test_stream_relays_formatted_deltas_then_done(login, app_module, monkeypatch):
+    texts = ['Area is \\fr', 'ac{1}{2} [obj', 'ect Object] of x', ' so \\alpha']
+    monkeypatch.setattr(app_module, 'text_model', FakeStreamModel(texts))
+
+    response = post_stream(login)
+    events = sse_events(response)
+
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert [event for event, _ in events[:-1]] == ['message'] * (len(events) - 1)
+    deltas = ''.join(data['delta'] for _, data in events[:-1])
+    assert deltas == format_response(''.join(texts))  # Commands split across chunks format as a whole
+    assert events[-1] == ('done', {'response': deltas})
+
+
+def test_held_back_tail_is_flushed_before_done(login, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'text_model', FakeStreamModel(['The answer is ', '\\pi']))
+
+    events = sse_events(post_stream(login))
+
+    assert events[-2] == ('message', {'delta': format_response('\\pi')})  # Only complete once the stream ended
+    assert events[-1] == ('done', {'response': format_response('The answer is \\pi')})
+
+
+def test_model_failure_ends_the_stream_with_an_error_event(login, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'text_model', FakeStreamModel(['Partial '], fail_with=RuntimeError('quota exceeded')))
+
+    events = sse_events(post_stream(login))
+
+    assert events[0] == ('message', {'delta': 'Partial '})
+    assert events[-1] == ('error', {'error': 'quota exceeded'})
+    assert 'done' not in [event for event, _ in events]
@@ -0,0 +1,60 @@
+import threading
+
+from conversation_memory import ConversationMemory
+
+
+def turns(count):
+    return [{'role': 'user' if index % 2 == 0 else 'assistant', 'content': f'turn {index} ' + 'x' * 40}
+            for index in range(count)]
+
+
+def test_cleared_chat_drops_its_summary(fake_db):
+    chat_ref = fake_db.collection('chat_history').document('u1')
+    chat_ref.set({'messages': turns(4), 'summaries': {'daphinix': {'text': 'old topic', 'through': 'abc'}}})
+    memory = ConversationMemory(lambda *args: '', token_budget=10000)
+    assert memory.build('u1', 'daphinix')[0] == {'role': 'summary', 'content': 'old topic'}
+
+    chat_ref.set({'messages': []}, merge=True)  # What POST /api/chat_history does on "clear chat"
+    assert memory.build('u1', 'daphinix') == []  # A leftover summary is ignored...
+
+    memory.clear('u1', 'daphinix')  # ...and the route deletes it
+    assert 'daphinix' not in fake_db.dump('chat_history/u1').get('summaries', {})
+    chat_ref.set({'messages': turns(2)}, merge=True)
+    assert all(item['role'] != 'summary' for item in memory.build('u1', 'daphinix'))
+
+
+def test_summarizer_is_told_which_conversation_it_summarizes(fake_db):
+    calls = []
+    done = threading.Event()
+
+    def summarize(previous_summary, messages, conversation):
+        calls.append(conversation)
+        done.set()
+        return 'summary'
+    memory = ConversationMemory(summarize, token_budget=30)
+
+    memory.build('u1', 'sana', client_messages=turns(6), use_stored=False)
+    assert done.wait(5)
+    memory._executor.shutdown(wait=True)
+
+    assert calls == ['sana']
+    assert fake_db.dump('chat_history/u1')['summaries']['sana']['text'] == 'summary'
+
+
+def test_summary_finished_after_a_clear_is_not_saved(fake_db):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_summarize(previous_summary, messages, conversation):
+        started.set()
+        release.wait(5)
+        return 'stale'
+    memory = ConversationMemory(slow_summarize, token_budget=30)
+
+    memory.build('u1', 'sana', client_messages=turns(6), use_stored=False)
+    assert started.wait(5)
+    memory.clear('u1', 'sana')
+    release.set()
+    memory._executor.shutdown(wait=True)
+
+    assert 'sana' not in (fake_db.dump('chat_history/u1') or {}).get('summaries', {})
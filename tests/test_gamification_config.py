@@ -0,0 +1,98 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from gamification_logic import GamificationConfigProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def reads_of_config(fake_db):
+    reads = []
+    read = fake_db._read
+
+    def counting_read(reference, transaction=None):
+        if reference.path == 'gamification_config/settings':
+            reads.append(reference.path)
+        return read(reference, transaction)
+    fake_db._read = counting_read
+    return reads
+
+
+def test_settings_are_cached_until_the_ttl_expires(fake_db):
+    fake_db.document('gamification_config/settings').set({'leveling': {'baseXpForLevelUp': 100}})
+    clock = FakeClock()
+    provider = GamificationConfigProvider(ttl_seconds=60, clock=clock)
+    reads = reads_of_config(fake_db)
+
+    assert provider.get(fake_db)['leveling'] == {'baseXpForLevelUp': 100}
+    fake_db.document('gamification_config/settings').set({'leveling': {'baseXpForLevelUp': 200}})
+    clock.now = 59
+    assert provider.get(fake_db)['leveling'] == {'baseXpForLevelUp': 100}  # Still cached
+    clock.now = 61
+    assert provider.get(fake_db)['leveling'] == {'baseXpForLevelUp': 200}
+
+    assert len(reads) == 2
+    assert (provider.stats()['hits'], provider.stats()['misses']) == (1, 2)
+
+
+def test_callers_get_copies_of_the_cached_settings(fake_db):
+    fake_db.document('gamification_config/settings').set({'badges': {'bronze': {'name': 'Bronze'}}})
+    provider = GamificationConfigProvider()
+
+    provider.get(fake_db)['badges']['bronze']['name'] = 'changed'
+    assert provider.get(fake_db)['badges']['bronze']['name'] == 'Bronze'
+
+
+def test_expired_settings_are_served_while_firestore_fails(fake_db):
+    fake_db.document('gamification_config/settings').set({'xpValues': {'perPomodoroWorkMinute': 3}})
+    clock = FakeClock()
+    provider = GamificationConfigProvider(ttl_seconds=60, clock=clock)
+    provider.get(fake_db)
+    read = fake_db._read
+
+    def unavailable(reference, transaction=None):
+        raise google_exceptions.ServiceUnavailable('firestore down')
+    fake_db._read = unavailable
+    clock.now = 120
+
+    assert provider.get(fake_db)['xpValues'] == {'perPomodoroWorkMinute': 3}
+    assert provider.stats()['stale_hits'] == 1
+
+    fake_db._read = read  # Back up: the next get() refreshes
+    fake_db.document('gamification_config/settings').set({'xpValues': {'perPomodoroWorkMinute': 4}})
+    assert provider.get(fake_db)['xpValues'] == {'perPomodoroWorkMinute': 4}
+
+
+def test_failure_without_cached_settings_is_raised(fake_db):
+    def unavailable(reference, transaction=None):
+        raise google_exceptions.ServiceUnavailable('firestore down')
+    fake_db._read = unavailable
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        GamificationConfigProvider().get(fake_db)
+
+
+def test_listener_replaces_the_cache_on_every_change(fake_db):
+    fake_db.document('gamification_config/settings').set({'leveling': {'baseXpForLevelUp': 100}})
+    clock = FakeClock()
+    provider = GamificationConfigProvider(ttl_seconds=60, clock=clock)
+    provider.start_listener(fake_db)
+
+    clock.now = 10000  # Past the TTL, but the listener keeps the cache current
+    assert provider.get(fake_db)['leveling'] == {'baseXpForLevelUp': 100}
+    fake_db.document('gamification_config/settings').update({'leveling.baseXpForLevelUp': 150})
+    assert provider.get(fake_db)['leveling'] == {'baseXpForLevelUp': 150}
+    fake_db.document('gamification_config/settings').delete()
+    assert provider.get(fake_db) == {}
+    assert provider.stats()['misses'] == 0  # All served from snapshots
+
+    provider.stop_listener()
+    fake_db.document('gamification_config/settings').set({'leveling': {'baseXpForLevelUp': 300}})
+    assert provider.get(fake_db)['leveling'] == {'baseXpForLevelUp': 300}
+    assert provider.stats()['listener'] is False
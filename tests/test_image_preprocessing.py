@@ -0,0 +1,112 @@
+import io
+import time
+
+import eventlet
+import pytest
+from PIL import Image
+
+from image_preprocessing import ImagePreprocessor
+
+
+def encode(image, image_format, **save_args):
+    output = io.BytesIO()
+    image.save(output, format=image_format, **save_args)
+    return output.getvalue()
+
+
+def rotated_photo(width=4000, height=3000):
+    """A landscape JPEG whose EXIF says to display it rotated 90 degrees (as phones do)."""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW
+    return encode(Image.new('RGB', (width, height), (200, 30, 30)), 'JPEG', exif=exif, quality=95)
+
+
+def test_large_photo_is_shrunk_rotated_and_stripped():
+    preprocessor = ImagePreprocessor(max_edge=1536)
+    original = rotated_photo()
+
+    output, mime_type = preprocessor.process(original)
+
+    assert mime_type == 'image/jpeg'
+    image = Image.open(io.BytesIO(output))
+    assert image.size == (1152, 1536)  # Upright portrait, longest edge capped
+    assert not image.getexif()
+    assert len(output) < len(original)
+
+
+def test_small_images_keep_their_size_and_transparency_is_flattened():
+    preprocessor = ImagePreprocessor(max_edge=1536)
+    logo = Image.new('RGBA', (64, 32), (0, 0, 0, 0))
+
+    output, mime_type = preprocessor.process(encode(logo, 'PNG'))
+
+    image = Image.open(io.BytesIO(output))
+    assert (mime_type, image.mode, image.size) == ('image/jpeg', 'RGB', (64, 32))
+    assert image.getpixel((10, 10)) == (255, 255, 255)
+
+
+def test_webp_output_keeps_alpha():
+    preprocessor = ImagePreprocessor(max_edge=16, output_format='webp')
+    output, mime_type = preprocessor.process(encode(Image.new('LA', (64, 64), (0, 0)), 'PNG'))
+    image = Image.open(io.BytesIO(output))
+    assert (mime_type, image.size) == ('image/webp', (16, 16))
+
+
+def test_unreadable_upload_raises():
+    with pytest.raises(OSError):
+        ImagePreprocessor().process(b'definitely not an image')
+    with pytest.raises(ValueError):
+        ImagePreprocessor(output_format='BMP')
+
+
+def slow_preprocessor(seconds):
+    preprocessor = ImagePreprocessor(max_workers=1)
+    preprocessor._convert = lambda image_bytes: time.sleep(seconds) or (b'', 'image/jpeg')
+    return preprocessor
+
+
+def test_timeout_raises_timeout_error():
+    started_at = time.monotonic()
+    with pytest.raises(TimeoutError):
+        slow_preprocessor(0.5).process(b'x', timeout=0.05)
+    assert time.monotonic() - started_at < 0.4
+
+
+def test_green_callers_yield_to_the_hub_while_waiting():
+    preprocessor = slow_preprocessor(0.3)
+    ticks = []
+
+    def ticker():
+        for _ in range(50):
+            ticks.append(time.monotonic())
+            eventlet.sleep(0.01)
+
+    def convert():
+        started_at = time.monotonic()
+        result = preprocessor.process(b'x', timeout=5)
+        return result, started_at, time.monotonic()
+
+    ticking = eventlet.spawn(ticker)
+    result, started_at, finished_at = eventlet.spawn(convert).wait()
+    ticking.kill()
+
+    assert result == (b'', 'image/jpeg')
+    # Other green threads kept running while the conversion was waited on
+    assert sum(1 for tick in ticks if started_at < tick < finished_at) >= 5
+
+    with pytest.raises(TimeoutError):
+        eventlet.spawn(lambda: slow_preprocessor(0.5).process(b'x', timeout=0.05)).wait()
+
+
+def test_chat_with_image_reports_a_timeout_as_504(login, app_module, monkeypatch):
+    def time_out(image_bytes, timeout=None):
+        raise TimeoutError('busy')
+    monkeypatch.setattr(app_module.image_preprocessor, 'process', time_out)
+    client = login()
+
+    response = client.post('/api/chat_with_image', data={'message': 'what is this?', 'image': (io.BytesIO(b'img'), 'a.jpg')})
+    assert response.status_code == 504
+
+    monkeypatch.undo()
+    response = client.post('/api/chat_with_image', data={'message': 'what is this?', 'image': (io.BytesIO(b'junk'), 'a.jpg')})
+    assert response.status_code == 400
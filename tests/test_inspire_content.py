@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import inspire_content
+from inspire_content import InspireContentPool
+
+QUOTES = [{'q': 'Keep going', 'a': 'Ana'}, {'q': ''}]
+MEMES = {'memes': [
+    {'url': 'https://i.example/a.png', 'nsfw': False, 'spoiler': False},
+    {'url': 'https://i.example/b.png', 'nsfw': True, 'spoiler': False},
+    {'url': 'https://v.example/c', 'nsfw': False, 'spoiler': False, 'preview': ['https://p.example/small', 'https://p.example/big']},
+]}
+FACT = {'text': 'Otters hold hands'}
+
+
+class StubUpstream:
+    """Local stand-in for the quote, meme and fact APIs. Each path can be made slow or failing."""
+
+    def __init__(self):
+        self.routes = {'/quotes': (200, QUOTES, 0), '/memes/memes/10': (200, MEMES, 0), '/fact': (200, FACT, 0)}
+        self.requests = []
+        self.release = threading.Event()  # Set at teardown so slow handlers don't outlive the test
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                stub.requests.append(path)
+                status, payload, delay = stub.routes.get(path, (404, {'error': 'not found'}, 0))
+                if delay:
+                    stub.release.wait(delay)
+                body = payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # The client gave up on a slow response
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def slow(self, path, seconds=5):
+        status, payload, _ = self.routes[path]
+        self.routes[path] = (status, payload, seconds)
+
+    def fail(self, path, status=500, body='upstream exploded'):
+        self.routes[path] = (status, body, 0)
+
+    def close(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    stub = StubUpstream()
+    monkeypatch.setattr(inspire_content, 'ZENQUOTES_BATCH_URL', stub.url + '/quotes')
+    monkeypatch.setattr(inspire_content, 'MEME_API_BATCH_URL', stub.url + '/memes/{subreddit}/{count}')
+    monkeypatch.setattr(inspire_content, 'USELESS_FACTS_URL', stub.url + '/fact?language=en')
+    monkeypatch.setattr(inspire_content, 'REQUEST_TIMEOUT', 0.3)
+    yield stub
+    stub.close()
+
+
+def inspire_sources():
+    return {'quote': inspire_content.fetch_quotes,
+            'meme:memes': lambda: inspire_content.fetch_memes('memes'),
+            'fact': inspire_content.fetch_facts}
+
+
+def test_fetchers_parse_upstream_payloads(upstream):
+    assert inspire_content.fetch_quotes() == [{'quote': 'Keep going', 'author': 'Ana'}]
+    assert inspire_content.fetch_memes('memes') == [{'url': 'https://i.example/a.png'}, {'url': 'https://p.example/big'}]
+    assert inspire_content.fetch_facts() == [FACT] * inspire_content.FACT_BATCH_SIZE
+
+
+def test_fetchers_fall_back_to_nothing_on_erroring_upstreams(upstream):
+    upstream.fail('/quotes')
+    upstream.fail('/memes/memes/10', status=200, body='<html>not json</html>')
+    upstream.fail('/fact', status=503)
+
+    assert inspire_content.fetch_quotes() == []
+    assert inspire_content.fetch_memes('memes') == []
+    assert inspire_content.fetch_facts() == []
+    assert upstream.requests.count('/fact') == 1  # A failing facts call stops the batch instead of retrying it
+
+
+def test_fetchers_give_up_on_a_slow_upstream(upstream):
+    upstream.slow('/quotes')
+    started_at = time.monotonic()
+    assert inspire_content.fetch_quotes() == []
+    assert time.monotonic() - started_at < 2  # Bounded by REQUEST_TIMEOUT, not by the upstream
+
+
+def test_pool_serves_what_arrives_in_time(upstream):
+    upstream.slow('/memes/memes/10')
+    upstream.fail('/fact')
+    pool = InspireContentPool(pool_size=4)
+
+    started_at = time.monotonic()
+    content = pool.take(inspire_sources(), timeout=1)
+
+    assert time.monotonic() - started_at < 1.5
+    assert content == {'quote': {'quote': 'Keep going', 'author': 'Ana'}}
+
+
+def test_inspire_route_falls_back_per_source(upstream, app_module, login, monkeypatch):
+    monkeypatch.setattr(app_module, 'inspire_pool', InspireContentPool(pool_size=4))
+    monkeypatch.setattr(app_module, 'INSPIRE_DEADLINE_SECONDS', 1)
+    upstream.slow('/quotes')
+    upstream.fail('/fact')
+
+    body = login().get('/api/inspire').get_json()
+
+    assert body['quote'] == 'Could not fetch a quote at this time. Please try again later.'
+    assert body['fact'].startswith('Could not fetch a fun fact')
+    assert body['meme_url'] == 'https://i.example/a.png'
+    assert body['selected_meme_category'] == 'memes'
+
+
+def test_cold_source_past_the_deadline_is_left_out_and_pooled_later():
+    release = threading.Event()
+
+    def slow_fetch():
+        release.wait(5)
+        return [{'text': 'late'}]
+    pool = InspireContentPool(pool_size=4)
+
+    content = pool.take({'fast': lambda: [{'text': 'quick'}], 'slow': slow_fetch}, timeout=0.2)
+    assert content == {'fast': {'text': 'quick'}}
+    assert pool.stats()['timeouts'] == 1
+
+    release.set()
+    pool._executor.shutdown(wait=True)
+    assert pool.stats()['pool_sizes']['slow'] == 1  # The late result is served to the next request
+
+
+def wait_for_refill(pool, key):
+    future = pool._inflight.get(key)
+    if future is not None:
+        future.result(5)
+
+
+def test_pools_are_refilled_in_the_background_once_running_low():
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return [{'n': len(fetches) * 10 + index} for index in range(3)]
+    pool = InspireContentPool(pool_size=6)
+    pool.prefetch({'quote': fetch})
+    wait_for_refill(pool, 'quote')
+
+    assert pool.take({'quote': fetch}, timeout=1) == {'quote': {'n': 10}}
+    assert pool.stats()['hits'] == 1
+    # Two items left is below half of pool_size, so the take also started a refill
+    wait_for_refill(pool, 'quote')
+    assert len(fetches) == 2
+    assert pool.stats()['pool_sizes']['quote'] == 5
+
+
+def test_concurrent_misses_share_one_refill():
+    release = threading.Event()
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        release.wait(5)
+        return [{'n': 1}, {'n': 2}]
+    pool = InspireContentPool(pool_size=2)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.take({'fact': fetch}, timeout=2))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while pool.stats()['misses'] < 2:
+        time.sleep(0.01)
+    assert len(fetches) == 1  # The second miss waits on the refill the first one started
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert sorted(result['fact']['n'] for result in results) == [1, 2]
@@ -0,0 +1,30 @@
+from leaderboard import LeaderboardService
+
+
+def entry(username, xp, streak=0):
+    return {'username': username, 'totalXp': xp, 'currentStreak': streak, 'level': 1}
+
+
+def test_snapshot_etag_matches_its_rows():
+    service = LeaderboardService(top_n=2)
+    service.record('u1', entry('ana', 10))
+    service.record('u2', entry('ben', 20))
+
+    rows, etag = service.snapshot('xp')
+    assert [row['username'] for row in rows] == ['ben', 'ana']
+    assert service.snapshot('xp') == (rows, etag)  # Cached until the board changes
+
+    service.record('u3', entry('cy', 30))
+    new_rows, new_etag = service.snapshot('xp')
+    assert [row['username'] for row in new_rows] == ['cy', 'ben']
+    assert new_etag != etag
+
+
+def test_missing_username_sorts_with_named_users():
+    service = LeaderboardService()
+    service.record('u1', entry(None, 5))
+    service.record('u2', entry('ana', 5))
+    service.record('u3', entry(None, 5))
+
+    assert [row['username'] for row in service.top('xp')] == [None, None, 'ana']
+    assert service.rank_of('xp', 'u2')[0] == 1
@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+from llm_executor import LLMExecutor, LLMUnavailable
+
+
+class Gate:
+    """A task that blocks its worker until released, so queue order is under the test's control."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        assert self.release.wait(5)
+        return 'gate'
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+def busy_executor(**options):
+    """An executor whose only worker is held by a Gate."""
+    executor = LLMExecutor(max_concurrency=1, **options)
+    gate = Gate()
+    executor.submit('someone', gate)
+    assert gate.started.wait(5)
+    return executor, gate
+
+
+def test_workers_take_turns_between_users():
+    executor, gate = busy_executor(max_queue=10, max_queue_per_user=5)
+    order = []
+    futures = [executor.submit(user, order.append, f'{user}{index}')
+               for user, index in [('a', 1), ('a', 2), ('a', 3), ('b', 1), ('c', 1), ('b', 2)]]
+
+    gate.release.set()
+    for future in futures:
+        future.result(5)
+
+    assert order == ['a1', 'b1', 'c1', 'a2', 'b2', 'a3']
+
+
+def test_full_queues_shed_new_calls_with_a_retry_hint():
+    executor, gate = busy_executor(max_queue=3, max_queue_per_user=2)
+    executor.submit('a', str)
+    executor.submit('a', str)
+    with pytest.raises(LLMUnavailable) as per_user:
+        executor.submit('a', str)  # a's share is full...
+    executor.submit('b', str)  # ...but b still gets in
+    with pytest.raises(LLMUnavailable):
+        executor.submit('c', str)  # The whole queue is full
+
+    assert per_user.value.retry_after >= 1
+    assert executor.stats()['shed'] == 2
+    assert executor.stats()['queued'] == 3
+    gate.release.set()
+
+
+def test_jobs_past_their_deadline_are_dropped_without_running():
+    executor, gate = busy_executor()
+    calls = []
+    late = executor.submit('a', calls.append, 'late', deadline_seconds=0.05)
+    time.sleep(0.1)
+
+    gate.release.set()
+
+    with pytest.raises(LLMUnavailable):
+        late.result(5)
+    assert calls == []
+    assert executor.stats()['expired'] == 1
+
+
+def test_run_gives_up_at_the_deadline_and_cancels_the_job():
+    executor, gate = busy_executor()
+    calls = []
+
+    with pytest.raises(LLMUnavailable):
+        executor.run('a', calls.append, 'x', deadline_seconds=0.05)
+    gate.release.set()
+
+    assert executor.run('a', lambda: 'next') == 'next'
+    assert calls == []  # The abandoned call never started
+
+
+def test_stream_relays_chunks_and_errors():
+    executor = LLMExecutor(max_concurrency=1)
+
+    def chunks(count):
+        yield from (f'chunk{index}' for index in range(count))
+        raise RuntimeError('model failed')
+
+    stream = executor.stream('a', chunks, 2)
+    assert next(stream) == 'chunk0' and next(stream) == 'chunk1'
+    with pytest.raises(RuntimeError, match='model failed'):
+        next(stream)
+
+
+def test_stream_waits_at_most_the_deadline_for_each_chunk():
+    executor = LLMExecutor(max_concurrency=1)
+    release = threading.Event()
+
+    def stalled():
+        yield 'first'
+        release.wait(5)
+        yield 'too late'
+
+    stream = executor.stream('a', stalled, deadline_seconds=0.1)
+    assert next(stream) == 'first'
+    with pytest.raises(LLMUnavailable):
+        next(stream)
+    release.set()
+
+
+def test_disconnected_stream_stops_the_generator_and_frees_the_worker():
+    executor = LLMExecutor(max_concurrency=1)
+    produced = []
+    closed = threading.Event()
+    resume = threading.Event()
+
+    def chunks():
+        try:
+            for index in range(100):
+                produced.append(index)
+                yield index
+                if index == 0:
+                    resume.wait(5)
+        finally:
+            closed.set()
+
+    stream = executor.stream('a', chunks)
+    assert next(stream) == 0
+    stream.close()  # What Flask does when the client goes away mid-response
+    resume.set()
+
+    assert closed.wait(5)
+    assert produced == [0, 1]  # The chunk in hand is dropped and nothing more is generated
+    assert executor.run('b', lambda: 'worker free', deadline_seconds=5) == 'worker free'
+    wait_until(lambda: executor.stats()['running'] == 0)
+
+
+def test_chat_route_answers_503_with_retry_after_when_shed(login, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'llm_executor', LLMExecutor(max_concurrency=1, max_queue=0))
+
+    for payload in ({'message': 'hi'}, {'message': 'hi', 'stream': True}):
+        response = login().post('/api/chat', json=payload)
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
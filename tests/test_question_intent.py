@@ -0,0 +1,60 @@
+import pytest
+
+from question_intent import classify_question
+
+LABELLED = [
+    # math
+    ('Solve for x: 3x + 5 = 20', 'math'),
+    ('What is 12 * (3 + 4)?', 'math'),
+    ('12/4+7', 'math'),
+    ('Can you help me differentiate sin(x) * x^2?', 'math'),
+    ('Find the derivative of ln(x)', 'math'),
+    ('Evaluate the integral of e^x from 0 to 1', 'math'),
+    ('Prove that the square root of 2 is irrational', 'math'),
+    ('How do I multiply two matrices?', 'math'),
+    ('Explain the quadratic formula', 'math'),
+    ('What is the probability of rolling two sixes?', 'math'),
+    ('I have a trigonometry test tomorrow', 'math'),
+    # physics
+    ('What is the velocity of a falling object after 3 seconds?', 'physics'),
+    ("Explain Newton's second law", 'physics'),
+    ('How does friction affect a sliding block?', 'physics'),
+    ('What is the kinetic energy of a moving car?', 'physics'),
+    ('Describe the magnetic field around a wire', 'physics'),
+    ('What is quantum tunnelling?', 'physics'),
+    ('How does gravity keep the moon in orbit?', 'physics'),
+    # chemistry
+    ('Balance the equation H2 + O2 -> H2O', 'chemistry'),
+    ('What is the molar mass of water?', 'chemistry'),
+    ('How many moles are in 18 grams of water?', 'chemistry'),
+    ('What is the pH of a 0.01 M HCl solution?', 'chemistry'),
+    ('Explain covalent and ionic bonds', 'chemistry'),
+    ('What is a redox reaction?', 'chemistry'),
+    ('How do I read the periodic table?', 'chemistry'),
+    # general
+    ('', 'general'),
+    ('Hi there!', 'general'),
+    ('Can you summarize the French Revolution?', 'general'),
+    ('Give me tips to focus while studying', 'general'),
+    ('Who wrote Pride and Prejudice?', 'general'),
+    ('Translate "good morning" into Spanish', 'general'),
+    # keywords only count as whole words
+    ('I love my acidic lemon tea', 'general'),
+    ('The newtonian era of art', 'general'),
+    ('Write a story about a proofreader', 'general'),
+]
+
+
+@pytest.mark.parametrize('message, subject', LABELLED)
+def test_labelled_corpus(message, subject):
+    assert classify_question(message) == subject
+
+
+def test_classification_ignores_case():
+    assert classify_question('SOLVE FOR X') == 'math'
+    assert classify_question('Titration Curves') == 'chemistry'
+
+
+def test_ties_go_to_math_first():
+    assert classify_question('velocity formula') == 'math'
+    assert classify_question('reaction momentum') == 'physics'
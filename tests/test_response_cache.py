@@ -0,0 +1,66 @@
+import response_cache
+from response_cache import ResponseCache
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', 'answer a')
+    cache.put('b', 'answer b')
+    assert cache.get('a') == 'answer a'  # Now b is the least recently used
+
+    cache.put('c', 'answer c')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'answer a' and cache.get('c') == 'answer c'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_total_characters_are_bounded():
+    cache = ResponseCache(max_entries=10, max_chars=10)
+    cache.put('a', 'x' * 6)
+    cache.put('b', 'y' * 6)
+    cache.put('too big', 'z' * 11)
+
+    assert cache.get('a') is None and cache.get('b') == 'y' * 6
+    assert cache.get('too big') is None
+    assert cache.stats()['chars'] == 6
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, 'time', lambda: now[0])
+    cache = ResponseCache(ttl_seconds=60)
+    cache.put('a', 'answer')
+
+    now[0] += 59
+    assert cache.get('a') == 'answer'
+    now[0] += 1
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['chars']) == (1, 1, 0, 0)
+
+
+def test_keys_depend_on_question_template_and_context():
+    key = ResponseCache.make_key('What is 2+2?', 'template')
+    assert ResponseCache.make_key('  what is 2+2 ', 'template') == key
+    assert ResponseCache.make_key('What is 2+2?', 'other template') != key
+    assert ResponseCache.make_key('What is 2+2?', 'template', [('user', 'hi')]) != key
+
+
+def test_daphinix_cache_key_separates_conversations_and_counts_bypasses(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'response_cache', ResponseCache())
+    key_for = app_module.daphinix_cache_key
+    first_chat = [{'role': 'user', 'content': 'What is entropy?'}, {'role': 'assistant', 'content': 'Disorder...'}]
+    second_chat = [{'role': 'user', 'content': 'What is a derivative?'}, {'role': 'assistant', 'content': 'A rate...'}]
+
+    follow_up = key_for('explain that again', 'instructions', first_chat)
+    assert follow_up is not None
+    assert key_for('explain that again', 'instructions', second_chat) != follow_up
+    assert key_for('explain that again', 'instructions', list(first_chat)) == follow_up
+    assert key_for('explain that again', 'instructions', []) != follow_up
+    assert app_module.response_cache.stats()['bypassed'] == 0
+
+    assert key_for('hi', 'instructions', [], use_cache=False) is None
+    assert key_for('hi', 'instructions', first_chat + second_chat) is None  # Too much context
+    assert key_for('hi', 'instructions', [{'role': 'summary', 'content': 'earlier talk'}]) is None
+    assert app_module.response_cache.stats()['bypassed'] == 3
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from response_formatting import LATEX_COMMANDS, StreamingResponseFormatter, format_latex, format_response
+
+
+def legacy_format_latex(text):
+    """format_latex as it was before the single-pass regex: one str.replace per command."""
+    for command in LATEX_COMMANDS:
+        text = text.replace('\\' + command, '\\\\' + command)
+    return text
+
+
+GOLDEN = [
+    ('', ''),
+    ('no maths here', 'no maths here'),
+    (r'\int_0^1 x\,dx', r'\\int_0^1 x\,dx'),
+    (r'$\frac{a}{b} + \dfrac{c}{d}$', r'$\\frac{a}{b} + \\dfrac{c}{d}$'),
+    (r'\begin{bmatrix} 1 & 0 \end{bmatrix}', r'\\begin{bmatrix} 1 & 0 \\end{bmatrix}'),
+    (r'a \; b \quad c', r'a \\; b \\quad c'),
+    (r'\sum_{i=1}^{n} \alpha_i \cdot \beta_i', r'\\sum_{i=1}^{n} \\alpha_i \\cdot \\beta_i'),
+    (r'\lim_{x \rightarrow \infty} \sin x \leq 1', r'\\lim_{x \\rightarrow \\infty} \\sin x \\leq 1'),
+    (r'\Rightarrow \Leftarrow \leftarrow', r'\\Rightarrow \\Leftarrow \\leftarrow'),
+    (r'\pi \pin \piano', r'\\pi \\pin \\piano'),  # Prefix matches, like str.replace
+    (r'\mathbb{R} \text{x} \unknown', r'\mathbb{R} \text{x} \unknown'),
+    (r'\nabla \times F = \partial_t E', r'\\nabla \\times F = \\partial_t E'),
+    (r'\\int stays escaped', r'\\int stays escaped'),
+    (r'\\\int', r'\\\\int'),
+    ('trailing backslash \\', 'trailing backslash \\'),
+]
+
+
+@pytest.mark.parametrize('text, expected', GOLDEN)
+def test_format_latex_golden(text, expected):
+    assert format_latex(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [pair for pair in GOLDEN if '\\\\' not in pair[0]])
+def test_format_latex_matches_the_chained_replaces(text, expected):
+    # Input that is already escaped is the one intended difference: the old code turned "\\int" into "\\\int"
+    assert legacy_format_latex(text) == expected
+
+
+def test_format_response_strips_object_markers():
+    assert format_response(r'x [object Object]\frac12') == r'x \\frac12'
+
+
+def stream(chunks):
+    formatter = StreamingResponseFormatter()
+    return ''.join(formatter.feed(chunk) for chunk in chunks) + formatter.flush()
+
+
+@pytest.mark.parametrize('text', [text for text, _ in GOLDEN] + [
+    r'see [object Object] then \begin{bmatrix} a \end{bmatrix}',
+    r'[obj not a marker] \Rightarrow [object Object',
+])
+def test_streaming_matches_whole_text_at_every_split(text):
+    expected = format_response(text)
+    for cut in range(len(text) + 1):
+        assert stream([text[:cut], text[cut:]]) == expected, cut
+
+
+def test_streaming_matches_whole_text_for_random_chunking():
+    rng = random.Random(7)
+    pieces = [r'\int', r'\\', '\\', ' x ', r'\frac{1}{2}', '[object Object]', '[obj', r'\;', 'ect Object]', r'\Rightarrow']
+    for _ in range(300):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 12)))
+        cuts = sorted(rng.sample(range(len(text) + 1), rng.randint(0, min(6, len(text)))))
+        chunks = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+        assert stream(chunks) == format_response(text), chunks
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from room_deletion import RoomDeleter
+
+MESSAGES = 1201  # Three batches: 500, 500, 201
+
+
+def seed_room(fake_db, room_id, messages=MESSAGES):
+    fake_db.document(f'rooms/{room_id}').set({'name': room_id, 'participants': []})
+    batch = fake_db.batch()
+    for index in range(messages):
+        batch.set(fake_db.document(f'rooms/{room_id}/messages/m{index:05d}'), {'message': f'hi {index}'})
+        if index % 400 == 399:
+            batch.commit()
+    batch.commit()
+
+
+def test_messages_are_deleted_in_batches_of_at_most_500(fake_db):
+    seed_room(fake_db, 'room1')
+    seed_room(fake_db, 'room2', messages=3)
+    batch_sizes = []
+    fake_db.commit_hook = lambda writes: batch_sizes.append(len(writes))
+
+    assert RoomDeleter()._delete_room('room1') == MESSAGES
+
+    assert batch_sizes == [1, 500, 500, 201]  # The room document first, then the messages subcollection
+    assert fake_db.paths('rooms/room1') == []
+    assert len(fake_db.paths('rooms/room2/messages/')) == 3  # Other rooms are untouched
+
+
+def test_batch_size_is_capped_at_the_firestore_limit(fake_db):
+    assert RoomDeleter(batch_size=2000).batch_size == 500
+    seed_room(fake_db, 'room1', messages=5)
+    batch_sizes = []
+    fake_db.commit_hook = lambda writes: batch_sizes.append(len(writes))
+
+    assert RoomDeleter(batch_size=2)._delete_room('room1') == 5
+    assert batch_sizes == [1, 2, 2, 1]
+
+
+def test_rerun_after_a_partial_failure_finishes_the_deletion(fake_db):
+    seed_room(fake_db, 'room1')
+    commits = []
+
+    def fail_second_message_batch(writes):
+        commits.append(len(writes))
+        if len(commits) == 3:
+            raise google_exceptions.ServiceUnavailable('unavailable')
+    fake_db.commit_hook = fail_second_message_batch
+    deleter = RoomDeleter()
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        deleter._delete_room('room1')
+    assert fake_db.dump('rooms/room1') is None
+    assert len(fake_db.paths('rooms/room1/messages/')) == MESSAGES - 500
+
+    fake_db.commit_hook = None
+    assert deleter._delete_room('room1') == MESSAGES - 500
+    assert fake_db.paths('rooms/room1') == []
+    assert deleter._delete_room('room1') == 0  # Already gone: nothing to do, no error
+
+
+def test_queued_room_is_deleted_once_in_the_background(fake_db):
+    seed_room(fake_db, 'room1', messages=10)
+    release = threading.Event()
+    fake_db.commit_hook = lambda writes: release.wait(5)  # Holds the worker inside the first deletion
+    deleter = RoomDeleter()
+
+    deleter.delete('room1')
+    deleter.delete('room1')  # Still being deleted: not queued twice
+    release.set()
+    deadline = time.monotonic() + 5
+    while deleter.stats()['pending'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert deleter.stats() == {'pending': 0, 'deleted_rooms': 1, 'deleted_messages': 10, 'failures': 0}
+    assert fake_db.paths('rooms/room1') == []
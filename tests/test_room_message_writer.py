@@ -0,0 +1,106 @@
+import threading
+
+from google.api_core import exceptions as google_exceptions
+
+from room_message_writer import MAX_MESSAGE_CHARS, RoomMessageWriter, normalize_message
+
+
+def stored_messages(fake_db, room_id):
+    prefix = f'rooms/{room_id}/messages/'
+    return [fake_db.dump(path)['message'] for path in fake_db.paths(prefix)]
+
+
+def test_normalize_message_makes_values_storable():
+    normalized = normalize_message({'username': 'ana', 'message': [[1]], '': 'x', 'extra': {'a': [[2]]}})
+    assert normalized == {'username': 'ana', 'message': '[[1]]', 'extra': "{'a': [[2]]}"}
+    assert len(normalize_message({'message': 'x' * (MAX_MESSAGE_CHARS + 10)})['message']) == MAX_MESSAGE_CHARS
+
+
+def test_rejected_message_is_dead_lettered_and_the_rest_are_written(fake_db):
+    def reject_bad(writes):
+        if any(data and data.get('message') == 'bad' for _, _, data, _ in writes):
+            raise google_exceptions.InvalidArgument('rejected')
+    fake_db.commit_hook = reject_bad
+    writer = RoomMessageWriter(max_batch=10, flush_interval=60)
+
+    for text in ['one', 'two', 'bad', 'four', 'five']:
+        writer.enqueue('room1', {'username': 'ana', 'message': text})
+    assert writer.flush(timeout=5)
+
+    assert sorted(stored_messages(fake_db, 'room1')) == ['five', 'four', 'one', 'two']
+    assert writer.stats()['dead_lettered_messages'] == 1
+    assert writer.dead_letters[0][2]['message'] == 'bad'
+
+
+def test_retries_are_capped(fake_db):
+    def unavailable(writes):
+        raise google_exceptions.ServiceUnavailable('down')
+    fake_db.commit_hook = unavailable
+    writer = RoomMessageWriter(max_batch=10, flush_interval=60, max_retry_delay=0.01, max_attempts=3)
+
+    writer.enqueue('room1', {'username': 'ana', 'message': 'hello'})
+    assert writer.flush(timeout=5)
+
+    stats = writer.stats()
+    assert stats['failed_flushes'] == 3
+    assert stats['dead_lettered_messages'] == 1
+    assert stats['pending'] == 0
+
+
+def test_queue_is_bounded(fake_db):
+    release = threading.Event()
+    fake_db.commit_hook = lambda writes: release.wait(5)
+    writer = RoomMessageWriter(max_batch=1, flush_interval=0, max_pending=3)
+
+    results = [writer.enqueue('room1', {'message': str(index)}) for index in range(10)]
+    release.set()
+    assert writer.flush(timeout=5)
+
+    assert results.count(False) == writer.stats()['dropped_messages'] > 0
+    assert len(stored_messages(fake_db, 'room1')) == results.count(True)
+
+
+def test_messages_in_flight_for_a_deleted_room_are_removed(fake_db):
+    committing = threading.Event()
+    release = threading.Event()
+
+    def block_first_commit(writes):
+        if not committing.is_set():
+            committing.set()
+            release.wait(5)
+    fake_db.commit_hook = block_first_commit
+    writer = RoomMessageWriter(max_batch=10, flush_interval=0)
+
+    writer.enqueue('doomed', {'message': 'hi'})
+    writer.enqueue('kept', {'message': 'hello'})
+    assert committing.wait(5)
+    writer.discard_room('doomed')
+    release.set()
+    assert writer.flush(timeout=5)
+
+    assert stored_messages(fake_db, 'doomed') == []
+    assert stored_messages(fake_db, 'kept') == ['hello']
+
+
+def test_chat_history_pages_through_messages_sent_in_the_same_instant(login, fake_db, app_module):
+    messages_ref = fake_db.collection('rooms').document('room1').collection('messages')
+    for index in range(7):
+        messages_ref.document().set({'username': 'ana', 'message': f'burst {index}', 'timestamp': '2024-01-01T10:00:00'})
+    messages_ref.document().set({'username': 'ana', 'message': 'before', 'timestamp': '2024-01-01T09:00:00'})
+    messages_ref.document().set({'username': 'ana', 'message': 'after', 'timestamp': '2024-01-01T11:00:00'})
+    client = login()
+
+    pages, cursor = [], ''
+    while cursor is not None:
+        body = client.get(f'/api/room_chat_history/room1?limit=3&start_after={cursor}').get_json()
+        if body['messages']:
+            pages.append([message['message'] for message in body['messages']])
+        cursor = body['next_cursor']
+    assert pages[0][-1] == 'after'  # Latest page first, each page oldest first
+    assert pages[-1][0] == 'before'
+    seen = [text for page in pages for text in page]
+    assert sorted(seen) == sorted(['before', 'after'] + [f'burst {index}' for index in range(7)])
+
+    messages, cursor = app_module.get_room_messages('room1', 20)
+    assert [message['message'] for message in messages][::8] == ['before', 'after'] and cursor is None
+    assert client.get('/api/room_chat_history/room1?start_after=2024-01-01T10:00:00').status_code == 400
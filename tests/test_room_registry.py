@@ -0,0 +1,36 @@
+from room_registry import RoomRegistry
+
+
+def test_add_and_remove_keep_both_indexes_in_step():
+    registry = RoomRegistry()
+    assert registry.add('s1', 'u1', 'r1', 'Ana') is None
+    registry.add('s2', 'u2', 'r1', 'Ben')
+
+    assert sorted(info['user_id'] for info in registry.sessions_in('r1')) == ['u1', 'u2']
+    assert registry.remove('s1') == {'user_id': 'u1', 'room_id': 'r1', 'display_name': 'Ana'}
+    assert registry.remove('s1') is None
+    assert [info['user_id'] for info in registry.sessions_in('r1')] == ['u2']
+
+    registry.remove('s2')
+    assert not registry.has_sessions('r1')
+    assert registry.sessions_in('r1') == []
+    assert registry.stats() == {'sessions': 0, 'rooms': 0}
+
+
+def test_moving_a_socket_leaves_its_old_room():
+    registry = RoomRegistry()
+    registry.add('s1', 'u1', 'r1', 'Ana')
+
+    previous = registry.add('s1', 'u1', 'r2', 'Ana')
+
+    assert previous['room_id'] == 'r1'
+    assert not registry.has_sessions('r1')
+    assert [info['room_id'] for info in registry.sessions_in('r2')] == ['r2']
+    assert registry.stats() == {'sessions': 1, 'rooms': 1}
+
+
+def test_sessions_in_returns_copies():
+    registry = RoomRegistry()
+    registry.add('s1', 'u1', 'r1', 'Ana')
+    registry.sessions_in('r1')[0]['room_id'] = 'elsewhere'
+    assert registry.sessions_in('r1')[0]['room_id'] == 'r1'
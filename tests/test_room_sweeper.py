@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+from room_sweeper import FirestoreLease, backfill_empty_since, find_empty_rooms
+
+
+def test_released_lease_can_be_taken_by_another_worker_immediately(fake_db):
+    first, second = FirestoreLease('room_sweeper', 300), FirestoreLease('room_sweeper', 300)
+
+    assert first.acquire()
+    assert first.acquire()  # Renewing our own lease
+    assert not second.acquire()
+
+    first.release()
+    assert fake_db.dump('locks/room_sweeper') is None
+    assert second.acquire()
+
+
+def test_release_leaves_a_lease_held_by_someone_else(fake_db):
+    holder, other = FirestoreLease('room_sweeper', 300), FirestoreLease('room_sweeper', 300)
+    assert holder.acquire()
+
+    other.release()  # Never held it: nothing to do
+    assert not other.acquire()
+    other.release()
+    assert fake_db.dump('locks/room_sweeper')['holder'] == holder.holder
+
+
+def test_legacy_rooms_without_empty_since_are_swept_after_a_backfill(fake_db):
+    long_ago = datetime.now(timezone.utc) - timedelta(hours=2)
+    fake_db.document('rooms/legacy_empty').set({'name': 'a', 'participants': []})
+    fake_db.document('rooms/legacy_busy').set({'name': 'b', 'participants': ['ana']})
+    fake_db.document('rooms/current_empty').set({'name': 'c', 'participants': [], 'emptySince': long_ago})
+    fake_db.document('rooms/current_busy').set({'name': 'd', 'participants': ['ben'], 'emptySince': None})
+
+    assert [room.id for room in find_empty_rooms(60)] == ['current_empty']  # Legacy rooms are invisible
+
+    assert backfill_empty_since(page_size=1) == 1
+    assert fake_db.dump('rooms/legacy_busy')['emptySince'] is None
+    assert fake_db.dump('rooms/current_empty')['emptySince'] == long_ago  # Rooms with the field are left alone
+    assert [room.id for room in find_empty_rooms(0)] == ['current_empty', 'legacy_empty']
+    assert [room.id for room in find_empty_rooms(60)] == ['current_empty']  # Grace period starts at the backfill
+
+    commits = fake_db.commits
+    assert backfill_empty_since() == 0  # Nothing left to mark
+    assert fake_db.commits == commits
@@ -0,0 +1,178 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from room_timers import RoomTimerScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def manual_scheduler(callback=None, interval=1.0):
+    """A scheduler without its thread, ticked by run_due() against a fake clock."""
+    clock = FakeClock()
+    ticks = []
+
+    def record(room_id):
+        ticks.append((clock.now, room_id))
+        return callback(room_id) if callback else True
+    return RoomTimerScheduler(record, interval=interval, clock=clock, autostart=False), clock, ticks
+
+
+def test_rooms_tick_once_per_interval_from_their_first_deadline():
+    scheduler, clock, ticks = manual_scheduler()
+    scheduler.schedule('a')
+
+    assert scheduler.run_due() == 0
+    clock.advance(1)
+    assert scheduler.run_due() == 1
+    clock.advance(0.5)
+    assert scheduler.run_due() == 0
+    clock.advance(0.5)
+    assert scheduler.run_due() == 1
+    assert ticks == [(101.0, 'a'), (102.0, 'a')]
+
+
+def test_due_rooms_tick_in_deadline_order():
+    scheduler, clock, ticks = manual_scheduler(callback=lambda room_id: False)
+    scheduler.schedule('late', delay=3)
+    scheduler.schedule('first', delay=1)
+    scheduler.schedule('middle', delay=2)
+
+    clock.advance(5)
+    assert scheduler.run_due() == 3
+    assert [room_id for _, room_id in ticks] == ['first', 'middle', 'late']
+
+
+def test_cancelled_room_never_ticks_again():
+    scheduler, clock, ticks = manual_scheduler()
+    scheduler.schedule('a')
+    scheduler.schedule('b')
+
+    assert scheduler.cancel('a') is True
+    assert scheduler.cancel('a') is False
+    clock.advance(1)
+    assert scheduler.run_due() == 1
+    assert [room_id for _, room_id in ticks] == ['b']
+    assert not scheduler.is_active('a')
+    assert scheduler.stats()['heap_size'] == 1  # The cancelled entry was dropped on the way
+
+
+def test_rescheduling_supersedes_the_earlier_deadline():
+    scheduler, clock, ticks = manual_scheduler()
+    scheduler.schedule('a', delay=5)
+    scheduler.schedule('a', delay=1)
+
+    for _ in range(5):
+        clock.advance(1)
+        scheduler.run_due()
+    assert ticks == [(101.0, 'a'), (102.0, 'a'), (103.0, 'a'), (104.0, 'a'), (105.0, 'a')]  # No extra tick at 105
+
+
+def test_falsy_or_failing_callbacks_drop_the_room():
+    def callback(room_id):
+        if room_id == 'broken':
+            raise RuntimeError('boom')
+        return room_id != 'finished'
+    scheduler, clock, ticks = manual_scheduler(callback)
+    for room_id in ('finished', 'broken', 'running'):
+        scheduler.schedule(room_id)
+
+    clock.advance(1)
+    scheduler.run_due()
+    clock.advance(1)
+    scheduler.run_due()
+    assert [room_id for _, room_id in ticks] == ['finished', 'broken', 'running', 'running']  # Equal deadlines tick in scheduling order
+    assert scheduler.stats()['active_timers'] == 1
+
+
+def test_room_cancelled_by_its_own_callback_is_not_rescheduled():
+    scheduler, clock, ticks = manual_scheduler(callback=lambda room_id: scheduler.cancel(room_id) or True)
+    scheduler.schedule('a')
+
+    clock.advance(1)
+    scheduler.run_due()
+    clock.advance(1)
+    assert scheduler.run_due() == 0
+    assert len(ticks) == 1
+
+
+def test_a_late_tick_skips_ahead_instead_of_bursting():
+    scheduler, clock, ticks = manual_scheduler()
+    scheduler.schedule('a')
+
+    clock.advance(10.5)
+    assert scheduler.run_due() == 1
+    stats = scheduler.stats()
+    assert stats['skipped_ticks'] == 9
+    assert stats['max_tick_lag_ms'] == 9500.0
+    clock.advance(1)
+    assert scheduler.run_due() == 1  # Next tick one interval after the late one
+
+
+def test_background_thread_ticks_with_the_real_clock():
+    ticked = threading.Event()
+    ticks = []
+
+    def callback(room_id):
+        ticks.append(room_id)
+        if len(ticks) == 3:
+            ticked.set()
+            return False
+        return True
+    scheduler = RoomTimerScheduler(callback, interval=0.01)
+    scheduler.schedule('a')
+
+    assert ticked.wait(5)
+    assert ticks == ['a', 'a', 'a']
+
+
+def expired_room(fake_db, app_module):
+    timer = {'isRunning': True, 'isWorkSession': True, 'workDuration': 25, 'breakDuration': 5,
+             'timeLeft': 0, 'startedAt': 1000.0, 'endsAt': 1500.0}
+    fake_db.document('rooms/r1').set({'name': 'r1', 'timer': timer})
+    app_module.active_room_timers['r1'] = dict(timer)
+
+
+def test_phase_switch_is_written_off_the_scheduler_thread(fake_db, app_module, monkeypatch):
+    expired_room(fake_db, app_module)
+    release = threading.Event()
+    writer_threads = []
+
+    def slow_commit(writes):
+        writer_threads.append(threading.current_thread().name)
+        release.wait(5)
+    fake_db.commit_hook = slow_commit
+    emitted = threading.Event()
+    monkeypatch.setattr(app_module.socketio, 'emit', lambda event, data, room=None: emitted.set())
+
+    assert app_module.room_timer_tick('r1') is False  # Returns while the write is still blocked
+    assert 'r1' not in app_module.active_room_timers
+    release.set()
+
+    assert emitted.wait(5)
+    assert writer_threads[0].startswith('room-timer-write')
+    stored = fake_db.dump('rooms/r1')['timer']
+    assert (stored['isRunning'], stored['isWorkSession'], stored['timeLeft']) == (False, False, 300)
+
+
+def test_phase_switch_skips_a_timer_restarted_meanwhile(fake_db, app_module, monkeypatch):
+    expired_room(fake_db, app_module)
+    emitted = []
+    monkeypatch.setattr(app_module.socketio, 'emit', lambda event, data, room=None: emitted.append(data))
+    fake_db.document('rooms/r1').update({'timer.endsAt': 9999999999.0})  # Restarted by another worker
+    writes = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(app_module, 'room_timer_writes', writes)
+
+    app_module.room_timer_tick('r1')
+    writes.shutdown(wait=True)
+
+    assert fake_db.dump('rooms/r1')['timer']['isRunning'] is True
+    assert emitted == []
@@ -0,0 +1,47 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import gamification_logic
+
+SESSIONS = 12
+DURATION = 25
+XP_PER_MINUTE = 2
+
+
+def test_parallel_session_completed_events_are_all_counted(login, fake_db):
+    fake_db.document('gamification_config/settings').set({
+        'xpValues': {'perPomodoroWorkMinute': XP_PER_MINUTE},
+        'leveling': {'baseXpForLevelUp': 1000000},  # No level-ups, so xp is a plain sum
+    })
+    gamification_logic.invalidate_gamification_settings()
+    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+    fake_db.document('users/u1').set({
+        'username': 'ana',
+        'progress': {'xp': 10, 'level': 1, 'sessions': 3, 'total_time': 75, 'streak': 4, 'lastStudyDay': yesterday},
+        'leaderboardData': {'username': 'ana', 'totalXp': 10, 'currentStreak': 4, 'level': 1},
+    })
+
+    clients = [login('u1') for _ in range(SESSIONS)]
+    start = threading.Barrier(SESSIONS)
+    statuses = []
+
+    def complete_session(client):
+        start.wait()
+        response = client.post('/api/user_data', json={
+            'event_type': 'session_completed', 'event_data': {'duration': DURATION}})
+        statuses.append(response.status_code)
+    threads = [threading.Thread(target=complete_session, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert statuses == [200] * SESSIONS
+    progress = fake_db.dump('users/u1')['progress']
+    assert progress['xp'] == 10 + SESSIONS * DURATION * XP_PER_MINUTE
+    assert progress['sessions'] == 3 + SESSIONS
+    assert progress['total_time'] == 75 + SESSIONS * DURATION
+    assert progress['streak'] == 5  # Studying again today extends yesterday's streak once
+    assert len(fake_db.paths('users/u1/sessions/')) == SESSIONS
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    assert fake_db.dump(f'users/u1/session_days/{today}')['sessions'] == SESSIONS
@@ -0,0 +1,57 @@
+import session_history
+
+LEGACY_HISTORY = [
+    {'type': 'work', 'duration': 25, 'date': '2024-03-01T09:00:00+00:00', 'xp_earned': 25},
+    {'type': 'work', 'duration': 50, 'date': 'yesterday', 'xp_earned': 50},
+    {'type': 'work', 'duration': 'lots', 'date': '2024-03-01T10:00:00Z'},
+    {'type': 'work', 'date': None},
+    'not a session',
+    {'type': 'work', 'duration': 30, 'date': '2024-03-02T08:00:00Z', 'xp_earned': 30},
+]
+
+
+def seed_legacy_user(fake_db):
+    fake_db.document('users/u1').set({
+        'username': 'ana',
+        'progress': {'xp': 0, 'level': 1, 'sessions': 2, 'sessionHistory': LEGACY_HISTORY},
+        'leaderboardData': {'username': 'ana', 'totalXp': 0, 'currentStreak': 0, 'level': 1},
+    })
+
+
+def test_unreadable_legacy_entries_are_skipped(fake_db):
+    seed_legacy_user(fake_db)
+
+    assert session_history.migrate_legacy_history('u1') == 2
+
+    assert 'sessionHistory' not in fake_db.dump('users/u1')['progress']
+    assert fake_db.paths('users/u1/sessions/') == [
+        'users/u1/sessions/legacy-20240301T090000000000', 'users/u1/sessions/legacy-20240302T080000000000']
+    assert fake_db.dump('users/u1/session_days/2024-03-01')['minutes'] == 25
+    assert fake_db.dump('users/u1/session_weeks/2024-W09')['sessions'] == 2
+
+
+def test_save_with_unreadable_legacy_history_still_succeeds(login, fake_db):
+    seed_legacy_user(fake_db)
+
+    response = login().post('/api/user_data', json={'event_type': 'session_completed', 'event_data': {'duration': 10}})
+
+    assert response.status_code == 200
+    assert len(fake_db.paths('users/u1/sessions/')) == 3  # Two migrated plus the new one
+    assert 'sessionHistory' not in fake_db.dump('users/u1')['progress']
+
+
+def test_session_pages_do_not_skip_sessions_with_the_same_date(login, fake_db):
+    sessions_ref = session_history.sessions_ref('u1')
+    for index in range(5):
+        sessions_ref.document(f's{index}').set({'type': 'work', 'duration': index, 'date': '2024-03-01T09:00:00+00:00'})
+    sessions_ref.document('newest').set({'type': 'work', 'duration': 99, 'date': '2024-03-02T09:00:00+00:00'})
+    client = login()
+
+    durations, cursor = [], ''
+    while cursor is not None:
+        body = client.get(f'/api/session_history?limit=2&start_after={cursor}').get_json()
+        durations += [entry['duration'] for entry in body['sessions']]
+        cursor = body['next_cursor']
+    assert durations[0] == 99
+    assert sorted(durations) == [0, 1, 2, 3, 4, 99]
+    assert client.get('/api/session_history?start_after=2024-03-01T09:00:00%2B00:00').status_code == 400
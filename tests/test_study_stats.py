@@ -0,0 +1,134 @@
+from datetime import date
+
+import pytest
+
+from firebase_admin import firestore
+
+import session_history
+import study_stats
+
+
+def session(completed_at, duration, xp=None):
+    return {'type': 'work', 'duration': duration, 'date': completed_at, 'xp_earned': duration if xp is None else xp}
+
+
+def record(fake_db, user_id, entries):
+    @firestore.transactional
+    def write(transaction):
+        session_history.record_sessions(transaction, user_id, entries)
+    write(fake_db.transaction())
+
+
+SESSIONS = [
+    session('2024-03-03T09:30:00+00:00', 25),  # Sunday, ISO week 9
+    session('2024-03-03T23:40:00Z', 50),  # Sunday night
+    # Started 23:50 on Sunday, finished 00:15 on Monday: counted where it finished (Monday, week 10, hour 00)
+    session('2024-03-04T00:15:00Z', 25),
+    session('2024-03-04T02:30:00+02:00', 30),  # 00:30 UTC on Monday, though local time says 02:30
+    session('2024-03-05T18:00:00Z', 45, xp=90),
+]
+
+
+def test_rollups_bucket_sessions_by_utc_day_week_and_hour(fake_db):
+    record(fake_db, 'u1', SESSIONS[:3])
+    record(fake_db, 'u1', SESSIONS[3:])
+
+    days = {path.rsplit('/', 1)[1]: fake_db.dump(path) for path in fake_db.paths('users/u1/session_days/')}
+    assert days == {
+        '2024-03-03': {'date': '2024-03-03', 'minutes': 75, 'sessions': 2, 'xp': 75},
+        '2024-03-04': {'date': '2024-03-04', 'minutes': 55, 'sessions': 2, 'xp': 55},
+        '2024-03-05': {'date': '2024-03-05', 'minutes': 45, 'sessions': 1, 'xp': 90},
+    }
+    weeks = {path.rsplit('/', 1)[1]: fake_db.dump(path) for path in fake_db.paths('users/u1/session_weeks/')}
+    assert weeks == {
+        '2024-W09': {'week': '2024-W09', 'minutes': 75, 'sessions': 2, 'xp': 75},
+        '2024-W10': {'week': '2024-W10', 'minutes': 100, 'sessions': 3, 'xp': 145},
+    }
+    assert fake_db.dump('users/u1/session_stats/hours') == {
+        'minutes': {'09': 25, '23': 50, '00': 55, '18': 45},
+        'sessions': {'09': 1, '23': 1, '00': 2, '18': 1},
+    }
+    assert len(fake_db.paths('users/u1/sessions/')) == len(SESSIONS)
+
+
+def test_build_stats_reads_the_rollups(fake_db):
+    record(fake_db, 'u1', SESSIONS)
+
+    stats = study_stats.build_stats('u1', days=14, weeks=3, today=date(2024, 3, 5))
+
+    assert stats['range'] == {'start': '2024-02-21', 'end': '2024-03-05', 'days': 14}
+    assert stats['totals'] == {'minutes': 175, 'sessions': 5, 'xp': 220, 'active_days': 3, 'average_minutes_per_day': 12.5}
+    assert [day['minutes'] for day in stats['daily'][-3:]] == [75, 55, 45]
+    assert stats['rolling_7_day_minutes'][-1] == 25.0
+    assert stats['last_7_days']['minutes'] == 175
+    assert stats['previous_7_days']['minutes'] == 0
+    assert stats['week_over_week_change_percent'] is None
+    assert stats['weekly'] == [
+        {'week': '2024-W08', 'minutes': 0, 'sessions': 0},
+        {'week': '2024-W09', 'minutes': 75, 'sessions': 2},
+        {'week': '2024-W10', 'minutes': 100, 'sessions': 3},
+    ]
+    assert stats['hours']['minutes'][0] == 55
+    assert stats['best_hour'] == 0
+
+
+def test_daily_series_sums_and_ranges():
+    series = study_stats.DailySeries(date(2024, 1, 1), 5, [
+        {'date': '2024-01-02', 'minutes': 10, 'sessions': 1, 'xp': 10},
+        {'date': '2024-01-05', 'minutes': 30, 'sessions': 2, 'xp': 40},
+        {'date': '2024-01-09', 'minutes': 99, 'sessions': 9, 'xp': 99},  # Outside the range
+    ])
+
+    assert series.minutes == [0, 10, 0, 0, 30]
+    assert series.total() == {'minutes': 40, 'sessions': 3, 'xp': 50}
+    assert series.total(1, 3) == {'minutes': 10, 'sessions': 1, 'xp': 10}
+    assert series.total(-5, 0) == {'minutes': 0, 'sessions': 0, 'xp': 0}
+    assert series.total(3, 1) == {'minutes': 0, 'sessions': 0, 'xp': 0}
+    assert series.rolling_average(2) == [0.0, 5.0, 5.0, 0.0, 15.0]
+    assert series.active_days() == 2
+
+
+def test_ranges_are_clamped(fake_db):
+    stats = study_stats.build_stats('nobody', days=10000, weeks=0, today=date(2024, 3, 5))
+    assert stats['range']['days'] == study_stats.MAX_RANGE_DAYS
+    assert len(stats['weekly']) == 1
+    assert stats['best_hour'] is None
+
+
+IST_SESSIONS = [
+    session('2024-02-25T18:00:00Z', 10),  # Sunday 23:30 IST, before the requested weeks
+    session('2024-02-26T18:00:00Z', 15),  # Monday 23:30 IST, week 9
+    session('2024-03-03T20:00:00Z', 30),  # Sunday in UTC, but Monday 01:30 in IST (week 10)
+    session('2024-03-04T09:00:00+00:00', 25),  # Monday 14:30 IST
+    session('2024-03-04T19:00:00Z', 40),  # Monday in UTC, Tuesday 00:30 in IST
+]
+
+
+def test_build_stats_buckets_days_weeks_and_hours_in_the_users_timezone(fake_db):
+    record(fake_db, 'u1', IST_SESSIONS)
+
+    utc = study_stats.build_stats('u1', days=7, weeks=2, today=date(2024, 3, 5))
+    ist = study_stats.build_stats('u1', days=7, weeks=2, today=date(2024, 3, 5), tz=study_stats.parse_tz_offset(330))
+
+    assert [day['minutes'] for day in utc['daily'][-3:]] == [30, 65, 0]
+    assert [day['minutes'] for day in ist['daily'][-3:]] == [0, 55, 40]
+    assert ist['timezone'] == 'UTC+05:30' and utc['timezone'] == 'UTC'
+    assert ist['weekly'] == [{'week': '2024-W09', 'minutes': 15, 'sessions': 1},
+                             {'week': '2024-W10', 'minutes': 95, 'sessions': 3}]
+    assert [ist['hours']['minutes'][hour] for hour in (0, 1, 14, 23)] == [40, 30, 25, 15]
+    assert ist['best_hour'] == 0
+    assert ist['totals']['minutes'] == 95
+
+
+@pytest.mark.parametrize('minutes', [-721, 841, 7, True, '330'])
+def test_parse_tz_offset_rejects_offsets_no_timezone_uses(minutes):
+    with pytest.raises(ValueError):
+        study_stats.parse_tz_offset(minutes)
+
+
+def test_stats_route_takes_the_client_offset(login, fake_db):
+    client = login()
+
+    assert client.get('/api/stats?tz_offset=330').get_json()['timezone'] == 'UTC+05:30'
+    assert client.get('/api/stats').get_json()['timezone'] == 'UTC'
+    assert client.get('/api/stats?tz_offset=1000').status_code == 400
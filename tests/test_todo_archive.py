@@ -0,0 +1,77 @@
+import pytest
+
+import todo_archive
+from todo_archive import TodoArchiver, archive_page
+
+SAME_MOMENT = '2024-01-10T09:00:00+00:00'
+
+
+def seed_done_todos(fake_db):
+    items = {f't{index}': {'name': f'task {index}', 'status': 'Done', 'completedAt': SAME_MOMENT} for index in range(5)}
+    items['older'] = {'name': 'older', 'status': 'Done', 'completedAt': '2024-01-01T09:00:00+00:00'}
+    items['undated'] = {'name': 'undated', 'status': 'Done'}  # Saved before completedAt existed
+    items['open'] = {'name': 'open', 'status': 'To Do', 'completedAt': None}
+    fake_db.document('todo_lists/u1').set({'items': items})
+
+
+def all_pages(limit):
+    names, cursor, pages = [], None, 0
+    while True:
+        todos, cursor = archive_page('u1', limit, cursor)
+        names += [todo['name'] for todo in todos]
+        pages += 1
+        if cursor is None:
+            return names, pages
+
+
+def test_archiving_moves_only_expired_items(fake_db):
+    seed_done_todos(fake_db)
+
+    assert TodoArchiver().archive_user('u1') == 7
+    assert list(fake_db.dump('todo_lists/u1')['items']) == ['open']
+    assert len(fake_db.paths('todo_lists/u1/archive/')) == 7
+    assert fake_db.dump('todo_lists/u1/archive/undated')['completedAt'] is None
+    assert TodoArchiver().archive_user('u1') == 0
+
+
+def test_archiving_runs_in_batches(fake_db, monkeypatch):
+    monkeypatch.setattr(todo_archive, 'ARCHIVE_BATCH_LIMIT', 2)
+    seed_done_todos(fake_db)
+    commits = fake_db.commits
+
+    assert TodoArchiver().archive_user('u1') == 7
+    assert fake_db.commits - commits == 4
+    assert list(fake_db.dump('todo_lists/u1')['items']) == ['open']
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 50])
+def test_pages_return_every_archived_todo_once(fake_db, limit):
+    seed_done_todos(fake_db)
+    TodoArchiver().archive_user('u1')
+
+    names, _ = all_pages(limit)
+    assert sorted(names[:5]) == [f'task {index}' for index in range(5)]  # Same completedAt, split across pages
+    assert names[5:] == ['older', 'undated']  # Newest first, undated last
+
+
+def test_last_page_ending_on_an_undated_todo(fake_db):
+    seed_done_todos(fake_db)
+    TodoArchiver().archive_user('u1')
+
+    todos, cursor = archive_page('u1', 6)
+    assert todos[-1]['name'] == 'older' and cursor is not None
+    todos, cursor = archive_page('u1', 1, cursor)
+    assert [todo['name'] for todo in todos] == ['undated'] and cursor is not None
+    assert archive_page('u1', 1, cursor) == ([], None)
+
+
+def test_archive_route_pages_and_rejects_foreign_cursors(login, fake_db):
+    seed_done_todos(fake_db)
+    TodoArchiver().archive_user('u1')
+    client = login()
+
+    first = client.get('/api/todo_list/archive?limit=4').get_json()
+    second = client.get(f"/api/todo_list/archive?limit=4&start_after={first['next_cursor']}").get_json()
+    assert len({todo['id'] for todo in first['todos'] + second['todos']}) == 7
+    assert second['next_cursor'] is None
+    assert client.get(f'/api/todo_list/archive?start_after={SAME_MOMENT}').status_code == 400
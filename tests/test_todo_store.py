@@ -0,0 +1,41 @@
+import pytest
+
+import todo_store
+
+
+@pytest.mark.parametrize('value, expected', [(0, 0), (3, 3), ('3', 3), ('"12"', 12), (' "7" ', 7)])
+def test_parse_version_accepts_integers_and_strong_etags(value, expected):
+    assert todo_store.parse_version(value) == expected
+
+
+@pytest.mark.parametrize('value', ['abc', '"abc"', 'W/"3"', '', '-1', '3.5', '٣', True, 2.0, None, [1], -2])
+def test_parse_version_rejects_anything_else(value):
+    with pytest.raises(ValueError):
+        todo_store.parse_version(value)
+
+
+def test_replace_todos_rejects_a_non_numeric_version(fake_db):
+    with pytest.raises(ValueError):
+        todo_store.replace_todos('u1', [{'name': 'a', 'timestamp': '1', 'version': 'abc'}])
+    with pytest.raises(ValueError):
+        todo_store.replace_todos('u1', {'name': 'not a list'})
+    assert fake_db.dump('todo_lists/u1') is None
+
+    todo_store.replace_todos('u1', [{'name': 'a', 'timestamp': '1', 'version': '2'}, {'name': 'b', 'timestamp': '2'}])
+    assert [todo['version'] for todo in todo_store.list_todos('u1')] == [3, 1]
+
+
+def test_malformed_versions_are_bad_requests(login, fake_db):
+    client = login()
+    todo = client.post('/api/todo_list/items', json={'name': 'read'}).get_json()['todo']
+    url = f"/api/todo_list/items/{todo['id']}"
+
+    assert client.patch(url, json={'status': 'Done'}, headers={'If-Match': '"abc"'}).status_code == 400
+    assert client.patch(url, json={'status': 'Done'}, headers={'If-Match': 'W/"1"'}).status_code == 400
+    assert client.patch(url, json={'status': 'Done', 'version': 'x'}).status_code == 400
+    assert client.delete(url, headers={'If-Match': 'nope'}).status_code == 400
+    assert client.post('/api/todo_list', json=[{'name': 'a', 'version': 'abc'}]).status_code == 400
+
+    assert client.patch(url, json={'status': 'Done'}, headers={'If-Match': '"2"'}).status_code == 409
+    assert client.patch(url, json={'status': 'Done'}, headers={'If-Match': '"1"'}).status_code == 200
+    assert client.delete(url, headers={'If-Match': '*'}).status_code == 200
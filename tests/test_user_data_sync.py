@@ -0,0 +1,77 @@
+import gamification_logic
+
+
+def seed_legacy_user(fake_db):
+    fake_db.document('gamification_config/settings').set({'leveling': {'baseXpForLevelUp': 100}})  # No quests to assign
+    gamification_logic.invalidate_gamification_settings()
+    fake_db.document('users/u1').set({
+        'username': 'ana',
+        'progress': {
+            'xp': 40, 'level': 2, 'sessions': 3, 'total_time': 75, 'streak': 1, 'lastStudyDay': '2024-01-02',
+            'activeQuests': [], 'completedQuests': [],
+            'badges': {'bronze': True, 'silver': False},  # Stored before badges became a list
+            'sessionHistory': [{'date': '2024-01-02T10:00:00+00:00', 'duration': 25, 'xp': 50}],
+        },
+        'leaderboardData': {'username': 'ana', 'totalXp': 40, 'currentStreak': 1, 'level': 2},
+    })
+
+
+def test_unchanged_sync_of_a_legacy_document_is_not_written(login, fake_db):
+    seed_legacy_user(fake_db)
+    client = login('u1')
+
+    body = client.get('/api/user_data').get_json()
+    assert body['progress']['badges'] == ['bronze']
+    commits = fake_db.commits
+
+    response = client.post('/api/user_data', json={'progress': body['progress'], 'version': body['version']})
+    assert response.get_json() == {'status': 'not_modified', 'version': body['version']}
+    response = client.post('/api/user_data', json={'progress': body['progress']},
+                           headers={'If-None-Match': f'"{body["version"]}"'})
+    assert response.get_json()['status'] == 'not_modified'
+    assert fake_db.commits == commits
+
+
+def test_stale_version_gets_the_normalized_progress(login, fake_db):
+    seed_legacy_user(fake_db)
+    client = login('u1')
+    body = client.get('/api/user_data').get_json()
+    commits = fake_db.commits
+
+    response = client.post('/api/user_data', json={'progress': body['progress'], 'version': 'stale'})
+    assert response.get_json()['status'] == 'success'
+    assert response.get_json()['version'] == body['version']
+    assert response.get_json()['progress']['badges'] == ['bronze']
+    assert fake_db.commits == commits
+
+
+QUESTS = {'quests': {'daily': [{
+    'templateId': 'focus', 'title': 'Focus', 'descriptionTemplate': 'Study {N} minutes', 'goalType': 'study_time_added',
+    'targetMin': 30, 'targetMax': 30, 'rewardXp': 20}]}}
+
+
+def test_quest_assignment_on_get_does_not_overwrite_a_concurrent_save(login, fake_db, app_module, monkeypatch):
+    fake_db.document('gamification_config/settings').set(QUESTS)
+    gamification_logic.invalidate_gamification_settings()
+    fake_db.document('users/u1').set({
+        'username': 'ana',
+        'progress': {'xp': 10, 'level': 1, 'sessions': 3, 'total_time': 75, 'streak': 1, 'badges': [], 'activeQuests': []},
+        'leaderboardData': {'username': 'ana', 'totalXp': 10, 'currentStreak': 1, 'level': 1},
+    })
+    read_user_data = app_module.get_user_data
+
+    def read_then_session_lands(user_id):
+        user_data = read_user_data(user_id)
+        fake_db.document('users/u1').update({'progress.xp': 60, 'progress.sessions': 4})  # Another tab's session
+        return user_data
+    monkeypatch.setattr(app_module, 'get_user_data', read_then_session_lands)
+    writes = []
+    fake_db.commit_hook = lambda batch: writes.extend(data for _, _, data, _ in batch)
+
+    body = login('u1').get('/api/user_data').get_json()
+
+    progress = fake_db.dump('users/u1')['progress']
+    assert (progress['xp'], progress['sessions']) == (60, 4)
+    assert [quest['title'] for quest in progress['activeQuests']] == ['Focus']
+    assert list(writes[-1]) == ['progress.activeQuests']
+    assert body['progress']['activeQuests'] == progress['activeQuests']
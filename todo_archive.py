@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+import metrics
+import page_cursor
+from firebase_config import get_db
+
+ARCHIVE_BATCH_LIMIT = 200  # Items moved per transaction; each costs two writes (archive doc + map delete)
+
+
+def parse_completed_at(todo):
+    """completedAt as an aware datetime, or None. Old saves stored naive UTC strings."""
+    completed_at = todo.get('completedAt')
+    if not completed_at:
+        return None
+    parsed = datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def is_expired(todo, cutoff):
+    """
+    True for a Done todo completed before cutoff, i.e. one that belongs in the
+    archive. Done todos without a completedAt never showed in the list, so they go too.
+    """
+    if todo.get('status') != 'Done':
+        return False
+    completed_at = parse_completed_at(todo)
+    return completed_at is None or completed_at <= cutoff
+
+
+def _archive_ref(user_id):
+    return get_db().collection('todo_lists').document(user_id).collection('archive')
+
+
+def archive_page(user_id, limit=50, start_after=None):
+    """
+    One page of a user's archived todos, most recently completed first; todos
+    without a completedAt come last. Items completed at the same moment are
+    ordered by id, so paging never skips one.
+
+    Pass the page's next_cursor as start_after to get the next, older page.
+    Raises ValueError for a cursor this function did not hand out.
+
+    Returns:
+        tuple: (todos, next_cursor) where next_cursor is None on the last page.
+    """
+    snapshots, next_cursor = page_cursor.descending_page(_archive_ref(user_id), 'completedAt', limit, start_after)
+    return [dict(doc.to_dict(), id=doc.id) for doc in snapshots], next_cursor
+
+
+class TodoArchiver:
+    """
+    Moves completed todos out of the hot todo_lists/<uid> document.
+
+    Done items whose completedAt is older than archive_after_days are copied to
+    todo_lists/<uid>/archive/<id> and removed from the 'items' map in the same
+    transaction, so an item is never in both places or in neither. compact()
+    only queues the user; a background thread does the work, and a user already
+    waiting is not queued twice. GET /api/todo_list queues its user whenever it
+    sees an expired item, so the document is compacted the first time someone
+    reads it after items expire.
+    """
+
+    def __init__(self, archive_after_days=30, max_attempts=3):
+        self.archive_after_days = archive_after_days
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self.archived_todos = 0
+        self.compactions = 0
+        self.failures = 0
+        threading.Thread(target=self._run, daemon=True, name='todo-archiver').start()
+
+    def cutoff(self):
+        return datetime.now(timezone.utc) - timedelta(days=self.archive_after_days)
+
+    def compact(self, user_id):
+        """Queues a user's todo document for compaction. Returns immediately."""
+        with self._lock:
+            if user_id in self._queued:
+                return
+            self._queued.add(user_id)
+        self._queue.put((user_id, 1))
+
+    def _archive_batch(self, user_id, cutoff):
+        """Moves up to ARCHIVE_BATCH_LIMIT expired items. Returns (moved, more_left)."""
+        db_client = get_db()
+        todo_ref = db_client.collection('todo_lists').document(user_id)
+        archive_ref = todo_ref.collection('archive')
+
+        @firestore.transactional
+        def move_expired(transaction):
+            todo_doc = todo_ref.get(transaction=transaction)
+            items = ((todo_doc.to_dict() or {}).get('items') or {}) if todo_doc.exists else {}
+            expired = [(todo_id, item) for todo_id, item in items.items() if is_expired(item, cutoff)]
+            batch = expired[:ARCHIVE_BATCH_LIMIT]
+            if not batch:
+                return 0, False
+            archived_at = datetime.now(timezone.utc).isoformat()
+            for todo_id, item in batch:
+                # completedAt is always written (None if the item never had one): archive_page
+                # orders by it, and Firestore leaves documents without the field out of that query
+                transaction.set(archive_ref.document(todo_id),
+                                dict(item, completedAt=item.get('completedAt') or None, archivedAt=archived_at))
+            transaction.update(todo_ref, {f'items.{todo_id}': firestore.DELETE_FIELD for todo_id, _ in batch})
+            return len(batch), len(expired) > len(batch)
+
+        return move_expired(db_client.transaction())
+
+    def archive_user(self, user_id):
+        """Archives every expired todo of one user. Returns how many were moved."""
+        cutoff = self.cutoff()
+        archived = 0
+        more_left = True
+        while more_left:
+            moved, more_left = self._archive_batch(user_id, cutoff)
+            archived += moved
+        return archived
+
+    def _run(self):
+        while True:
+            user_id, attempt = self._queue.get()
+            started_at = time.perf_counter()
+            try:
+                archived = self.archive_user(user_id)
+            except Exception as e:
+                metrics.get_metrics('todo_archive').record(time.perf_counter() - started_at, error=True)
+                with self._lock:
+                    self.failures += 1
+                if attempt < self.max_attempts:
+                    print(f"[TODO ARCHIVE] Error compacting todos of {user_id} (attempt {attempt}), retrying: {e}")
+                    retry_timer = threading.Timer(2 ** attempt, self._queue.put, args=((user_id, attempt + 1),))
+                    retry_timer.daemon = True
+                    retry_timer.start()
+                else:
+                    print(f"[TODO ARCHIVE] Giving up compacting todos of {user_id}: {e}")
+                    with self._lock:
+                        self._queued.discard(user_id)
+                continue
+
+            metrics.get_metrics('todo_archive').record(time.perf_counter() - started_at, todos=archived)
+            if archived:
+                print(f"[TODO ARCHIVE] Archived {archived} completed todos of {user_id}")
+            with self._lock:
+                self._queued.discard(user_id)
+                self.compactions += 1
+                self.archived_todos += archived
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._queued),
+                'compactions': self.compactions,
+                'archived_todos': self.archived_todos,
+                'failures': self.failures,
+            }
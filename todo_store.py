@@ -0,0 +1,258 @@
+import hashlib
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+import metrics
+from firebase_config import get_db
+
+TODO_FIELDS = ('name', 'startDate', 'dueDate', 'status', 'priority', 'effort', 'desc')
+DATE_FIELDS = ('startDate', 'dueDate')
+TODO_ID_PATTERN = re.compile(r'^t[0-9a-f]{16,32}$')  # Also a valid Firestore field path segment
+
+
+class TodoConflict(Exception):
+    """Raised when a todo was changed by someone else since the client last read it."""
+
+    def __init__(self, current):
+        super().__init__("This task was changed on another device.")
+        self.current = current  # The item as it is stored now, so the client can refresh it
+
+
+def parse_version(value):
+    """
+    Reads a todo version sent by a client: a JSON integer or the strong ETag
+    ('"3"') the item endpoints return. Raises ValueError for anything else.
+    """
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith('"') and text.endswith('"') and len(text) >= 2:
+            text = text[1:-1]
+        if text.isascii() and text.isdigit():
+            return int(text)
+    raise ValueError(f"Invalid task version: {value!r}")
+
+
+def new_todo_id():
+    return 't' + uuid.uuid4().hex
+
+
+def legacy_todo_id(todo, index):
+    """Stable id for an item of the old whole-list format, which only had a 'timestamp'."""
+    key = todo.get('timestamp') or f"{index}:{todo.get('name', '')}"
+    return 't' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_todo_fields(fields):
+    """
+    Keeps the known todo fields of a client payload and normalizes only those.
+
+    Dates are re-serialized as ISO 8601 and completedAt follows status, so an
+    update that doesn't touch a date or the status doesn't parse anything.
+    """
+    normalized = {field: fields[field] for field in TODO_FIELDS if field in fields}
+    for field in DATE_FIELDS:
+        if normalized.get(field):
+            normalized[field] = datetime.fromisoformat(normalized[field].replace('Z', '+00:00')).isoformat()
+    if 'status' in normalized:
+        normalized['completedAt'] = datetime.now(timezone.utc).isoformat() if normalized['status'] == 'Done' else None
+    return normalized
+
+
+def _todo_ref(user_id):
+    return get_db().collection('todo_lists').document(user_id)
+
+
+def _legacy_migration(todo_data):
+    """
+    Field updates that move an old 'todos' list into the 'items' map, or {} if
+    there is nothing to migrate. Items already in the map win over legacy ones.
+    """
+    legacy_todos = todo_data.get('todos')
+    if legacy_todos is None:
+        return {}
+    items = todo_data.get('items') or {}
+    updates = {'todos': firestore.DELETE_FIELD}
+    for index, todo in enumerate(legacy_todos):
+        todo_id = legacy_todo_id(todo, index)
+        if todo_id not in items:
+            item = {field: value for field, value in todo.items() if field != 'id'}
+            item['version'] = 1
+            updates[f'items.{todo_id}'] = item
+    return updates
+
+
+def _items_after(todo_data, updates):
+    """The items map as it will be once the given migration updates are applied."""
+    items = dict(todo_data.get('items') or {})
+    for path, value in updates.items():
+        if path.startswith('items.'):
+            items[path[len('items.'):]] = value
+    return items
+
+
+def _as_list(items):
+    todos = [dict(item, id=todo_id) for todo_id, item in items.items()]
+    todos.sort(key=lambda todo: todo.get('timestamp') or '')  # Creation order, like the old list
+    return todos
+
+
+def list_todos(user_id):
+    """Returns every todo of the user as a list of dicts with 'id' and 'version'."""
+    todo_ref = _todo_ref(user_id)
+    todo_doc = todo_ref.get()
+    todo_data = todo_doc.to_dict() if todo_doc.exists else {}
+    if 'todos' in todo_data:
+        migrate_todos(user_id)
+        todo_data = todo_ref.get().to_dict() or {}
+    return _as_list(todo_data.get('items') or {})
+
+
+def migrate_todos(user_id):
+    """Converts a document still in the whole-list format. Safe to call concurrently."""
+    db_client = get_db()
+    todo_ref = _todo_ref(user_id)
+
+    @firestore.transactional
+    def migrate(transaction):
+        todo_doc = todo_ref.get(transaction=transaction)
+        updates = _legacy_migration(todo_doc.to_dict() or {}) if todo_doc.exists else {}
+        if updates:
+            transaction.update(todo_ref, updates)
+        return len(updates) - 1 if updates else 0
+
+    migrated = migrate(db_client.transaction())
+    if migrated:
+        print(f"[TODO] Migrated {migrated} todos of {user_id} to per-item storage")
+
+
+def create_todo(user_id, fields):
+    """Adds one todo with a server-assigned id. Returns the stored item."""
+    started_at = time.perf_counter()
+    item = {field: None for field in TODO_FIELDS}
+    item.update(normalize_todo_fields(fields))
+    item.setdefault('completedAt', None)
+    item['timestamp'] = fields.get('timestamp') or datetime.now(timezone.utc).isoformat()
+    item['version'] = 1
+    todo_id = new_todo_id()
+    # Merging a one-key map writes just this item, whatever else the document holds
+    _todo_ref(user_id).set({'items': {todo_id: item}}, merge=True)
+    metrics.get_metrics('todo_write').record(time.perf_counter() - started_at, created=1)
+    return dict(item, id=todo_id)
+
+
+def update_todo(user_id, todo_id, fields, expected_version=None):
+    """
+    Applies a partial update to one todo.
+
+    Only the changed fields are written (as items.<id>.<field> paths). If
+    expected_version is given and doesn't match the stored version, nothing is
+    written and TodoConflict is raised.
+
+    Returns:
+        dict: The updated item, or None if there is no such todo.
+    """
+    started_at = time.perf_counter()
+    db_client = get_db()
+    todo_ref = _todo_ref(user_id)
+    changes = normalize_todo_fields(fields)
+
+    @firestore.transactional
+    def apply_update(transaction):
+        todo_doc = todo_ref.get(transaction=transaction)
+        if not todo_doc.exists:
+            return None
+        todo_data = todo_doc.to_dict() or {}
+        updates = _legacy_migration(todo_data)
+        item = _items_after(todo_data, updates).get(todo_id)
+        if item is None:
+            return None
+        if expected_version is not None and expected_version != item.get('version', 1):
+            raise TodoConflict(dict(item, id=todo_id))
+        item_changes = dict(changes)
+        if item.get('status') == 'Done' and item_changes.get('status') == 'Done':
+            item_changes.pop('completedAt', None)  # Re-saving a done task keeps its completion time
+        changed = {field: value for field, value in item_changes.items() if item.get(field) != value}
+        if not changed:
+            if updates:
+                transaction.update(todo_ref, updates)
+            return dict(item, id=todo_id)
+        item = dict(item, **changed)
+        item['version'] = item.get('version', 1) + 1
+        if f'items.{todo_id}' in updates:
+            updates[f'items.{todo_id}'] = item  # Freshly migrated: write it whole
+        else:
+            for field, value in changed.items():
+                updates[f'items.{todo_id}.{field}'] = value
+            updates[f'items.{todo_id}.version'] = item['version']
+        transaction.update(todo_ref, updates)
+        return dict(item, id=todo_id)
+
+    try:
+        updated = apply_update(db_client.transaction())
+    except TodoConflict:
+        metrics.get_metrics('todo_write').record(time.perf_counter() - started_at, conflicts=1)
+        raise
+    metrics.get_metrics('todo_write').record(time.perf_counter() - started_at, updated=int(updated is not None))
+    return updated
+
+
+def delete_todo(user_id, todo_id, expected_version=None):
+    """
+    Removes one todo. Raises TodoConflict like update_todo().
+
+    Returns:
+        bool: False if there was no such todo.
+    """
+    started_at = time.perf_counter()
+    db_client = get_db()
+    todo_ref = _todo_ref(user_id)
+
+    @firestore.transactional
+    def apply_delete(transaction):
+        todo_doc = todo_ref.get(transaction=transaction)
+        if not todo_doc.exists:
+            return False
+        todo_data = todo_doc.to_dict() or {}
+        updates = _legacy_migration(todo_data)
+        item = _items_after(todo_data, updates).get(todo_id)
+        if item is None:
+            return False
+        if expected_version is not None and expected_version != item.get('version', 1):
+            raise TodoConflict(dict(item, id=todo_id))
+        updates[f'items.{todo_id}'] = firestore.DELETE_FIELD
+        transaction.update(todo_ref, updates)
+        return True
+
+    try:
+        deleted = apply_delete(db_client.transaction())
+    except TodoConflict:
+        metrics.get_metrics('todo_write').record(time.perf_counter() - started_at, conflicts=1)
+        raise
+    metrics.get_metrics('todo_write').record(time.perf_counter() - started_at, deleted=int(deleted))
+    return deleted
+
+
+def replace_todos(user_id, todos):
+    """
+    Overwrites the whole list (the old POST /api/todo_list contract).
+
+    Items keep their 'id' if they have one; items without get their legacy id.
+    """
+    if not isinstance(todos, list) or not all(isinstance(todo, dict) for todo in todos):
+        raise ValueError("Expected a list of tasks")
+    items = {}
+    for index, todo in enumerate(todos):
+        todo_id = todo.get('id') if TODO_ID_PATTERN.match(str(todo.get('id', ''))) else legacy_todo_id(todo, index)
+        item = {field: value for field, value in todo.items() if field not in TODO_FIELDS and field != 'id'}
+        item.update(normalize_todo_fields(todo))
+        if todo.get('status') == 'Done' and todo.get('completedAt'):
+            item['completedAt'] = todo['completedAt']
+        item['version'] = parse_version(todo.get('version') or 0) + 1
+        items[todo_id] = item
+    _todo_ref(user_id).set({'items': items})